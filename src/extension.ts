@@ -3,7 +3,10 @@
 import * as vscode from "vscode";
 import { commands, InputBoxOptions } from "vscode";
 import { PythonExtension } from "@vscode/python-extension";
-import WebSocket from "ws";
+import * as cp from "child_process";
+import * as fs from "fs";
+import * as net from "net";
+import * as path from "path";
 
 async function get_all_function_names(uri: vscode.Uri): Promise<string[]> {
   const symbols: vscode.DocumentSymbol[] = await commands.executeCommand(
@@ -60,13 +63,170 @@ async function preparePythonEnvironment(
   );
 }
 
-let websocket: WebSocket.Server | undefined = undefined;
+type DaemonAddress = { host: string; port: number; token: string };
+type JobNotification = { method: string; params: { job_id: string; update: any } };
+
+/**
+ * Connection to the pyoptimaizer daemon of this workspace, see pyoptimaizer/daemon.py.
+ *
+ * The daemon is started once and keeps its imports and caches warm between
+ * optimizations. It speaks JSON-RPC 2.0, one message per line, and streams the
+ * progress of every job as notifications.
+ */
+class DaemonClient {
+  private socket: net.Socket | undefined = undefined;
+  private process: cp.ChildProcess | undefined = undefined;
+  private buffer = "";
+  private nextId = 1;
+  private pending = new Map<number, { resolve: (result: any) => void; reject: (error: Error) => void }>();
+  private listeners = new Map<string, (notification: JobNotification) => void>();
+  // notifications of a job can arrive before the response that tells its id
+  private early = new Map<string, JobNotification[]>();
+
+  constructor(
+    private pythonExePath: string,
+    private portFile: string,
+    private output: vscode.OutputChannel
+  ) {}
+
+  private connectTo(address: DaemonAddress): Promise<net.Socket> {
+    return new Promise((resolve, reject) => {
+      const socket = net.createConnection(address.port, address.host);
+      socket.once("connect", () => resolve(socket));
+      socket.once("error", reject);
+    });
+  }
+
+  private readPortFile(): DaemonAddress {
+    return JSON.parse(fs.readFileSync(this.portFile, "utf8"));
+  }
+
+  private start() {
+    fs.rmSync(this.portFile, { force: true });
+    fs.mkdirSync(path.dirname(this.portFile), { recursive: true });
+    this.output.appendLine(`Starting the pyoptimaizer daemon with ${this.pythonExePath}`);
+    this.process = cp.spawn(
+      this.pythonExePath,
+      ["-m", "pyoptimaizer", "--serve", "--port_file", this.portFile],
+      { env: process.env }
+    );
+    this.process.stdout?.on("data", (data) => this.output.append(data.toString()));
+    this.process.stderr?.on("data", (data) => this.output.append(data.toString()));
+    this.process.on("exit", (code) => {
+      this.output.appendLine(`The pyoptimaizer daemon exited with code ${code}`);
+      this.process = undefined;
+    });
+  }
+
+  private async waitForPortFile(timeoutMs = 60000): Promise<DaemonAddress> {
+    const start = Date.now();
+    while (Date.now() - start < timeoutMs) {
+      if (this.process === undefined) {
+        break;
+      }
+      try {
+        return this.readPortFile();
+      } catch {
+        // not written yet
+      }
+      await new Promise((resolve) => setTimeout(resolve, 200));
+    }
+    throw new Error("The pyoptimaizer daemon did not start, see the Optimaize output");
+  }
+
+  async connect(): Promise<void> {
+    if (this.socket) {
+      return;
+    }
+    let socket: net.Socket;
+    let address: DaemonAddress;
+    try {
+      // a daemon of an earlier session may still run
+      address = this.readPortFile();
+      socket = await this.connectTo(address);
+    } catch {
+      this.start();
+      address = await this.waitForPortFile();
+      socket = await this.connectTo(address);
+    }
+    socket.setEncoding("utf8");
+    socket.on("data", (data: string) => this.receive(data));
+    socket.on("close", () => {
+      this.socket = undefined;
+      this.pending.forEach(({ reject }) => reject(new Error("Connection to the pyoptimaizer daemon lost")));
+      this.pending.clear();
+    });
+    this.socket = socket;
+    // the daemon closes connections that do not start with the token of the port file
+    await this.send("authenticate", { token: address.token });
+  }
+
+  private receive(data: string) {
+    this.buffer += data;
+    let newline: number;
+    while ((newline = this.buffer.indexOf("\n")) >= 0) {
+      const message = JSON.parse(this.buffer.slice(0, newline));
+      this.buffer = this.buffer.slice(newline + 1);
+      if (message.id !== undefined && message.id !== null) {
+        const request = this.pending.get(message.id);
+        this.pending.delete(message.id);
+        if (message.error) {
+          request?.reject(new Error(message.error.message));
+        } else {
+          request?.resolve(message.result);
+        }
+        continue;
+      }
+      const notification = message as JobNotification;
+      const listener = this.listeners.get(notification.params.job_id);
+      if (listener) {
+        listener(notification);
+      } else {
+        const queued = this.early.get(notification.params.job_id) ?? [];
+        queued.push(notification);
+        this.early.set(notification.params.job_id, queued);
+      }
+    }
+  }
+
+  async call(method: string, params: object = {}): Promise<any> {
+    await this.connect();
+    return this.send(method, params);
+  }
+
+  private send(method: string, params: object): Promise<any> {
+    const id = this.nextId++;
+    return new Promise((resolve, reject) => {
+      this.pending.set(id, { resolve, reject });
+      this.socket!.write(JSON.stringify({ jsonrpc: "2.0", id, method, params }) + "\n");
+    });
+  }
+
+  onJob(jobId: string, listener: (notification: JobNotification) => void) {
+    this.listeners.set(jobId, listener);
+    (this.early.get(jobId) ?? []).forEach(listener);
+    this.early.delete(jobId);
+  }
+
+  offJob(jobId: string) {
+    this.listeners.delete(jobId);
+  }
+
+  dispose() {
+    this.socket?.destroy();
+    this.process?.kill();
+  }
+}
+
+let daemon: DaemonClient | undefined = undefined;
 
 export function activate(context: vscode.ExtensionContext) {
   console.log('Congratulations, your extension "optimaize" is now active!');
 
   let first_command_done = false;
   let terminal: vscode.Terminal | undefined = undefined;
+  const output = vscode.window.createOutputChannel("Optimaize");
+  context.subscriptions.push(output);
 
   let disposable = vscode.commands.registerCommand(
     "optimaize.cythonize_function",
@@ -110,6 +270,15 @@ export function activate(context: vscode.ExtensionContext) {
       }
 
       let pythonExePath = environment.executable.uri?.fsPath;
+      if (!pythonExePath) {
+        return;
+      }
+      if (daemon === undefined) {
+        // one daemon per workspace, it outlives the panels
+        const storage = context.storageUri ?? context.globalStorageUri;
+        daemon = new DaemonClient(pythonExePath, path.join(storage.fsPath, "daemon.json"), output);
+      }
+      const client = daemon;
 
       for (let symbol of documentSymbols) {
         if (
@@ -128,12 +297,7 @@ export function activate(context: vscode.ExtensionContext) {
             );
 
             const val = await selectTestFunction();
-            const testFilePathstr = "";
-            const testFunctionNamestr = "";
-            if (val) {
-              const testFilePath = val[1].fsPath;
-              const testFunctionName = val[0];
-            }
+            const testFunctions = val ? [`${val[1].fsPath}::${val[0]}`] : [];
 
             //open a webview to show the results
             const panel = vscode.window.createWebviewPanel(
@@ -144,12 +308,21 @@ export function activate(context: vscode.ExtensionContext) {
             );
             // view panel and put on the right side
             panel.reveal(vscode.ViewColumn.Two);
+            // deltas that arrive before the shell has loaded are queued until it is ready
+            let shellReady = false;
+            let queuedDeltas: unknown[] = [];
+            let jobId: string | undefined = undefined;
             // receive panel messages
             panel.webview.onDidReceiveMessage(
               ({message_type, message_data}) => {
                 console.log(`Received message from webview: ${message_type}`);
-                if (message_type === "stop") {
-                  terminal?.sendText("exit");
+                if (message_type === "ready") {
+                  shellReady = true;
+                  queuedDeltas.forEach((delta) => panel.webview.postMessage(delta));
+                  queuedDeltas = [];
+                }
+                if (message_type === "stop" && jobId !== undefined) {
+                  client.call("cancel", { job_id: jobId });
                 }
                 if (message_type === "open_code_file") {
                   vscode.workspace.openTextDocument(message_data).then(doc => {
@@ -159,11 +332,10 @@ export function activate(context: vscode.ExtensionContext) {
                 if (message_type === "accept") {
                   const optimized_path = message_data;
                   const original_path = doc.uri.fsPath;
-                  const new_path = original_path.replace(".py", "_optimized.pyx");
-                  // log all
-                  console.log(`Optimized path: ${optimized_path}, original path: ${original_path}, new path: ${new_path}`);
-                  // move the optimized file to the original file path
-                  vscode.workspace.fs.copy(vscode.Uri.file(optimized_path), vscode.Uri.file(new_path), {overwrite: true});
+                  client.call("accept", { candidate_path: optimized_path, original_path }).then(
+                    ({ path }) => vscode.window.showInformationMessage(`Saved the optimized function as ${path}`),
+                    (error) => vscode.window.showErrorMessage(`Could not accept ${optimized_path}: ${error.message}`)
+                  );
                   return;
                 }
 
@@ -172,34 +344,44 @@ export function activate(context: vscode.ExtensionContext) {
               context.subscriptions
             );
 
-            // create a websocket server to listen for the results
-            // and send them to the webview
-            console.log("Starting websocket server");
-            if (websocket) {
-              websocket.close();
-              websocket = undefined;
-            }
+            const onUpdate = ({ method, params }: JobNotification) => {
+              const update = params.update;
+              if (method === "finished") {
+                client.offJob(params.job_id);
+                if (update.state === "failed") {
+                  vscode.window.showErrorMessage(`Optimizing ${the_name} failed: ${update.error}`);
+                }
+                return;
+              }
+              // the page is sent once as a shell, after that only deltas are posted to it
+              if (update.type === "shell") {
+                shellReady = false;
+                queuedDeltas = [];
+                panel.reveal(vscode.ViewColumn.Two);
+                panel.webview.html = update.html;
+              } else if (shellReady) {
+                panel.webview.postMessage(update);
+              } else {
+                queuedDeltas.push(update);
+              }
+            };
+            panel.onDidDispose(() => {
+              if (jobId !== undefined) {
+                client.offJob(jobId);
+              }
+            });
 
-            if (!websocket) {
-              websocket = new WebSocket.Server({ port: 8085 });
-              websocket.on("connection", (ws) => {
-                ws.on("message", (message) => {
-                  console.log(`Received message => ${message}`);
-                  panel.reveal(vscode.ViewColumn.Two);
-                  panel.webview.html = message.toString();
-                });
-
-                ws.on("close", () => {
-                  console.log("Client disconnected");
-                });
+            // the daemon runs the optimization and streams its progress back
+            try {
+              const job = await client.call("optimize", {
+                function_path: `${doc.fileName}::${the_name}`,
+                test_functions: testFunctions,
               });
+              jobId = job.job_id as string;
+              client.onJob(jobId, onUpdate);
+            } catch (error: any) {
+              vscode.window.showErrorMessage(`Could not start optimizing ${the_name}: ${error.message}`);
             }
-            
-            // execute python
-            terminal.sendText(
-              `"${pythonExePath}" -m pyoptimaizer "${doc.fileName}::${the_name}" "${testFilePathstr}" "${testFunctionNamestr}"`
-            );
-
           }
         }
       }
@@ -257,4 +439,6 @@ async function selectTestFunction(): Promise<[string, vscode.Uri] | undefined> {
 }
 
 // This method is called when your extension is deactivated
-export function deactivate() {}
+export function deactivate() {
+  daemon?.dispose();
+}
@@ -1,19 +1,125 @@
 import argparse
+import shlex
 import sys
+from pathlib import Path
+from pyoptimaizer.backends import BACKENDS
+from pyoptimaizer.evolution import EvolutionConfig
+from pyoptimaizer.hotspots import optimize_hotspots
+from pyoptimaizer.html_display import configure_reporting
+from pyoptimaizer.objectives import ObjectiveConfig
 from pyoptimaizer.optimize import cythonize_function
+from pyoptimaizer.parallel import ParallelConfig
+from pyoptimaizer.pipeline import cythonize_function_pipelined
+from pyoptimaizer.reporter import JsonlSink
+from pyoptimaizer.scaling import ScalingConfig
+from pyoptimaizer.throughput import RANKING_KEYS, ThroughputConfig
 # Desc: Main file for python_optimaizer
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     # pythom -m optimaizer /path/to/file::function_name /path_to_test_1::function_name /path_to_test_2::function_name ...
-    parser.add_argument('function_to_optimize', type=str, help='Path to file with function')
-    parser.add_argument('test_functions', type=str, nargs='+', help='Path to file with test functions')
+    parser.add_argument('function_to_optimize', type=str, nargs='?', help='Path to file with function')
+    parser.add_argument('test_functions', type=str, nargs='*', help='Path to file with test functions')
     # openai url
     parser.add_argument('--openai_url', type=str, default='https://api.openai.com/v1/engines/davinci/completions', help='Openai url')
+    # overlap test generation, llm requests, compiles and benchmarks
+    parser.add_argument('--pipelined', action='store_true', help='Run all optimization stages concurrently')
+    # python -m optimaizer --profile "-m pytest tests" --top_n 3
+    parser.add_argument('--profile', type=str, help='Python command to profile, its hotspots are optimized')
+    parser.add_argument('--project_root', type=str, default='.', help='Only functions under this directory are optimized')
+    parser.add_argument('--top_n', type=int, default=3, help='Number of hotspots to optimize')
+    parser.add_argument('--sort_by', type=str, default='cumulative', choices=['cumulative', 'self'], help='Rank hotspots by')
+    # time candidates over growing inputs, from workload_<file>.py or an llm generated one
+    parser.add_argument('--scaling', action='store_true', help='Measure how the runtime of every candidate scales with the input size')
+    parser.add_argument('--target_size', type=int, help='Refine the candidate that is fastest at this input size, implies --scaling')
+    # trade runtime against peak memory
+    parser.add_argument('--objective', type=str, default='runtime', choices=['runtime', 'pareto', 'weighted'], help='Rank candidates by runtime, by the pareto front of runtime and memory, or by a weighted score')
+    parser.add_argument('--memory_weight', type=float, default=1.0, help='Weight of the peak memory relative to the runtime with --objective weighted')
+    # let candidates of several backends compete, e.g. --backends cython numpy
+    parser.add_argument('--backends', type=str, nargs='+', default=['cython'], choices=list(BACKENDS), help='Backends that generate candidates')
+    # multi-threaded OpenMP candidates, benchmarked on 1, 2, 4, ... threads
+    parser.add_argument('--parallel', action='store_true', help='Also generate OpenMP candidates that use prange')
+    parser.add_argument('--max_threads', type=int, help='Largest number of threads to benchmark with --parallel, defaults to all cores')
+    parser.add_argument('--prefer', type=str, default='many', choices=['single', 'many'], help='Refine the best single-thread or the best many-thread candidate with --parallel')
+    # throughput with many threads calling the function at once, e.g. from a web server
+    parser.add_argument('--throughput_threads', type=int, nargs='+', help='Measure the calls per second with these numbers of concurrent callers')
+    parser.add_argument('--rank_by', type=str, default='runtime', choices=list(RANKING_KEYS), help='Refine the candidate with the best single call runtime or the best concurrent throughput')
+    # population based search instead of refining the best candidate
+    parser.add_argument('--evolve', action='store_true', help='Evolve a population with crossover and mutation instead of refining the best candidate')
+    parser.add_argument('--generations', type=int, default=5, help='Maximum number of generations with --evolve')
+    parser.add_argument('--time_budget', type=float, help='Stop evolving after this many seconds')
+    parser.add_argument('--token_budget', type=int, help='Stop evolving after this many LLM tokens')
+    parser.add_argument('--warm_start', type=int, default=2, help='Start from this many best candidates of earlier runs, 0 to start from nothing')
+    parser.add_argument('--beam_width', type=int, default=1, help='Refine the best k candidates of every generation concurrently')
+    # a long-lived process that takes jobs over a local socket, e.g. from the VS Code extension
+    parser.add_argument('--serve', action='store_true', help='Run as a daemon that accepts JSON-RPC requests on a local socket')
+    parser.add_argument('--port', type=int, default=0, help='Port of the daemon, 0 picks a free one')
+    parser.add_argument('--port_file', type=str, help='File the daemon writes its port and access token to, required with --serve')
+    parser.add_argument('--max_jobs', type=int, default=2, help='Number of jobs the daemon runs at once')
+    parser.add_argument('--report_jsonl', type=str, help='Write the UI updates to this JSONL file instead of sending them to VS Code')
     args = parser.parse_args(sys.argv[1:])
+    if args.report_jsonl:
+        configure_reporting(JsonlSink(args.report_jsonl))
+
+    if args.serve:
+        if not args.port_file:
+            parser.error('--serve needs --port_file, clients read the access token from it')
+        # imported lazily, only the daemon needs the socket server and the job processes
+        from pyoptimaizer.daemon import serve
+
+        serve(args.port_file, port=args.port, max_jobs=args.max_jobs)
+        sys.exit(0)
+
+    if args.profile:
+        optimize_hotspots(
+            shlex.split(args.profile),
+            Path(args.project_root).resolve(),
+            args.top_n,
+            args.sort_by,
+            optimize=cythonize_function_pipelined if args.pipelined else cythonize_function,
+        )
+        sys.exit(0)
+    if args.function_to_optimize is None:
+        parser.error('function_to_optimize is required without --profile')
     
+    scaling_config = None
+    if args.scaling or args.target_size is not None:
+        if args.pipelined:
+            parser.error('--scaling and --target_size are not supported with --pipelined')
+        scaling_config = ScalingConfig(target_size=args.target_size)
+
+    objectives = ObjectiveConfig(mode=args.objective, memory_weight=args.memory_weight)
+    if args.pipelined and args.objective != 'runtime':
+        parser.error('--objective is not supported with --pipelined')
+
+    parallel = None
+    if args.parallel:
+        if args.pipelined:
+            parser.error('--parallel is not supported with --pipelined')
+        parallel = ParallelConfig(max_threads=args.max_threads, prefer=args.prefer)
+
+    throughput = None
+    if args.throughput_threads or args.rank_by != 'runtime':
+        if args.pipelined:
+            parser.error('--throughput_threads and --rank_by are not supported with --pipelined')
+        throughput = ThroughputConfig(threads=args.throughput_threads)
+
+    evolution = None
+    if args.evolve:
+        if args.pipelined:
+            parser.error('--evolve is not supported with --pipelined')
+        evolution = EvolutionConfig(max_generations=args.generations, time_budget_s=args.time_budget, token_budget=args.token_budget)
+
+    if args.beam_width < 1:
+        parser.error('--beam_width must be at least 1')
+    if args.beam_width > 1 and (args.pipelined or args.evolve):
+        parser.error('--beam_width is not supported with --pipelined or --evolve')
+
     function_to_optimize = args.function_to_optimize
     test_functions = args.test_functions if len(args.test_functions)>0 else []
     print(f"Optimizing function: {function_to_optimize}", f"Test functions: {test_functions}")
-    cythonize_function(function_to_optimize, test_functions)
\ No newline at end of file
+    if args.pipelined:
+        cythonize_function_pipelined(function_to_optimize, test_functions, backends=args.backends, warm_start=args.warm_start)
+    else:
+        cythonize_function(function_to_optimize, test_functions, scaling_config=scaling_config, objectives=objectives, backends=args.backends, parallel=parallel, throughput=throughput, rank_by=args.rank_by, evolution=evolution, beam_width=args.beam_width, warm_start=args.warm_start)
\ No newline at end of file
@@ -0,0 +1,58 @@
+/* Counts the allocations of the Python allocators, see memory.allocation_counter.
+ * The hooks call the allocators they replace, so they can be installed at runtime.
+ * Loaded with ctypes.PyDLL, so start and stop run with the GIL held. */
+#include <Python.h>
+
+static const PyMemAllocatorDomain domains[3] = {PYMEM_DOMAIN_RAW, PYMEM_DOMAIN_MEM, PYMEM_DOMAIN_OBJ};
+static PyMemAllocatorEx originals[3];
+static unsigned long long allocations = 0;
+static int counting = 0;
+
+/* the raw domain is also used without the GIL */
+#define COUNT() __atomic_fetch_add(&allocations, 1, __ATOMIC_RELAXED)
+
+static void *counting_malloc(void *ctx, size_t size) {
+    PyMemAllocatorEx *original = (PyMemAllocatorEx *)ctx;
+    COUNT();
+    return original->malloc(original->ctx, size);
+}
+
+static void *counting_calloc(void *ctx, size_t nelem, size_t elsize) {
+    PyMemAllocatorEx *original = (PyMemAllocatorEx *)ctx;
+    COUNT();
+    return original->calloc(original->ctx, nelem, elsize);
+}
+
+static void *counting_realloc(void *ctx, void *ptr, size_t new_size) {
+    PyMemAllocatorEx *original = (PyMemAllocatorEx *)ctx;
+    COUNT();
+    return original->realloc(original->ctx, ptr, new_size);
+}
+
+static void counting_free(void *ctx, void *ptr) {
+    PyMemAllocatorEx *original = (PyMemAllocatorEx *)ctx;
+    original->free(original->ctx, ptr);
+}
+
+void start(void) {
+    if (counting) {
+        return;
+    }
+    for (int i = 0; i < 3; i++) {
+        PyMem_GetAllocator(domains[i], &originals[i]);
+        PyMemAllocatorEx hook = {&originals[i], counting_malloc, counting_calloc, counting_realloc, counting_free};
+        PyMem_SetAllocator(domains[i], &hook);
+    }
+    allocations = 0;
+    counting = 1;
+}
+
+unsigned long long stop(void) {
+    if (counting) {
+        for (int i = 0; i < 3; i++) {
+            PyMem_SetAllocator(domains[i], &originals[i]);
+        }
+        counting = 0;
+    }
+    return __atomic_load_n(&allocations, __ATOMIC_RELAXED);
+}
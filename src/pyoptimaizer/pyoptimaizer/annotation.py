@@ -0,0 +1,116 @@
+import html
+import re
+from pathlib import Path
+from typing import List, Optional, Union
+
+from pyoptimaizer.types import AnnotatedLine, CythonAnnotation
+
+# a source line of the annotation, optionally followed by the C code it compiles to
+_LINE_PATTERN = re.compile(
+    r'<pre class="cython line score-(\d+)"[^>]*>(.*?)</pre>\s*'
+    r"(?:<pre class=['\"]cython code score-\d+ ?['\"]>(.*?)</pre>)?",
+    re.S,
+)
+_TAG_PATTERN = re.compile(r"<[^>]+>")
+# "+12: " or a non-breaking space for lines without code in front of the source
+_LINE_NUMBER_PATTERN = re.compile(r"^[+\xa0]?(\d+): ?")
+
+# substrings of the generated C code, and what they say about the cython source
+_HINTS = [
+    (
+        ("PyObject_GetIter", "__Pyx_PyObject_GetIterNextFunc", "PyIter_Next"),
+        "iterates over a Python object: loop over a typed range or memoryview instead",
+    ),
+    (
+        ("PyNumber_", "__Pyx_PyLong_", "__Pyx_PyInt_", "PyFloat_FromDouble", "PyLong_From", "__Pyx_PyFloat_"),
+        "boxed arithmetic or conversions on Python objects: declare the variables with cdef types",
+    ),
+    (
+        ("__Pyx_RaiseBufferIndexError",),
+        "bounds checked indexing: disable it with @cython.boundscheck(False) once indices are known to be valid",
+    ),
+    (
+        ("ZeroDivisionError",),
+        "division by zero check: disable it with @cython.cdivision(True)",
+    ),
+    (
+        ("__Pyx_GetModuleGlobalName", "__Pyx_PyObject_GetAttrStr", "__Pyx_GetBuiltinName"),
+        "looks up a Python global or attribute: cimport it or hoist the lookup out of loops",
+    ),
+    (
+        ("__Pyx_PyObject_Call", "__Pyx_PyObject_FastCall", "PyObject_Call"),
+        "calls a Python function: call a cdef function or a C library function instead",
+    ),
+    (
+        ("PyList_Append", "__Pyx_PyList_Append", "PyList_New", "PyDict_", "PyTuple_New"),
+        "builds a Python container: write into a preallocated typed buffer instead",
+    ),
+]
+# wrap around of negative indices shows up as a check of the index against zero
+_WRAPAROUND_PATTERN = re.compile(r"if \(__pyx_t_\d+ < 0\) \{?\s*__pyx_t_\d+ \+=")
+_WRAPAROUND_HINT = "negative index wrap around: disable it with @cython.wraparound(False)"
+
+# lines whose Python interaction is the price of being callable from Python
+_UNAVOIDABLE_PREFIXES = ("def ", "cpdef ", "import ", "from ", "cimport ", "@")
+
+
+def _text(fragment: str) -> str:
+    return html.unescape(_TAG_PATTERN.sub("", fragment))
+
+
+def line_hints(c_code: str) -> List[str]:
+    """Guess why a line interacts with Python, from the C code it compiles to."""
+    hints = [hint for markers, hint in _HINTS if any(marker in c_code for marker in markers)]
+    if _WRAPAROUND_PATTERN.search(c_code):
+        hints.append(_WRAPAROUND_HINT)
+    return hints
+
+
+def parse_annotation_html(annotation_html: str) -> CythonAnnotation:
+    """Parse the html written by `cythonize -a` into the lines that still interact with Python."""
+    lines = []
+    for match in _LINE_PATTERN.finditer(annotation_html):
+        score = int(match.group(1))
+        if score == 0:
+            continue
+        source = _text(match.group(2))
+        number = _LINE_NUMBER_PATTERN.match(source)
+        if number is None:
+            continue
+        lines.append(
+            AnnotatedLine(
+                line_number=int(number.group(1)),
+                score=score,
+                source=source[number.end() :].rstrip(),
+                hints=line_hints(_text(match.group(3) or "")),
+            )
+        )
+    return CythonAnnotation(lines=lines)
+
+
+def read_annotation(pyx_path: Union[str, Path]) -> Optional[CythonAnnotation]:
+    """Read the annotation next to a compiled pyx file, None if there is none."""
+    annotation_path = Path(pyx_path).with_suffix(".html")
+    if not annotation_path.exists():
+        return None
+    return parse_annotation_html(annotation_path.read_text(errors="replace"))
+
+
+def worst_lines(annotation: Optional[CythonAnnotation], n: int = 5) -> List[AnnotatedLine]:
+    """The n lines with the most Python interaction that could be removed, worst first.
+    Function signatures and imports are left out, converting arguments is unavoidable there."""
+    if annotation is None:
+        return []
+    candidates = [line for line in annotation.lines if not line.source.lstrip().startswith(_UNAVOIDABLE_PREFIXES)]
+    return sorted(candidates, key=lambda line: -line.score)[:n]
+
+
+def annotation_feedback(annotation: Optional[CythonAnnotation]) -> Optional[str]:
+    """Feedback pointing the refinement at the remaining Python interaction, None when there is none."""
+    lines = worst_lines(annotation)
+    if not lines:
+        return None
+    return (
+        "The lines in python_interaction still call into the Python C-API. "
+        "Remove this overhead first, starting with the highest score"
+    )
@@ -1,9 +1,14 @@
 from loguru import logger
-from pydantic import BaseModel
-from typing import List, Optional, Tuple
-import openai
-from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from pydantic import AliasChoices, BaseModel, Field
+from typing import TYPE_CHECKING, List, Optional, Tuple
+from pyoptimaizer.backends import get_backend
+from pyoptimaizer.llm_cache import LLMResponseCache, request_key
 from pyoptimaizer.prompt import read_instruction_template
+from pyoptimaizer.types import AnnotatedLine, BuildConfig, Lineage
+
+if TYPE_CHECKING:
+    import openai
+    from openai.types.chat import ChatCompletion, ChatCompletionMessage
 
 
 class AssistantCodeOptimizationQuery(BaseModel):
@@ -13,10 +18,21 @@ class AssistantCodeOptimizationQuery(BaseModel):
     number_of_optimizations: int = 1
 
 
+class AssistantCodeCrossoverQuery(AssistantCodeOptimizationQuery):
+    # earlier solutions to combine, each a complete candidate file
+    parent_solutions: List[str]
+
+
 class AssistantCodeOptimizationResult(BaseModel):
     reasoning: str
-    cython_function: str
+    # the optimized code, whatever the backend; templates of other backends call it optimized_function
+    cython_function: str = Field(validation_alias=AliasChoices("cython_function", "optimized_function"))
     import_statements: List[str]
+    # set by the assistant and the search, not by the LLM
+    backend: str = "cython"
+    lineage: Lineage = Field(default_factory=Lineage)
+    # flags and directives the code already has a header for, e.g. of a warm-start seed
+    build_config: Optional[BuildConfig] = None
 
 class AssistantCodeOptimizationResults(BaseModel):
     optimized_functions: List[AssistantCodeOptimizationResult]
@@ -26,6 +42,8 @@ class AssistantCodeOptimizationRefineQuery(BaseModel):
     test_that_failed_src: str
     runtime_ms: float
     user_feedback: str
+    # lines of the previous submission that still call into the Python C-API, worst first
+    python_interaction: List[AnnotatedLine] = []
 
 
 class AssistantCodeTestCreateQuery(BaseModel):
@@ -40,6 +58,16 @@ class AssistantCodeTestCreateResult(BaseModel):
     new_tests: List[str]
 
 
+class AssistantWorkloadQuery(BaseModel):
+    import_statements: List[str]
+    python_function: str
+
+
+class AssistantWorkloadResult(BaseModel):
+    import_statements: List[str]
+    make_arguments: str
+
+
 class OpenAIAssistant:
     def __init__(
         self,
@@ -48,6 +76,7 @@ class OpenAIAssistant:
         openai_api_key: Optional[str] = None,
         openai_org_id: Optional[str] = None,
         default_model: str = "gpt-4o",
+        response_cache: Optional[LLMResponseCache] = None,
         **kwargs
     ):
         """If any of the parameters are none, they will be taken from environment variables.
@@ -58,6 +87,7 @@ class OpenAIAssistant:
             openai_url (str, optional): Openai url. Defaults to None.
             openai_api_key (str, optional): Openai api key. Defaults to None.
             openai_org_id (str, optional): Openai org id. Defaults to None.
+            response_cache (LLMResponseCache, optional): Cache of LLM responses. Defaults to the user-wide cache.
             kwargs: Additional arguments to pass to openai.OpenAI
         """
 
@@ -65,28 +95,100 @@ class OpenAIAssistant:
 
         self.model_preamble = model_preamble
 
-        self._openai_api = openai.OpenAI(
+        self._client_kwargs = dict(
             base_url=openai_url,
             api_key=openai_api_key,
             organization=openai_org_id,
             **kwargs
         )
+        self.response_cache = response_cache or LLMResponseCache()
+        # requests and tokens that were not answered from the cache, for budgets
+        self.requests_made = 0
+        self.tokens_used = 0
+        self._openai_api: Optional["openai.OpenAI"] = None
+        self._openai_async_api: Optional["openai.AsyncOpenAI"] = None
+
+    @property
+    def openai_api(self) -> "openai.OpenAI":
+        """Client, created on first use so replaying from the cache works without credentials."""
+        if self._openai_api is None:
+            # imported lazily, openai is the slowest import of the package
+            import openai
+
+            self._openai_api = openai.OpenAI(**self._client_kwargs)
+        return self._openai_api
+
+    @property
+    def openai_async_api(self) -> "openai.AsyncOpenAI":
+        """Async client, created on first use so it binds to the running event loop."""
+        if self._openai_async_api is None:
+            import openai
+
+            self._openai_async_api = openai.AsyncOpenAI(**self._client_kwargs)
+        return self._openai_async_api
+
+    def _request(self, messages: List, choices: int, seed: Optional[int]) -> dict:
+        request = dict(
+            messages=messages,
+            model=self.default_model,
+            response_format={"type": "json_object"},
+            n=choices,
+        )
+        if seed is not None:
+            request["seed"] = seed
+        return request
+
+    def _cache_key(self, request: dict) -> str:
+        return request_key(
+            request["model"],
+            request["messages"],
+            request["n"],
+            request["response_format"],
+            request.get("seed"),
+        )
 
-
-class CythonCodeOptimizerAssistant(OpenAIAssistant):
-    def __init__(self, **kwargs):
-        model_preamble = read_instruction_template("cython_code_optimizer", "v1")
+    def _create_completion(self, messages: List, choices: int, seed: Optional[int] = None) -> "ChatCompletion":
+        request = self._request(messages, choices, seed)
+        key = self._cache_key(request)
+        completion = self.response_cache.lookup(key)
+        if completion is None:
+            completion = self.openai_api.chat.completions.create(**request)  # type: ignore
+            self.response_cache.store(key, completion)
+            self._count_usage(completion)
+        return completion
+
+    async def _create_completion_async(
+        self, messages: List, choices: int, seed: Optional[int] = None
+    ) -> "ChatCompletion":
+        request = self._request(messages, choices, seed)
+        key = self._cache_key(request)
+        completion = self.response_cache.lookup(key)
+        if completion is None:
+            completion = await self.openai_async_api.chat.completions.create(**request)  # type: ignore
+            self.response_cache.store(key, completion)
+            self._count_usage(completion)
+        return completion
+
+    def _count_usage(self, completion: "ChatCompletion"):
+        self.requests_made += 1
+        if completion.usage is not None:
+            self.tokens_used += completion.usage.total_tokens
+
+
+class CodeOptimizerAssistant(OpenAIAssistant):
+    """Rewrites a function for one of the backends, see backends."""
+
+    def __init__(self, backend: str = "cython", **kwargs):
+        self.backend = get_backend(backend)
+        model_preamble = read_instruction_template(*self.backend.template)
         super().__init__(model_preamble=model_preamble, **kwargs)
 
-    def optimize_code_initial(
+    def _initial_messages(
         self,
         code: str,
-        test_code: List[str] = [],
-        choices: int = 1,
-        import_statements: List[str] = [],
-    ) -> List[Tuple[AssistantCodeOptimizationResult, List[ChatCompletionMessage]]]:
-        """Optimize the code using the assistant."""
-
+        test_code: List[str],
+        import_statements: List[str],
+    ) -> List:
         llm_query = AssistantCodeOptimizationQuery(
             python_code=code,
             python_tests=test_code,
@@ -97,61 +199,53 @@ class CythonCodeOptimizerAssistant(OpenAIAssistant):
         llm_query_json = llm_query.model_dump_json()
         code_message = {"role": "user", "content": llm_query_json}
 
-        messages = self.model_preamble + [code_message]
-        
-        completion = self._openai_api.chat.completions.create(
-            messages=messages,
-            model=self.default_model,
-            response_format={"type": "json_object"},
-            n=choices,
-        )  # type: ignore
+        return self.model_preamble + [code_message]
 
-        results = []
-        for choice in completion.choices:
-            # parse with pydantic
-            assert choice.message.content is not None
-            try:
-                nestedresult = AssistantCodeOptimizationResults.model_validate_json(
-                    choice.message.content
-                )
-                for result in nestedresult.optimized_functions:
-                    results.append((result, messages + [choice.message]))
-            except Exception as e:
-                logger.error("Error parsing result from CodeOptimizationLLM")
-                logger.exception(e)
+    def _crossover_messages(
+        self,
+        code: str,
+        parent_solutions: List[str],
+        test_code: List[str],
+        import_statements: List[str],
+    ) -> List:
+        llm_query = AssistantCodeCrossoverQuery(
+            python_code=code,
+            python_tests=test_code,
+            import_statements=import_statements,
+            number_of_optimizations=1,
+            parent_solutions=parent_solutions,
+        )
 
-        return results
-    
-    def refine_code(
+        llm_query_json = llm_query.model_dump_json()
+        code_message = {"role": "user", "content": llm_query_json}
+
+        return self.model_preamble + [code_message]
+
+    def _refine_messages(
         self,
         error: str,
         test_that_failed_src: str,
         runtime_ms: float,
         user_feedback: str,
-        choices: int = 4,
-        previous_messages: List[ChatCompletionMessage] = [],
-        ) -> List[Tuple[AssistantCodeOptimizationResult, List[ChatCompletionMessage]]]:
-        """Refine the code using the assistant."""
-
+        previous_messages: List["ChatCompletionMessage"],
+        python_interaction: List[AnnotatedLine] = [],
+    ) -> List:
         llm_query = AssistantCodeOptimizationRefineQuery(
             error=error,
             test_that_failed_src=test_that_failed_src,
             runtime_ms=runtime_ms,
             user_feedback=user_feedback,
+            python_interaction=python_interaction,
         )
 
         llm_query_json = llm_query.model_dump_json()
         code_message = {"role": "user", "content": llm_query_json}
 
-        messages = self.model_preamble + previous_messages + [code_message]
-        
-        completion = self._openai_api.chat.completions.create(
-            messages=messages,
-            model=self.default_model,
-            response_format={"type": "json_object"},
-            n=choices,
-        )
+        return self.model_preamble + previous_messages + [code_message]
 
+    def _parse_completion(
+        self, completion: "ChatCompletion", messages: List
+    ) -> List[Tuple[AssistantCodeOptimizationResult, List["ChatCompletionMessage"]]]:
         results = []
         for choice in completion.choices:
             # parse with pydantic
@@ -161,6 +255,7 @@ class CythonCodeOptimizerAssistant(OpenAIAssistant):
                     choice.message.content
                 )
                 for result in nestedresult.optimized_functions:
+                    result.backend = self.backend.name
                     results.append((result, messages + [choice.message]))
             except Exception as e:
                 logger.error("Error parsing result from CodeOptimizationLLM")
@@ -168,24 +263,100 @@ class CythonCodeOptimizerAssistant(OpenAIAssistant):
 
         return results
 
+    def optimize_code_initial(
+        self,
+        code: str,
+        test_code: List[str] = [],
+        choices: int = 1,
+        import_statements: List[str] = [],
+        seed: Optional[int] = None,
+    ) -> List[Tuple[AssistantCodeOptimizationResult, List["ChatCompletionMessage"]]]:
+        """Optimize the code using the assistant.
+        Requests with a different seed are answered and cached separately."""
+        messages = self._initial_messages(code, test_code, import_statements)
+        completion = self._create_completion(messages, choices, seed)
+        return self._parse_completion(completion, messages)
+
+    async def optimize_code_initial_async(
+        self,
+        code: str,
+        test_code: List[str] = [],
+        choices: int = 1,
+        import_statements: List[str] = [],
+        seed: Optional[int] = None,
+    ) -> List[Tuple[AssistantCodeOptimizationResult, List["ChatCompletionMessage"]]]:
+        """Optimize the code using the assistant, without blocking the event loop."""
+        messages = self._initial_messages(code, test_code, import_statements)
+        completion = await self._create_completion_async(messages, choices, seed)
+        return self._parse_completion(completion, messages)
+    
+    async def crossover_code_async(
+        self,
+        code: str,
+        parent_solutions: List[str],
+        test_code: List[str] = [],
+        choices: int = 1,
+        import_statements: List[str] = [],
+    ) -> List[Tuple[AssistantCodeOptimizationResult, List["ChatCompletionMessage"]]]:
+        """Combine earlier solutions into a new one, in a new conversation, without blocking the event loop."""
+        messages = self._crossover_messages(code, parent_solutions, test_code, import_statements)
+        completion = await self._create_completion_async(messages, choices)
+        return self._parse_completion(completion, messages)
+
+    def refine_code(
+        self,
+        error: str,
+        test_that_failed_src: str,
+        runtime_ms: float,
+        user_feedback: str,
+        choices: int = 4,
+        previous_messages: List["ChatCompletionMessage"] = [],
+        python_interaction: List[AnnotatedLine] = [],
+        ) -> List[Tuple[AssistantCodeOptimizationResult, List["ChatCompletionMessage"]]]:
+        """Refine the code using the assistant."""
+        messages = self._refine_messages(
+            error, test_that_failed_src, runtime_ms, user_feedback, previous_messages, python_interaction
+        )
+        completion = self._create_completion(messages, choices)
+        return self._parse_completion(completion, messages)
+
+    async def refine_code_async(
+        self,
+        error: str,
+        test_that_failed_src: str,
+        runtime_ms: float,
+        user_feedback: str,
+        choices: int = 4,
+        previous_messages: List["ChatCompletionMessage"] = [],
+        python_interaction: List[AnnotatedLine] = [],
+        ) -> List[Tuple[AssistantCodeOptimizationResult, List["ChatCompletionMessage"]]]:
+        """Refine the code using the assistant, without blocking the event loop."""
+        messages = self._refine_messages(
+            error, test_that_failed_src, runtime_ms, user_feedback, previous_messages, python_interaction
+        )
+        completion = await self._create_completion_async(messages, choices)
+        return self._parse_completion(completion, messages)
+
 
 
 
+class CythonCodeOptimizerAssistant(CodeOptimizerAssistant):
+    def __init__(self, **kwargs):
+        super().__init__(backend="cython", **kwargs)
+
+
 class PythonTestCreatorAssistant(OpenAIAssistant):
     def __init__(self, **kwargs):
         model_preamble = read_instruction_template("python_test_creator", "v1")
         super().__init__(model_preamble=model_preamble, **kwargs)
 
-    def create_tests(
+    def _test_messages(
         self,
         import_statements: List[str],
         python_function: str,
         number_of_tests_to_generate: int,
         existing_tests: List[str],
-        choices: int = 1,
-    ) -> List[AssistantCodeTestCreateResult]:
-        """Create tests for the code using the assistant."""
-
+    ) -> List:
         llm_query = AssistantCodeTestCreateQuery(
             import_statements=import_statements,
             python_function=python_function,
@@ -196,15 +367,9 @@ class PythonTestCreatorAssistant(OpenAIAssistant):
         llm_query_json = llm_query.model_dump_json()
         code_message = {"role": "user", "content": llm_query_json}
 
-        messages = self.model_preamble + [code_message]
-
-        completion = self._openai_api.chat.completions.create(
-            messages=messages,
-            model=self.default_model,
-            response_format={"type": "json_object"},
-            n=choices,
-        )  # type: ignore
+        return self.model_preamble + [code_message]
 
+    def _parse_completion(self, completion: "ChatCompletion") -> List[AssistantCodeTestCreateResult]:
         results: List[AssistantCodeTestCreateResult] = []
         for choice in completion.choices:
             # parse with pydantic
@@ -220,3 +385,68 @@ class PythonTestCreatorAssistant(OpenAIAssistant):
             
 
         return results
+
+    def create_tests(
+        self,
+        import_statements: List[str],
+        python_function: str,
+        number_of_tests_to_generate: int,
+        existing_tests: List[str],
+        choices: int = 1,
+    ) -> List[AssistantCodeTestCreateResult]:
+        """Create tests for the code using the assistant."""
+        messages = self._test_messages(
+            import_statements, python_function, number_of_tests_to_generate, existing_tests
+        )
+        completion = self._create_completion(messages, choices)
+        return self._parse_completion(completion)
+
+    async def create_tests_async(
+        self,
+        import_statements: List[str],
+        python_function: str,
+        number_of_tests_to_generate: int,
+        existing_tests: List[str],
+        choices: int = 1,
+    ) -> List[AssistantCodeTestCreateResult]:
+        """Create tests for the code using the assistant, without blocking the event loop."""
+        messages = self._test_messages(
+            import_statements, python_function, number_of_tests_to_generate, existing_tests
+        )
+        completion = await self._create_completion_async(messages, choices)
+        return self._parse_completion(completion)
+
+
+class WorkloadGeneratorAssistant(OpenAIAssistant):
+    """Writes a `make_arguments(n)` function producing benchmark inputs of size n."""
+
+    def __init__(self, **kwargs):
+        model_preamble = read_instruction_template("workload_generator", "v1")
+        super().__init__(model_preamble=model_preamble, **kwargs)
+
+    def _workload_messages(self, import_statements: List[str], python_function: str) -> List:
+        llm_query = AssistantWorkloadQuery(
+            import_statements=import_statements,
+            python_function=python_function,
+        )
+        code_message = {"role": "user", "content": llm_query.model_dump_json()}
+        return self.model_preamble + [code_message]
+
+    def _parse_completion(self, completion: "ChatCompletion") -> List[AssistantWorkloadResult]:
+        results: List[AssistantWorkloadResult] = []
+        for choice in completion.choices:
+            assert choice.message.content is not None
+            try:
+                results.append(AssistantWorkloadResult.model_validate_json(choice.message.content))
+            except Exception as e:
+                logger.error("Error parsing result from WorkloadGeneratorLLM")
+                logger.exception(e)
+        return results
+
+    def create_workload(
+        self, import_statements: List[str], python_function: str, choices: int = 1
+    ) -> List[AssistantWorkloadResult]:
+        """Create a workload generator for the code using the assistant."""
+        messages = self._workload_messages(import_statements, python_function)
+        completion = self._create_completion(messages, choices)
+        return self._parse_completion(completion)
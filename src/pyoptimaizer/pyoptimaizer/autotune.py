@@ -0,0 +1,113 @@
+import itertools
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+
+from loguru import logger
+
+from pyoptimaizer.benchmark import rank_results
+from pyoptimaizer.types import BuildConfig, EvaluatedOptimizedFunctionResult
+
+# directives that remove safety checks, a candidate that relies on them fails its tests or crashes
+UNCHECKED_DIRECTIVES: Dict[str, bool] = {
+    "boundscheck": False,
+    "wraparound": False,
+    "cdivision": True,
+    "initializedcheck": False,
+}
+
+# C compiler flags on top of the default build, Python's CFLAGS already have -O3; -ffast-math may change floating point results
+FLAG_SETS: Dict[str, List[str]] = {
+    "native": ["-O3", "-march=native"],
+    "fastmath": ["-O3", "-march=native", "-ffast-math"],
+}
+
+
+def default_grid(
+    flag_sets: Optional[Dict[str, List[str]]] = None,
+    directive_sets: Optional[Dict[str, Dict[str, bool]]] = None,
+) -> List[BuildConfig]:
+    """Every combination of the flag sets and directive sets, except the default build.
+    Args:
+        flag_sets (Dict[str, List[str]], optional): Named compiler flags. Defaults to FLAG_SETS.
+        directive_sets (Dict[str, Dict[str, bool]], optional): Named Cython directives.
+            Defaults to all checks on, or all of UNCHECKED_DIRECTIVES off.
+    """
+    flag_sets = {"default": [], **(FLAG_SETS if flag_sets is None else flag_sets)}
+    directive_sets = {"checked": {}, **({"unchecked": UNCHECKED_DIRECTIVES} if directive_sets is None else directive_sets)}
+    grid = []
+    for (flags_name, flags), (directives_name, directives) in itertools.product(flag_sets.items(), directive_sets.items()):
+        if not flags and not directives:
+            continue
+        grid.append(BuildConfig(name=f"{flags_name}_{directives_name}", compiler_flags=flags, directives=directives))
+    return grid
+
+
+def build_header(config: BuildConfig) -> str:
+    """Header comments that make cythonize build a pyx file with the flags and directives."""
+    lines = []
+    if config.directives:
+        lines.append("# cython: " + ", ".join(f"{k}={v}" for k, v in config.directives.items()))
+    if config.compiler_flags:
+        lines.append("# distutils: extra_compile_args = " + " ".join(config.compiler_flags))
+    return "".join(line + "\n" for line in lines)
+
+
+def write_build_variant(pyx_path: Union[str, Path], config: BuildConfig) -> Path:
+    """Write a copy of a candidate that builds with the given configuration, next to it.
+    The configuration lives in the header of the copy, so accepting it keeps the configuration,
+    and the build cache tells the variants apart by their source.
+    """
+    pyx_path = Path(pyx_path)
+    variant_path = pyx_path.with_name(f"{pyx_path.stem}_{config.name}.pyx")
+    source = build_header(config) + pyx_path.read_text()
+    if not variant_path.exists() or variant_path.read_text() != source:
+        variant_path.write_text(source)
+    return variant_path
+
+
+def autotune_candidates(
+    results: Sequence[EvaluatedOptimizedFunctionResult], top_k: int
+) -> List[EvaluatedOptimizedFunctionResult]:
+    """The first top_k ranked results that are compiled candidates built with the defaults.
+    Parallel candidates are left out, their header already sets the OpenMP flags."""
+    candidates = [
+        result
+        for result in results
+        if Path(result.optimized_function_path).suffix == ".pyx"
+        and result.backend != "cython_parallel"
+        and result.build_config is None
+        and not result.raced_out
+        and not result.error
+    ]
+    return candidates[:top_k]
+
+
+def select_build(
+    candidate: EvaluatedOptimizedFunctionResult,
+    tuned_results: Sequence[EvaluatedOptimizedFunctionResult],
+    confidence: float = 0.95,
+) -> EvaluatedOptimizedFunctionResult:
+    """The fastest build of a candidate, keeping the default build unless a tuned one is
+    significantly faster."""
+    variant_prefix = Path(candidate.optimized_function_path).stem + "_"
+    builds = [candidate] + [
+        result for result in tuned_results if Path(result.optimized_function_path).stem.startswith(variant_prefix)
+    ]
+    return rank_results(builds, confidence)[0]
+
+
+def replace_with_selected_builds(
+    results: List[EvaluatedOptimizedFunctionResult],
+    candidates: Sequence[EvaluatedOptimizedFunctionResult],
+    tuned_results: Sequence[EvaluatedOptimizedFunctionResult],
+    confidence: float = 0.95,
+) -> List[EvaluatedOptimizedFunctionResult]:
+    """Replace every autotuned candidate in `results` by its selected build, see select_build,
+    so every candidate is ranked, shown and stored once. The other builds are dropped."""
+    selected = {}
+    for candidate in candidates:
+        best_build = select_build(candidate, tuned_results, confidence)
+        build_name = best_build.build_config.name if best_build.build_config else "default"
+        logger.info(f"Best build of {Path(candidate.optimized_function_path).name}: {build_name}")
+        selected[id(candidate)] = best_build
+    return [selected.get(id(result), result) for result in results]
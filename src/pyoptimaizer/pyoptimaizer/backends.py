@@ -0,0 +1,214 @@
+import importlib.util
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+from typing import IO, Dict, List, Optional, Sequence, Tuple, cast
+
+from loguru import logger
+
+from pyoptimaizer.build_cache import BuildCache, extension_suffix, source_digest
+from pyoptimaizer.exceptions import BuildError, CythonCompilerError
+from pyoptimaizer.scheduler import set_process_affinity
+from pyoptimaizer.types import EvaluatedOptimizedFunctionResult
+
+
+# cythonize reads the build settings of a pyx file from its header comments
+OPENMP_HEADER = "# distutils: extra_compile_args = -fopenmp\n# distutils: extra_link_args = -fopenmp\n"
+
+
+class Backend:
+    """A way of accelerating a Python function: how candidates are prompted for,
+    built and imported, and roughly what building one costs.
+
+    Candidates of all backends implement the same function, so they are benchmarked
+    against the same tests and compete in the same generation.
+    """
+
+    name: str = ""
+    # instruction template of the optimizer assistant, (folder, version)
+    template: Tuple[str, str] = ("", "")
+    # suffix of the candidate source files
+    suffix: str = ".py"
+    # rough seconds to build a candidate, cheap candidates are built first so their benchmarks start early
+    estimated_build_s: float = 0.0
+    # written above the imports of every candidate, e.g. build settings
+    header: str = ""
+
+    def available(self) -> bool:
+        """Whether the tools to build candidates of this backend are installed."""
+        return True
+
+    def candidate_path(self, function_file_path: Path, source: str) -> Path:
+        """Path of a candidate next to the original file, in .tmp, derived from its code."""
+        return function_file_path.parent / ".tmp" / f"{function_file_path.stem}_{self.name}_{source_digest(source)}{self.suffix}"
+
+    def write_candidate(self, function_file_path: Path, import_statements: List[str], code: str) -> Path:
+        """Write a candidate, the same code always gets the same path."""
+        source = self.header + "\n".join(import_statements) + "\n" + code
+        path = self.candidate_path(function_file_path, source)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if not path.exists() or path.read_text() != source:
+            path.write_text(source)
+        return path
+
+    def build(
+        self,
+        source_path: Path,
+        cpu_affinity: Optional[List[int]] = None,
+        build_cache: Optional[BuildCache] = None,
+    ):
+        """Build a candidate, raising a BuildError when it does not build."""
+
+    def import_path(self, source_path: Path) -> Path:
+        """Path the benchmarks import the candidate from, see runner.import_module_from_file."""
+        return source_path
+
+
+class CythonBackend(Backend):
+    name = "cython"
+    template = ("cython_code_optimizer", "v1")
+    suffix = ".pyx"
+    estimated_build_s = 5.0
+
+    def candidate_path(self, function_file_path: Path, source: str) -> Path:
+        # no backend in the name, so builds cached before there were backends are still found
+        return function_file_path.parent / ".tmp" / f"{function_file_path.stem}_{source_digest(source)}.pyx"
+
+    def build(self, source_path, cpu_affinity=None, build_cache=None):
+        compile_pyx_to_so(source_path, cpu_affinity, build_cache)
+
+
+class CythonParallelBackend(CythonBackend):
+    """Cython with OpenMP, for kernels that release the GIL and split their loops with prange.
+    The number of threads follows OMP_NUM_THREADS, see parallel.sweep_threads."""
+
+    name = "cython_parallel"
+    template = ("cython_parallel_code_optimizer", "v1")
+    estimated_build_s = 6.0
+    header = OPENMP_HEADER
+
+    def candidate_path(self, function_file_path: Path, source: str) -> Path:
+        return Backend.candidate_path(self, function_file_path, source)
+
+
+class NumpyBackend(Backend):
+    """Vectorized NumPy rewrites, plain Python modules without a build step."""
+
+    name = "numpy"
+    template = ("numpy_code_optimizer", "v1")
+    suffix = ".py"
+    estimated_build_s = 0.0
+
+    def available(self) -> bool:
+        return importlib.util.find_spec("numpy") is not None
+
+    def build(self, source_path, cpu_affinity=None, build_cache=None):
+        # nothing to compile, but fail early on code that cannot be imported
+        try:
+            compile(Path(source_path).read_text(), str(source_path), "exec")
+        except SyntaxError as e:
+            raise BuildError(f"Syntax error in {source_path}: {e}") from e
+
+
+class PythranBackend(Backend):
+    """Python kernels with `#pythran export` signatures, compiled ahead of time by Pythran."""
+
+    name = "pythran"
+    template = ("pythran_code_optimizer", "v1")
+    suffix = ".py"
+    estimated_build_s = 20.0
+
+    def available(self) -> bool:
+        return shutil.which("pythran") is not None
+
+    def build(self, source_path, cpu_affinity=None, build_cache=None):
+        source_path = Path(source_path)
+        # the source of a pythran kernel can be valid for another backend as well
+        flags = ["pythran"]
+        if build_cache is not None and build_cache.restore(source_path, flags):
+            return
+        so_path = self.import_path(source_path)
+        with subprocess.Popen(
+            ["pythran", "-O3", str(source_path), "-o", str(so_path)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        ) as proc:
+            set_process_affinity(proc.pid, cpu_affinity)
+            _, stderr = proc.communicate()
+            if proc.returncode != 0:
+                print(stderr, file=sys.stderr)
+                raise BuildError(f"Error running pythran for {source_path}")
+        if build_cache is not None:
+            build_cache.store(source_path, flags)
+
+    def import_path(self, source_path: Path) -> Path:
+        # next to the source, the .py would be imported as plain Python
+        return source_path.with_name(source_path.stem + extension_suffix())
+
+
+BACKENDS: Dict[str, Backend] = {
+    backend.name: backend
+    for backend in (CythonBackend(), CythonParallelBackend(), NumpyBackend(), PythranBackend())
+}
+
+
+def get_backend(name: str) -> Backend:
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown backend {name}, choose from {', '.join(BACKENDS)}") from None
+
+
+def result_import_path(result: EvaluatedOptimizedFunctionResult) -> Path:
+    """Path to import an evaluated result from, the original has no backend."""
+    path = Path(result.optimized_function_path)
+    if result.backend is None:
+        return path
+    return get_backend(result.backend).import_path(path)
+
+
+def available_backends(names: Sequence[str]) -> List[Backend]:
+    """The backends with the given names whose tools are installed, cheapest build first."""
+    backends = []
+    for name in names:
+        backend = get_backend(name)
+        if backend.available():
+            backends.append(backend)
+        else:
+            logger.warning(f"Backend {name} is not installed, skipping it")
+    return sorted(backends, key=lambda backend: backend.estimated_build_s)
+
+
+def compile_pyx_to_so(
+    pyx_path,
+    cpu_affinity: Optional[List[int]] = None,
+    build_cache: Optional[BuildCache] = None,
+):
+    """Compile a pyx file to a shared object file.
+    Args:
+        pyx_path (str): Path to the pyx file.
+        cpu_affinity (List[int], optional): Cores the compiler is allowed to run on.
+        build_cache (BuildCache, optional): Skip the compile when this cache has a build of the pyx file.
+    """
+    if build_cache is not None and build_cache.restore(pyx_path):
+        return
+
+    with subprocess.Popen(
+        ["cythonize", "-i", "-a", pyx_path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    ) as proc:
+        # the C compiler is started by cythonize, so it inherits the affinity
+        set_process_affinity(proc.pid, cpu_affinity)
+        proc.stdout = cast(IO[bytes], proc.stdout)
+        proc.stderr = cast(IO[bytes], proc.stderr)
+        stdout, stderr = proc.communicate()
+        returncode = proc.returncode
+        print(stdout)
+        print(stderr, file=sys.stderr)
+        if returncode != 0:
+            raise CythonCompilerError(f"Error running cythonize for {pyx_path}")
+
+    if build_cache is not None:
+        build_cache.store(pyx_path)
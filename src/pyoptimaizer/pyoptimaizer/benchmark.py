@@ -0,0 +1,257 @@
+import math
+import os
+import random
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from timeit import Timer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from pydantic import BaseModel
+
+from pyoptimaizer.types import BenchmarkResult, EvaluatedOptimizedFunctionResult, TimingDistribution
+
+
+class BenchmarkConfig(BaseModel):
+    # number of discarded samples before timing starts
+    warmup: int = 1
+    # number of timed samples per test
+    repeats: int = 10
+    # every sample loops the test until it takes at least this long
+    min_sample_time_s: float = 0.01
+    # disable the garbage collector while timing
+    disable_gc: bool = True
+    # pin the benchmark to these cores
+    cpu_affinity: Optional[List[int]] = None
+    bootstrap_resamples: int = 1000
+    confidence: float = 0.95
+    seed: int = 0
+    # also measure the memory of a single call of every test
+    measure_memory: bool = True
+
+
+@contextmanager
+def pinned(cores: Optional[Sequence[int]]):
+    """Temporarily pin the calling thread to a set of cores."""
+    if not cores or not hasattr(os, "sched_setaffinity"):
+        yield
+        return
+    previous = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, set(cores))
+    try:
+        yield
+    finally:
+        os.sched_setaffinity(0, previous)
+
+
+def interquartile_range(samples: Sequence[float]) -> float:
+    if len(samples) < 2:
+        return 0.0
+    q1, _, q3 = statistics.quantiles(samples, n=4)
+    return q3 - q1
+
+
+def percentile_interval(values: List[float], confidence: float) -> Tuple[float, float]:
+    values = sorted(values)
+    alpha = (1 - confidence) / 2
+    low = values[int(alpha * (len(values) - 1))]
+    high = values[int(math.ceil((1 - alpha) * (len(values) - 1)))]
+    return low, high
+
+
+def bootstrap_ci(
+    samples: Sequence[float],
+    statistic: Callable[[Sequence[float]], float] = statistics.median,
+    resamples: int = 1000,
+    confidence: float = 0.95,
+    rng: Optional[random.Random] = None,
+) -> Tuple[float, float]:
+    """Percentile bootstrap confidence interval of a statistic."""
+    rng = rng or random.Random(0)
+    if len(samples) < 2:
+        return samples[0], samples[0]
+    estimates = [statistic(rng.choices(samples, k=len(samples))) for _ in range(resamples)]
+    return percentile_interval(estimates, confidence)
+
+
+def geometric_mean(values: Sequence[float]) -> float:
+    return math.exp(sum(math.log(v) for v in values) / len(values))
+
+
+def calibrate_loops(timer: Timer, min_sample_time_s: float) -> int:
+    """Find the number of loops so a single sample takes at least `min_sample_time_s`,
+    similar to Timer.autorange but with a configurable target."""
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_sample_time_s:
+            return number
+        # aim a bit above the target, but never grow by more than 10x at once
+        number = max(number + 1, min(number * 10, int(number * 1.2 * min_sample_time_s / max(elapsed, 1e-9))))
+
+
+def benchmark_callable(
+    test_name: str, func: Callable[[], object], config: BenchmarkConfig
+) -> TimingDistribution:
+    """Time a callable taking no arguments.
+    Args:
+        test_name (str): Name to report the timings under.
+        func (Callable): Callable to time.
+        config (BenchmarkConfig): Benchmark settings.
+    """
+    # Note: timeit disables the garbage collector while timing, unless we enable it in the setup
+    timer = Timer(func, setup="pass" if config.disable_gc else "gc.enable()")
+    loops = calibrate_loops(timer, config.min_sample_time_s)
+    for _ in range(config.warmup):
+        timer.timeit(loops)
+    samples = [total / loops for total in timer.repeat(repeat=config.repeats, number=loops)]
+    return distribution_from_samples(test_name, loops, samples, config)
+
+
+def calls_per_second(funcs: Sequence[Callable[[], object]], threads: int, duration_s: float) -> float:
+    """Throughput of callables that are called from several threads at once.
+    Every thread calls the callables in turn until the time is up, a call that is in flight
+    by then still counts, and so does its time.
+    Args:
+        funcs (Sequence[Callable]): Callables taking no arguments.
+        threads (int): Number of concurrent callers.
+        duration_s (float): Time to keep calling.
+    """
+    start_together = threading.Barrier(threads + 1)
+    stop = threading.Event()
+    counts = [0] * threads
+
+    def caller(idx: int):
+        start_together.wait()
+        calls = 0
+        while not stop.is_set():
+            funcs[calls % len(funcs)]()
+            calls += 1
+        counts[idx] = calls
+
+    callers = [threading.Thread(target=caller, args=(idx,), daemon=True) for idx in range(threads)]
+    for thread in callers:
+        thread.start()
+    start_together.wait()
+    start = time.perf_counter()
+    time.sleep(duration_s)
+    stop.set()
+    for thread in callers:
+        thread.join()
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def distribution_from_samples(
+    test_name: str, loops: int, samples: List[float], config: BenchmarkConfig
+) -> TimingDistribution:
+    ci_low, ci_high = bootstrap_ci(
+        samples,
+        resamples=config.bootstrap_resamples,
+        confidence=config.confidence,
+        rng=random.Random(config.seed),
+    )
+    return TimingDistribution(
+        test_name=test_name,
+        loops=loops,
+        samples_s=samples,
+        median_s=statistics.median(samples),
+        iqr_s=interquartile_range(samples),
+        ci_low_s=ci_low,
+        ci_high_s=ci_high,
+    )
+
+
+def summarize(timings: Dict[str, TimingDistribution]) -> BenchmarkResult:
+    return BenchmarkResult(
+        tests=timings,
+        geometric_mean_s=geometric_mean([t.median_s for t in timings.values()]),
+    )
+
+
+def merge_results(
+    first: BenchmarkResult, second: BenchmarkResult, config: BenchmarkConfig
+) -> BenchmarkResult:
+    """Pool the samples of two benchmarks of the same function."""
+    timings = {}
+    for name in first.tests.keys() & second.tests.keys():
+        a, b = first.tests[name], second.tests[name]
+        timings[name] = distribution_from_samples(
+            name, max(a.loops, b.loops), a.samples_s + b.samples_s, config
+        )
+    result = summarize(timings)
+    result.duration_s = first.duration_s + second.duration_s
+    # memory does not vary between runs like timings, keep the first measurement
+    result.memory = first.memory or second.memory
+    return result
+
+
+def speedup(
+    baseline: BenchmarkResult,
+    candidate: BenchmarkResult,
+    resamples: int = 1000,
+    confidence: float = 0.95,
+    seed: int = 0,
+) -> Tuple[float, Tuple[float, float]]:
+    """Geometric-mean speedup of the candidate against the baseline over their shared tests,
+    with a bootstrap confidence interval. A speedup above 1 means the candidate is faster.
+    """
+    test_names = sorted(set(baseline.tests) & set(candidate.tests))
+    if not test_names:
+        raise ValueError("Benchmarks have no tests in common")
+
+    def estimate(base_samples, cand_samples):
+        return geometric_mean(
+            [statistics.median(b) / statistics.median(c) for b, c in zip(base_samples, cand_samples)]
+        )
+
+    base_samples = [baseline.tests[name].samples_s for name in test_names]
+    cand_samples = [candidate.tests[name].samples_s for name in test_names]
+    point = estimate(base_samples, cand_samples)
+
+    rng = random.Random(seed)
+    estimates = []
+    for _ in range(resamples):
+        estimates.append(
+            estimate(
+                [rng.choices(s, k=len(s)) for s in base_samples],
+                [rng.choices(s, k=len(s)) for s in cand_samples],
+            )
+        )
+    return point, percentile_interval(estimates, confidence)
+
+
+def is_significantly_faster(
+    candidate: EvaluatedOptimizedFunctionResult,
+    reference: EvaluatedOptimizedFunctionResult,
+    confidence: float = 0.95,
+) -> bool:
+    """Whether the candidate is faster than the reference with the given confidence.
+    Falls back to comparing runtimes when a result has no timing distribution."""
+    if candidate.benchmark is None or reference.benchmark is None:
+        return candidate.runtime_ms < reference.runtime_ms
+    try:
+        _, (low, _) = speedup(reference.benchmark, candidate.benchmark, confidence=confidence)
+    except ValueError:
+        return candidate.runtime_ms < reference.runtime_ms
+    return low > 1
+
+
+def rank_results(
+    results: List[EvaluatedOptimizedFunctionResult], confidence: float = 0.95
+) -> List[EvaluatedOptimizedFunctionResult]:
+    """Order results from fastest to slowest, only ranking a result above another one
+    when it is significantly faster.
+
+    Results are grouped into tiers: a result starts a new tier when the leader of the
+    current tier is significantly faster than it. Within a tier the original order is
+    kept, so a newer candidate does not overtake an older one because of noise.
+    """
+    by_runtime = sorted(enumerate(results), key=lambda x: x[1].runtime_ms)
+    tiers: List[List[Tuple[int, EvaluatedOptimizedFunctionResult]]] = []
+    for idx, result in by_runtime:
+        if tiers and not is_significantly_faster(tiers[-1][0][1], result, confidence):
+            tiers[-1].append((idx, result))
+        else:
+            tiers.append([(idx, result)])
+    return [result for tier in tiers for _, result in sorted(tier, key=lambda x: x[0])]
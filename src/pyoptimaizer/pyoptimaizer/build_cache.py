@@ -0,0 +1,176 @@
+import hashlib
+import os
+import shutil
+import sys
+import sysconfig
+import tempfile
+import threading
+from pathlib import Path
+from typing import List, Optional, Sequence, Union
+
+from loguru import logger
+
+# environment variables that change the output of the C compiler
+COMPILER_ENVIRONMENT_VARIABLES = ("CC", "CFLAGS", "CPPFLAGS", "LDFLAGS", "LDSHARED")
+
+
+def default_cache_dir() -> Path:
+    """Get the directory of the build cache.
+    Can be overridden with the PYOPTIMAIZER_CACHE_DIR environment variable.
+    """
+    if "PYOPTIMAIZER_CACHE_DIR" in os.environ:
+        return Path(os.environ["PYOPTIMAIZER_CACHE_DIR"]) / "builds"
+    cache_home = os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+    return Path(cache_home) / "pyoptimaizer" / "builds"
+
+
+def extension_suffix() -> str:
+    """Get the file suffix of compiled extensions, e.g. .cpython-311-x86_64-linux-gnu.so"""
+    return sysconfig.get_config_var("EXT_SUFFIX") or ".so"
+
+
+def python_abi() -> str:
+    """Get a string identifying the ABI extensions are built against."""
+    return "|".join(
+        [
+            sys.implementation.cache_tag or "",
+            extension_suffix(),
+            sysconfig.get_platform(),
+            sys.version,
+        ]
+    )
+
+
+def cython_version() -> str:
+    # imported lazily, Cython is only needed once we actually compile something
+    import Cython
+
+    return Cython.__version__
+
+
+def source_digest(source: str, length: int = 12) -> str:
+    """Get a short hash of a piece of source code, used for stable file names."""
+    return hashlib.sha256(source.encode()).hexdigest()[:length]
+
+
+def build_key(module_name: str, source: str, compiler_flags: Sequence[str] = ()) -> str:
+    """Get the content address of a build.
+
+    Args:
+        module_name (str): Name of the extension module, it is baked into the shared object.
+        source (str): Source code of the pyx file.
+        compiler_flags (Sequence[str]): Extra flags passed to the compiler or cythonize.
+    """
+    h = hashlib.sha256()
+    parts = [
+        module_name,
+        source,
+        cython_version(),
+        python_abi(),
+        "\0".join(compiler_flags),
+        "\0".join(f"{k}={os.environ.get(k, '')}" for k in COMPILER_ENVIRONMENT_VARIABLES),
+    ]
+    for part in parts:
+        h.update(part.encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class BuildCache:
+    """Content-addressed on-disk cache of compiled Cython extensions.
+
+    Every entry is a directory named after its build key, containing the shared object
+    and the annotation html produced by `cythonize -a`. The modification time of an entry
+    is bumped on every hit, entries that were not used for the longest time are evicted
+    first once the cache grows beyond `max_size_bytes`.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[Union[str, Path]] = None,
+        max_size_bytes: int = 512 * 1024 * 1024,
+    ):
+        self.cache_dir = Path(cache_dir) if cache_dir else default_cache_dir()
+        self.max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    @staticmethod
+    def _artifact_paths(pyx_path: Path) -> List[Path]:
+        return [
+            pyx_path.with_name(pyx_path.stem + extension_suffix()),
+            pyx_path.with_suffix(".html"),
+        ]
+
+    def key_for(self, pyx_path: Union[str, Path], compiler_flags: Sequence[str] = ()) -> str:
+        pyx_path = Path(pyx_path)
+        return build_key(pyx_path.stem, pyx_path.read_text(), compiler_flags)
+
+    def restore(self, pyx_path: Union[str, Path], compiler_flags: Sequence[str] = ()) -> bool:
+        """Copy a cached build next to the pyx file.
+
+        Returns:
+            bool: True on a cache hit, False if the pyx file still has to be compiled.
+        """
+        pyx_path = Path(pyx_path)
+        entry = self._entry_dir(self.key_for(pyx_path, compiler_flags))
+        if not entry.is_dir():
+            return False
+        try:
+            for artifact in self._artifact_paths(pyx_path):
+                cached = entry / artifact.name
+                if cached.exists():
+                    shutil.copy2(cached, artifact)
+            os.utime(entry)
+        except OSError:
+            # evicted by another process while we were copying
+            logger.warning(f"Could not restore {pyx_path} from the build cache")
+            return False
+        logger.info(f"Build cache hit for {pyx_path.name}")
+        return True
+
+    def store(self, pyx_path: Union[str, Path], compiler_flags: Sequence[str] = ()):
+        """Store the build artifacts next to the pyx file in the cache."""
+        pyx_path = Path(pyx_path)
+        entry = self._entry_dir(self.key_for(pyx_path, compiler_flags))
+        artifacts = [a for a in self._artifact_paths(pyx_path) if a.exists()]
+        if entry.exists() or not artifacts:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # build the entry in a temporary directory first, so other processes never see a partial entry
+        tmp_entry = Path(tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp-"))
+        try:
+            for artifact in artifacts:
+                shutil.copy2(artifact, tmp_entry / artifact.name)
+            os.replace(tmp_entry, entry)
+        except OSError:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            return
+        self.evict()
+
+    def size_bytes(self) -> int:
+        return sum(f.stat().st_size for f in self.cache_dir.glob("*/*") if f.is_file())
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in `max_size_bytes`."""
+        with self._lock:
+            entries = []
+            for entry in self.cache_dir.iterdir():
+                if not entry.is_dir() or entry.name.startswith(".tmp-"):
+                    continue
+                try:
+                    size = sum(f.stat().st_size for f in entry.iterdir())
+                    entries.append((entry.stat().st_mtime, size, entry))
+                except OSError:
+                    continue
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in sorted(entries, key=lambda x: x[0]):
+                if total <= self.max_size_bytes:
+                    break
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
@@ -0,0 +1,208 @@
+import functools
+import io
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from loguru import logger
+
+# a recorded call: positional and keyword arguments
+Call = Tuple[tuple, Dict[str, Any]]
+
+# name under which the corpus shows up in benchmark results
+CORPUS_TEST_NAME = "corpus"
+
+
+def default_corpus_dir(function_file_path: Union[str, Path], function_name: str) -> Path:
+    """Get the directory of the recorded calls of a function, next to its file."""
+    function_file_path = Path(function_file_path)
+    return function_file_path.parent / ".corpus" / f"{function_file_path.stem}.{function_name}"
+
+
+def _is_ndarray(obj) -> bool:
+    # numpy is not a dependency, and if the arguments contain arrays it is imported already
+    return type(obj).__name__ == "ndarray" and type(obj).__module__ == "numpy"
+
+
+class _CallPickler(pickle.Pickler):
+    """Pickles a call, storing large numpy arrays next to it as .npy files."""
+
+    def __init__(self, file, directory: Path, min_array_bytes: int):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.directory = directory
+        self.min_array_bytes = min_array_bytes
+        self.arrays = 0
+
+    def persistent_id(self, obj):
+        if not _is_ndarray(obj) or obj.nbytes < self.min_array_bytes or obj.dtype.hasobject:
+            return None
+        import numpy as np
+
+        file_name = f"array_{self.arrays}.npy"
+        self.arrays += 1
+        np.save(self.directory / file_name, obj)
+        return file_name
+
+
+class _CallUnpickler(pickle.Unpickler):
+    """Loads a pickled call, memory-mapping its .npy files instead of reading them."""
+
+    def __init__(self, file, directory: Path):
+        super().__init__(file)
+        self.directory = directory
+
+    def persistent_load(self, pid):
+        import numpy as np
+
+        # copy-on-write, so candidates that write into their arguments do not touch the corpus
+        return np.load(self.directory / pid, mmap_mode="c")
+
+
+class ArgumentRecorder:
+    """Samples the arguments of real calls of a function into an on-disk corpus.
+
+    Every sample is a directory with the pickled call and the numpy arrays of at least
+    `min_array_bytes` as separate .npy files, which are memory-mapped on replay.
+    Recording is cheap when a call is not sampled: a single random draw.
+    """
+
+    def __init__(
+        self,
+        corpus_dir: Union[str, Path],
+        sample_rate: float = 0.01,
+        max_samples: int = 100,
+        min_array_bytes: int = 1024 * 1024,
+        seed: Optional[int] = None,
+    ):
+        """
+        Args:
+            corpus_dir (Union[str, Path]): Directory of the corpus, see `default_corpus_dir`.
+            sample_rate (float): Fraction of the calls that is recorded.
+            max_samples (int): Recording stops when the corpus has this many samples.
+            min_array_bytes (int): Numpy arrays of at least this size are stored as .npy files.
+            seed (int, optional): Seed of the sampling.
+        """
+        self.corpus_dir = Path(corpus_dir)
+        self.sample_rate = sample_rate
+        self.max_samples = max_samples
+        self.min_array_bytes = min_array_bytes
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._samples = len(list(self.corpus_dir.glob("[0-9]*"))) if self.corpus_dir.is_dir() else 0
+
+    @property
+    def samples(self) -> int:
+        return self._samples
+
+    def record(self, args: tuple, kwargs: Dict[str, Any]):
+        """Sample a call, storing its arguments when it is drawn."""
+        with self._lock:
+            if self._samples >= self.max_samples or self._rng.random() >= self.sample_rate:
+                return
+            idx = self._samples
+            self._samples += 1
+        try:
+            self._write(idx, (args, kwargs))
+        except Exception:
+            # never break the program that is being recorded
+            logger.exception(f"Could not record a call into {self.corpus_dir}")
+
+    def _write(self, idx: int, call: Call):
+        self.corpus_dir.mkdir(parents=True, exist_ok=True)
+        # write into a temporary directory first, so a replay never sees a partial sample
+        tmp_dir = Path(tempfile.mkdtemp(dir=self.corpus_dir, prefix=".tmp-"))
+        try:
+            buffer = io.BytesIO()
+            _CallPickler(buffer, tmp_dir, self.min_array_bytes).dump(call)
+            (tmp_dir / "call.pkl").write_bytes(buffer.getvalue())
+            os.replace(tmp_dir, self.corpus_dir / f"{idx:05d}")
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    def __call__(self, func: Callable) -> Callable:
+        """Wrap a function, so its calls are recorded."""
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self.record(args, kwargs)
+            return func(*args, **kwargs)
+
+        return wrapper
+
+
+def record_calls(
+    function_file_path: Union[str, Path],
+    function_name: Optional[str] = None,
+    **kwargs,
+) -> Callable[[Callable], Callable]:
+    """Decorator that records calls into the default corpus of the decorated function.
+
+    Use as `@record_calls(__file__)`. See ArgumentRecorder for the keyword arguments.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        corpus_dir = default_corpus_dir(function_file_path, function_name or func.__name__)
+        return ArgumentRecorder(corpus_dir, **kwargs)(func)
+
+    return decorator
+
+
+@contextmanager
+def capture(module, function_name: str, corpus_dir: Optional[Union[str, Path]] = None, **kwargs):
+    """Record calls of `module.function_name` while the context is active.
+
+    Only calls that look the function up on the module are seen, not references
+    taken before, e.g. by `from module import function`.
+
+    Args:
+        module: Module defining the function.
+        function_name (str): Name of the function.
+        corpus_dir (Union[str, Path], optional): Defaults to the corpus next to the module.
+        kwargs: See ArgumentRecorder.
+    """
+    original = getattr(module, function_name)
+    corpus_dir = corpus_dir or default_corpus_dir(module.__file__, function_name)
+    recorder = ArgumentRecorder(corpus_dir, **kwargs)
+    setattr(module, function_name, recorder(original))
+    try:
+        yield recorder
+    finally:
+        setattr(module, function_name, original)
+
+
+def load_corpus(corpus_dir: Union[str, Path]) -> List[Call]:
+    """Load all recorded calls, with large numpy arrays memory-mapped instead of copied."""
+    corpus_dir = Path(corpus_dir)
+    if not corpus_dir.is_dir():
+        return []
+    calls = []
+    for sample_dir in sorted(corpus_dir.glob("[0-9]*")):
+        with open(sample_dir / "call.pkl", "rb") as f:
+            calls.append(_CallUnpickler(f, sample_dir).load())
+    return calls
+
+
+def corpus_workload(func: Callable, corpus: List[Call]) -> Callable[[], None]:
+    """Get a callable replaying every recorded call against a function."""
+
+    def replay_corpus():
+        for args, kwargs in corpus:
+            func(*args, **kwargs)
+
+    replay_corpus.__name__ = CORPUS_TEST_NAME
+    return replay_corpus
+
+
+def find_corpus(function_file_path: Union[str, Path], function_name: str) -> Optional[Path]:
+    """Get the default corpus of a function, or None when no calls were recorded."""
+    corpus_dir = default_corpus_dir(function_file_path, function_name)
+    if not any(corpus_dir.glob("[0-9]*")):
+        return None
+    return corpus_dir
@@ -0,0 +1,521 @@
+import hmac
+import inspect
+import itertools
+import json
+import multiprocessing
+import os
+import secrets
+import shutil
+import signal
+import socketserver
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+
+from loguru import logger
+
+from pyoptimaizer.backends import BACKENDS, Backend
+from pyoptimaizer.benchmark import BenchmarkConfig
+from pyoptimaizer.evolution import EvolutionConfig
+from pyoptimaizer.html_display import close_reporting, configure_reporting
+from pyoptimaizer.objectives import ObjectiveConfig
+from pyoptimaizer.optimize import cythonize_function
+from pyoptimaizer.parallel import ParallelConfig
+from pyoptimaizer.reporter import BackgroundReporter, Message, PipeSink, Sink, merge_deltas
+from pyoptimaizer.runner import run_test_file_with_replacement_function
+from pyoptimaizer.scaling import ScalingConfig
+from pyoptimaizer.throughput import ThroughputConfig
+from pyoptimaizer.types import EvaluatedOptimizedFunctionResult
+from pyoptimaizer.utils import Process
+
+# options of an optimize job that are passed to cythonize_function as they are
+PLAIN_OPTIONS = ("refine_depth", "racing", "autotune_top", "backends", "rank_by", "beam_width", "warm_start")
+# options of an optimize job that are validated into a config
+CONFIG_OPTIONS = {
+    "scaling_config": ScalingConfig,
+    "objectives": ObjectiveConfig,
+    "parallel": ParallelConfig,
+    "throughput": ThroughputConfig,
+    "evolution": EvolutionConfig,
+}
+
+# seconds a cancelled job gets to clean up its benchmark processes before it is killed
+CANCEL_GRACE_S = 5
+
+# JSON-RPC error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+JOB_ERROR = -32000
+UNAUTHORIZED = -32001
+
+
+def optimize_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    """Keyword arguments of cythonize_function from the JSON options of an optimize request."""
+    kwargs = {}
+    for name, value in options.items():
+        if name in PLAIN_OPTIONS:
+            kwargs[name] = value
+        elif name in CONFIG_OPTIONS:
+            kwargs[name] = CONFIG_OPTIONS[name].model_validate(value)
+        else:
+            raise ValueError(f"Unknown option {name}, choose from {', '.join(PLAIN_OPTIONS + tuple(CONFIG_OPTIONS))}")
+    return kwargs
+
+
+def summarize_result(result: EvaluatedOptimizedFunctionResult) -> Dict[str, Any]:
+    return result.model_dump(
+        mode="json",
+        include={"optimized_function_path", "function_name", "runtime_ms", "speedup", "backend", "error", "lineage"},
+    )
+
+
+def backend_for_path(path: Union[str, Path]) -> Backend:
+    """The backend that writes candidates with the suffix of `path`."""
+    for backend in BACKENDS.values():
+        if Path(path).suffix == backend.suffix:
+            return backend
+    raise ValueError(f"No backend writes {Path(path).suffix} candidates")
+
+
+def optimize_job(function_path: str, test_functions: Sequence[str] = (), options: Optional[Dict[str, Any]] = None):
+    results = cythonize_function(function_path, list(test_functions), **optimize_options(options or {}))
+    return [summarize_result(result) for result in results]
+
+
+def benchmark_job(
+    test_path: str,
+    function_path: str,
+    candidate_path: Optional[str] = None,
+    config: Optional[Dict[str, Any]] = None,
+):
+    """Benchmark the original function, or a built candidate in place of it, on a test file."""
+    function_file_path = Path(function_path.split("::")[0])
+    function_name = function_path.split("::")[1]
+    sys.path.insert(0, str(function_file_path.parent))
+    replacement_path = function_file_path
+    if candidate_path is not None:
+        replacement_path = backend_for_path(candidate_path).import_path(Path(candidate_path))
+    benchmark = run_test_file_with_replacement_function(
+        test_path, replacement_path, function_name, BenchmarkConfig.model_validate(config or {})
+    )
+    return benchmark.model_dump(mode="json")
+
+
+JOBS: Dict[str, Callable] = {
+    "optimize": optimize_job,
+    "benchmark": benchmark_job,
+}
+
+
+def _exit_on_sigterm(signum, frame):
+    raise SystemExit(128 + signum)
+
+
+def run_job(kind: str, params: Dict[str, Any], progress):
+    """Entry point of a job process, forked from the daemon so the imports are already warm.
+    The UI updates of the job go to the daemon over `progress`."""
+    # a cancelled job unwinds, so its worker pools and benchmark processes are closed
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    configure_reporting(PipeSink(progress))
+    try:
+        return JOBS[kind](**params)
+    finally:
+        # job processes exit without running atexit
+        close_reporting(timeout=5)
+
+
+class Job:
+    """An optimize or benchmark request, running in its own process.
+
+    The UI updates of the job are forwarded to every connection that subscribed to it. The
+    page and the merged deltas are kept, so a late subscriber gets the current state first.
+    """
+
+    def __init__(self, job_id: str, kind: str, params: Dict[str, Any]):
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        # queued, running, done, failed or cancelled
+        self.state = "queued"
+        # the latest status of the UI
+        self.status = ""
+        self.error: Optional[str] = None
+        self.result: Any = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._process: Optional[Process] = None
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._shell: Optional[Message] = None
+        self._state: Optional[Message] = None
+        self._subscribers: List[BackgroundReporter] = []
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ("done", "failed", "cancelled")
+
+    def info(self, with_result: bool = False) -> Dict[str, Any]:
+        info = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if with_result:
+            info["result"] = self.result
+        return info
+
+    def subscribe(self, reporter: BackgroundReporter):
+        with self._lock:
+            if self._shell is not None:
+                reporter.report(self._shell)
+            if self._state is not None:
+                reporter.report(self._state)
+            if self.finished:
+                reporter.report({"type": "finished", **self.info(with_result=True)})
+            self._subscribers.append(reporter)
+
+    def unsubscribe(self, reporter: BackgroundReporter):
+        with self._lock:
+            if reporter in self._subscribers:
+                self._subscribers.remove(reporter)
+
+    def _publish(self, message: Message):
+        with self._lock:
+            if message["type"] == "shell":
+                self._shell, self._state = message, None
+            elif message["type"] == "delta":
+                self._state = merge_deltas(self._state, message)
+                self.status = message.get("status_text", self.status)
+            for reporter in self._subscribers:
+                reporter.report(message)
+
+    def _finish(self, state: str, result: Any = None, error: Optional[str] = None):
+        with self._lock:
+            self.state, self.result, self.error = state, result, error
+            self.finished_at = time.time()
+            message = {"type": "finished", **self.info(with_result=True)}
+            for reporter in self._subscribers:
+                reporter.report(message)
+        logger.info(f"Job {self.id} {state}" + (f": {error}" if error else ""))
+
+    def run(self, slots: threading.Semaphore):
+        """Wait for a free slot, then run the job and forward its updates until it exits."""
+        while not slots.acquire(timeout=0.1):
+            if self._cancelled.is_set():
+                self._finish("cancelled")
+                return
+        try:
+            result = self._run_process()
+        finally:
+            slots.release()
+
+        if self._cancelled.is_set():
+            self._finish("cancelled")
+        elif self._process.exception is not None:
+            self._finish("failed", error=self._process.exception[0])
+        elif self._process.exitcode != 0:
+            self._finish("failed", error=f"Job process exited with code {self._process.exitcode}")
+        else:
+            self._finish("done", result)
+
+    def _run_process(self) -> Any:
+        progress, child_progress = multiprocessing.Pipe(duplex=False)
+        with self._lock:
+            if self._cancelled.is_set():
+                return None
+            self._process = Process(target=run_job, args=(self.kind, self.params, child_progress))
+            self._process.start()
+            self.state, self.started_at = "running", time.time()
+        child_progress.close()
+        result = None
+        while True:
+            # jobs that start at the same time can inherit each others pipe, so the end of a job is
+            # noticed by its process exiting rather than by the pipe closing
+            if progress.poll(0.1):
+                try:
+                    self._publish(json.loads(progress.recv()))
+                except EOFError:
+                    break
+            elif not self._process.is_alive():
+                break
+            # read the result while the job runs, a large one would block its exit
+            if result is None:
+                result = self._process.result
+        self._process.join()
+        progress.close()
+        return result if result is not None else self._process.result
+
+    def cancel(self) -> bool:
+        """Stop the job, returns False when it already finished."""
+        with self._lock:
+            if self.finished:
+                return False
+            self._cancelled.set()
+            process = self._process
+        if process is not None and process.is_alive():
+            process.terminate()
+            process.join(CANCEL_GRACE_S)
+            if process.is_alive():
+                process.kill()
+        return True
+
+
+class JobManager:
+    """Runs up to `max_jobs` jobs at once, the others wait in order."""
+
+    def __init__(self, max_jobs: int = 2):
+        self.jobs: Dict[str, Job] = {}
+        self.slots = threading.Semaphore(max_jobs)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, params: Dict[str, Any]) -> Job:
+        # invalid parameters are rejected before anything runs
+        inspect.signature(JOBS[kind]).bind(**params)
+        if kind == "optimize":
+            optimize_options(params.get("options") or {})
+        with self._lock:
+            job = Job(str(next(self._ids)), kind, params)
+            self.jobs[job.id] = job
+        threading.Thread(target=job.run, args=(self.slots,), name=f"job-{job.id}", daemon=True).start()
+        logger.info(f"Job {job.id}: {kind} {params}")
+        return job
+
+    def get(self, job_id: str) -> Job:
+        if job_id not in self.jobs:
+            raise ValueError(f"Unknown job {job_id}")
+        return self.jobs[job_id]
+
+    def cancel_all(self):
+        for job in list(self.jobs.values()):
+            job.cancel()
+
+
+class ConnectionSink(Sink):
+    """Sends the updates of a job to a client as JSON-RPC notifications."""
+
+    def __init__(self, handler: "RequestHandler", job_id: str):
+        self.handler = handler
+        self.job_id = job_id
+
+    def send(self, message: Message):
+        method = "progress" if message["type"] in ("shell", "delta") else "finished"
+        self.handler.write({"jsonrpc": "2.0", "method": method, "params": {"job_id": self.job_id, "update": message}})
+
+
+def parse_request(line: bytes) -> Dict[str, Any]:
+    """The JSON-RPC 2.0 request or notification of a line, ValueError for anything else."""
+    request = json.loads(line)
+    if not isinstance(request, dict) or request.get("jsonrpc") != "2.0" or not isinstance(request.get("method"), str):
+        raise ValueError("Not a JSON-RPC 2.0 request")
+    if not isinstance(request.get("params", {}), (dict, type(None))):
+        raise ValueError("Only named params are supported")
+    return request
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """A client connection, one JSON-RPC 2.0 request or notification per line.
+
+    Any local process, including a web page in a browser, can reach the port. So the first
+    request has to be `authenticate(token)` with the token of the port file, and the
+    connection is closed on the first line that is not a JSON-RPC request.
+
+    Methods:
+        authenticate(token): Must be the first request of a connection.
+        optimize(function_path, test_functions=[], options={}): Start optimizing a function, see optimize_options.
+            The connection is subscribed to the progress of the job.
+        benchmark(test_path, function_path, candidate_path=None, config={}): Start benchmarking the original
+            function or a candidate.
+        accept(candidate_path, original_path): Copy a candidate next to the original function.
+        cancel(job_id): Stop a job.
+        status(job_id=None): State of one job with its result, or of all jobs.
+        subscribe(job_id): Receive the progress of a job, starting with its current state.
+        shutdown(): Cancel all jobs and stop the daemon.
+    """
+
+    server: "DaemonServer"
+
+    def setup(self):
+        super().setup()
+        self._write_lock = threading.Lock()
+        self._subscriptions: List[tuple] = []
+
+    def write(self, payload: Dict[str, Any]):
+        with self._write_lock:
+            self.wfile.write((json.dumps(payload) + "\n").encode())
+            self.wfile.flush()
+
+    def handle(self):
+        authenticated = False
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = parse_request(line)
+            except ValueError as e:
+                code = PARSE_ERROR if isinstance(e, json.JSONDecodeError) else INVALID_REQUEST
+                self.write({"jsonrpc": "2.0", "id": None, "error": {"code": code, "message": str(e)}})
+                return
+            if not authenticated:
+                if not self.authenticate(request):
+                    error = {"code": UNAUTHORIZED, "message": "The first request must be authenticate(token)"}
+                    self.write({"jsonrpc": "2.0", "id": request.get("id"), "error": error})
+                    return
+                authenticated = True
+                self.write({"jsonrpc": "2.0", "id": request.get("id"), "result": {"authenticated": True}})
+                continue
+            response = self.handle_request(request)
+            if response is not None:
+                self.write(response)
+
+    def authenticate(self, request: Dict[str, Any]) -> bool:
+        token = (request.get("params") or {}).get("token")
+        return (
+            request["method"] == "authenticate"
+            and isinstance(token, str)
+            and hmac.compare_digest(token.encode(), self.server.token.encode())
+        )
+
+    def finish(self):
+        for job, reporter in self._subscriptions:
+            job.unsubscribe(reporter)
+            reporter.close(timeout=0)
+        super().finish()
+
+    def handle_request(self, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        request_id = request.get("id")
+        method = getattr(self, f"rpc_{request.get('method')}", None)
+        params = request.get("params") or {}
+        try:
+            if method is None:
+                raise LookupError(f"Unknown method {request.get('method')}")
+            inspect.signature(method).bind(**params)
+        except (LookupError, TypeError) as e:
+            code = METHOD_NOT_FOUND if method is None else INVALID_PARAMS
+            return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": str(e)}}
+        try:
+            result = method(**params)
+        except (ValueError, TypeError) as e:
+            error = {"code": INVALID_PARAMS, "message": str(e)}
+        except Exception as e:
+            logger.exception(f"Error handling {request.get('method')}")
+            error = {"code": JOB_ERROR, "message": str(e)}
+        else:
+            # notifications do not get a response
+            return None if request_id is None else {"jsonrpc": "2.0", "id": request_id, "result": result}
+        return {"jsonrpc": "2.0", "id": request_id, "error": error}
+
+    def rpc_optimize(self, function_path: str, test_functions: Sequence[str] = (), options: Optional[Dict] = None):
+        job = self.server.jobs.submit(
+            "optimize", {"function_path": function_path, "test_functions": list(test_functions), "options": options}
+        )
+        self.rpc_subscribe(job.id)
+        return {"job_id": job.id}
+
+    def rpc_benchmark(
+        self,
+        test_path: str,
+        function_path: str,
+        candidate_path: Optional[str] = None,
+        config: Optional[Dict] = None,
+    ):
+        job = self.server.jobs.submit(
+            "benchmark",
+            {"test_path": test_path, "function_path": function_path, "candidate_path": candidate_path, "config": config},
+        )
+        self.rpc_subscribe(job.id)
+        return {"job_id": job.id}
+
+    def rpc_accept(self, candidate_path: str, original_path: str):
+        candidate, original = Path(candidate_path), Path(original_path)
+        accepted = original.with_name(f"{original.stem}_optimized{candidate.suffix}")
+        shutil.copyfile(candidate, accepted)
+        return {"path": str(accepted)}
+
+    def rpc_cancel(self, job_id: str):
+        return {"cancelled": self.server.jobs.get(job_id).cancel()}
+
+    def rpc_status(self, job_id: Optional[str] = None):
+        if job_id is not None:
+            return self.server.jobs.get(job_id).info(with_result=True)
+        return [job.info() for job in self.server.jobs.jobs.values()]
+
+    def rpc_subscribe(self, job_id: str):
+        job = self.server.jobs.get(job_id)
+        # a slow client only holds up its own updates
+        reporter = BackgroundReporter(ConnectionSink(self, job_id))
+        self._subscriptions.append((job, reporter))
+        job.subscribe(reporter)
+        return {"subscribed": job_id}
+
+    def rpc_shutdown(self):
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+        return {"shutting_down": True}
+
+
+class DaemonServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, max_jobs: int = 2, token: Optional[str] = None):
+        super().__init__(address, RequestHandler)
+        self.jobs = JobManager(max_jobs)
+        # clients read it from the port file, which only the user can read
+        self.token = token or secrets.token_urlsafe(32)
+
+
+def warm_up():
+    """Import what the jobs import lazily, so every forked job starts with it."""
+    import Cython.Build  # noqa: F401
+    import openai  # noqa: F401
+    import plotly.graph_objects  # noqa: F401
+    import plotly.utils  # noqa: F401
+
+    # numpy is not a dependency, only the numpy backend needs it
+    if BACKENDS["numpy"].available():
+        import numpy  # noqa: F401
+
+
+def write_private_file(path: Union[str, Path], text: str):
+    """Write a file only the current user can read and write, replacing it at once."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(f".{path.name}.{os.getpid()}")
+    fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+    os.replace(temporary, path)
+
+
+def serve(port_file: Union[str, Path], host: str = "127.0.0.1", port: int = 0, max_jobs: int = 2):
+    """Run the daemon until it is shut down.
+
+    Args:
+        port_file (Union[str, Path]): File the port, process id and access token are written to, for clients
+            to find the daemon. Only the current user can read it.
+        host (str): Address to listen on, only local clients by default.
+        port (int): Port to listen on, 0 picks a free one.
+        max_jobs (int): Number of jobs that run at once. Their benchmarks share the cores of this machine.
+    """
+    warm_up()
+    with DaemonServer((host, port), max_jobs) as server:
+        port = server.server_address[1]
+        write_private_file(
+            port_file, json.dumps({"host": host, "port": port, "pid": os.getpid(), "token": server.token})
+        )
+        logger.info(f"Listening on {host}:{port}")
+        try:
+            server.serve_forever()
+        finally:
+            server.jobs.cancel_all()
+            Path(port_file).unlink(missing_ok=True)
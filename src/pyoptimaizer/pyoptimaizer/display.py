@@ -1,3 +1,4 @@
+from pathlib import Path
 from typing import List
 from loguru import logger
 from pyoptimaizer.types import EvaluatedOptimizedFunctionResult
@@ -8,5 +9,34 @@ def display_ordered_runtimes(results: List[EvaluatedOptimizedFunctionResult], or
     to_print.append(f"Original Runtime: {original_time}ms")
     to_print.append(f"Parent Runtime: {parent_time}ms")
     for result in results:
-        to_print.append(f"Function: {result.optimized_function_path} Runtime: {result.runtime_ms}ms")
+        line = f"Function: {result.optimized_function_path} Runtime: {result.runtime_ms}ms"
+        if result.speedup is not None and result.speedup_ci is not None:
+            line += f" Speedup: {result.speedup:.2f}x ({result.speedup_ci[0]:.2f}x - {result.speedup_ci[1]:.2f}x)"
+        if result.memory is not None:
+            line += f" Peak memory: {result.memory.peak_bytes / 1024:.0f}KiB"
+        if result.annotation is not None:
+            line += f" Python interaction: {result.annotation.total_score}"
+        if result.backend is not None:
+            line += f" Backend: {result.backend}"
+        if result.thread_scaling is not None:
+            curve = " ".join(f"{point.threads}:{point.speedup:.2f}x" for point in result.thread_scaling.points)
+            line += f" Threads: {curve} ({result.thread_scaling.points[-1].efficiency:.0%} efficiency)"
+        if result.throughput is not None:
+            peak = result.throughput.points[-1]
+            line += f" Throughput: {peak.calls_per_s:.0f} calls/s on {peak.threads} threads ({peak.scaling:.2f}x"
+            if result.throughput.vs_original is not None:
+                line += f", {result.throughput.vs_original:.2f}x the original"
+            if result.throughput.releases_gil is not None:
+                line += ", releases the GIL" if result.throughput.releases_gil else ", holds the GIL"
+            line += ")"
+        if result.build_config is not None:
+            line += f" Build: {result.build_config.name}"
+        if result.lineage is not None and result.lineage.parents:
+            parents = ", ".join(Path(parent).stem for parent in result.lineage.parents)
+            line += f" From: {result.lineage.operator} of {parents} (generation {result.lineage.generation})"
+        if result.lineage is not None and result.lineage.root is not None:
+            line += f" Branch: {Path(result.lineage.root).stem}"
+        if result.raced_out:
+            line += " (dropped early)"
+        to_print.append(line)
     logger.info("\n".join(to_print))
\ No newline at end of file
@@ -0,0 +1,275 @@
+import asyncio
+import difflib
+import random
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from loguru import logger
+from pydantic import BaseModel
+
+from pyoptimaizer.annotation import worst_lines
+from pyoptimaizer.assistants import AssistantCodeOptimizationResult, CodeOptimizerAssistant
+from pyoptimaizer.benchmark import rank_results
+from pyoptimaizer.exceptions import AllGenerationsFailedError
+from pyoptimaizer.types import EvaluatedOptimizedFunctionResult, Lineage
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletionMessage
+
+Candidate = Tuple[AssistantCodeOptimizationResult, List["ChatCompletionMessage"]]
+
+GENERIC_MUTATIONS = [
+    "Change the loop order, so the innermost loop walks through memory contiguously",
+    "Replace the algorithm by one with a lower complexity, or move work out of the loops",
+    "Compute values that are needed more than once only once",
+    "Allocate less: reuse buffers, work in place and avoid temporary containers",
+]
+
+MUTATIONS = {
+    "cython": GENERIC_MUTATIONS
+    + [
+        "Add typed memoryviews for all array arguments and buffers",
+        "Give every local variable and loop index a C type",
+        "Move the hot loop into a cdef inline function that runs without the GIL",
+        "Disable boundscheck and wraparound where the indices are always valid, and use C division",
+    ],
+    "cython_parallel": GENERIC_MUTATIONS
+    + [
+        "Parallelize a different loop with prange, preferably the outermost one",
+        "Try another prange schedule and chunk size",
+    ],
+    "numpy": GENERIC_MUTATIONS
+    + [
+        "Replace the remaining Python loops by broadcasting",
+        "Use in-place ufuncs with out= to avoid temporary arrays",
+    ],
+}
+
+
+class EvolutionConfig(BaseModel):
+    # number of candidates the parents are selected from
+    population_size: int = 6
+    # number of candidates that compete in a tournament for every parent
+    tournament_size: int = 3
+    # LLM requests per generation, every request makes one child
+    offspring: int = 4
+    # chance that a child is a crossover of two parents instead of a mutation of one
+    crossover_rate: float = 0.5
+    # candidates whose code is more similar than this to a better one are left out of the population
+    max_similarity: float = 0.95
+    max_generations: int = 5
+    # stop starting new generations once one of these is spent
+    time_budget_s: Optional[float] = None
+    token_budget: Optional[int] = None
+    seed: int = 0
+
+
+def child_lineage(
+    parent: EvaluatedOptimizedFunctionResult,
+    generation: int,
+    operator: str,
+    other_parents: Sequence[EvaluatedOptimizedFunctionResult] = (),
+    mutation: Optional[str] = None,
+) -> Lineage:
+    """Lineage of a candidate made from `parent`, on the same branch as the parent."""
+    root = None
+    if parent.lineage is not None:
+        root = parent.lineage.root or str(parent.optimized_function_path)
+    return Lineage(
+        generation=generation,
+        operator=operator,
+        parents=[str(result.optimized_function_path) for result in (parent, *other_parents)],
+        mutation=mutation,
+        root=root,
+    )
+
+
+def mutations_for(backend: Optional[str]) -> List[str]:
+    return MUTATIONS.get(backend or "cython", GENERIC_MUTATIONS)
+
+
+def code_similarity(a: str, b: str) -> float:
+    """Similarity of two candidates, 1.0 for the same code."""
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    # quick_ratio is an upper bound of ratio and much cheaper
+    if matcher.quick_ratio() < 0.5:
+        return matcher.quick_ratio()
+    return matcher.ratio()
+
+
+def read_candidate(result: EvaluatedOptimizedFunctionResult) -> str:
+    return Path(result.optimized_function_path).read_text()
+
+
+def select_population(
+    results: List[EvaluatedOptimizedFunctionResult],
+    size: int,
+    max_similarity: float = 0.95,
+    rank: Optional[Callable[[List[EvaluatedOptimizedFunctionResult]], List[EvaluatedOptimizedFunctionResult]]] = None,
+) -> List[EvaluatedOptimizedFunctionResult]:
+    """The best `size` candidates, best first, leaving out near copies of better ones so
+    the population keeps different approaches around. The original and raced out results are left out."""
+    rank = rank or rank_results
+    candidates = [r for r in results if r.lineage is not None and not r.raced_out and not r.error]
+    population: List[EvaluatedOptimizedFunctionResult] = []
+    codes: List[str] = []
+    for result in rank(candidates):
+        code = read_candidate(result)
+        if any(code_similarity(code, other) > max_similarity for other in codes):
+            continue
+        population.append(result)
+        codes.append(code)
+        if len(population) == size:
+            break
+    return population
+
+
+def tournament(
+    population: List[EvaluatedOptimizedFunctionResult], size: int, rng: random.Random
+) -> EvaluatedOptimizedFunctionResult:
+    """The best of `size` random members of a ranked population."""
+    contestants = rng.sample(range(len(population)), min(size, len(population)))
+    return population[min(contestants)]
+
+
+class EvolutionBudget:
+    """Wall clock time and fresh LLM tokens spent by an evolution."""
+
+    def __init__(self, config: EvolutionConfig, assistants: Iterable[CodeOptimizerAssistant]):
+        self.config = config
+        self.assistants = list(assistants)
+        self.start = time.perf_counter()
+        self.tokens_at_start = self._tokens()
+
+    def _tokens(self) -> int:
+        return sum(assistant.tokens_used for assistant in self.assistants)
+
+    @property
+    def elapsed_s(self) -> float:
+        return time.perf_counter() - self.start
+
+    @property
+    def tokens_used(self) -> int:
+        return self._tokens() - self.tokens_at_start
+
+    def exhausted(self) -> Optional[str]:
+        """Why the budget is spent, None while it is not."""
+        if self.config.time_budget_s is not None and self.elapsed_s >= self.config.time_budget_s:
+            return f"time budget of {self.config.time_budget_s:.0f}s spent"
+        if self.config.token_budget is not None and self.tokens_used >= self.config.token_budget:
+            return f"token budget of {self.config.token_budget} spent"
+        return None
+
+
+async def breed(
+    population: List[EvaluatedOptimizedFunctionResult],
+    assistants: Dict[str, CodeOptimizerAssistant],
+    source: str,
+    import_statements: List[str],
+    test_code: List[str],
+    generation: int,
+    config: EvolutionConfig,
+    rng: random.Random,
+) -> List[Candidate]:
+    """Make a child of the population with a single LLM request, by crossover or mutation.
+    The parents are drawn before the request, so concurrent breeds draw from `rng` in the order they start."""
+    first = tournament(population, config.tournament_size, rng)
+    coa = assistants.get(first.backend or "cython", next(iter(assistants.values())))
+    # parents of different backends do not share a language to combine
+    mates = [r for r in population if r is not first and r.backend == first.backend]
+    if mates and rng.random() < config.crossover_rate:
+        second = tournament(mates, config.tournament_size, rng)
+        children = await coa.crossover_code_async(
+            source,
+            [read_candidate(first), read_candidate(second)],
+            test_code,
+            choices=1,
+            import_statements=import_statements,
+        )
+        lineage = child_lineage(first, generation, "crossover", [second])
+    else:
+        mutation = rng.choice(mutations_for(first.backend))
+        children = await coa.refine_code_async(
+            first.error,
+            first.test_that_failed_src,
+            first.runtime_ms,
+            f"{mutation}, and keep what already made it fast",
+            choices=1,
+            previous_messages=first.previous_messages,
+            python_interaction=worst_lines(first.annotation),
+        )
+        lineage = child_lineage(first, generation, "mutation", mutation=mutation)
+    for child, _ in children:
+        child.lineage = lineage
+    return children
+
+
+def evolve(
+    results: List[EvaluatedOptimizedFunctionResult],
+    assistants: Dict[str, CodeOptimizerAssistant],
+    source: str,
+    import_statements: List[str],
+    test_code: List[str],
+    evaluate: Callable[[List[Candidate]], List[EvaluatedOptimizedFunctionResult]],
+    config: EvolutionConfig,
+    rank: Optional[Callable[[List[EvaluatedOptimizedFunctionResult]], List[EvaluatedOptimizedFunctionResult]]] = None,
+    on_generation: Optional[Callable[[int, List[EvaluatedOptimizedFunctionResult]], None]] = None,
+) -> List[EvaluatedOptimizedFunctionResult]:
+    """Evolve a population of evaluated candidates, generation after generation, until the
+    maximum number of generations or the budget is reached.
+
+    Every generation selects a diverse population of the best candidates so far, picks
+    parents by tournament selection and makes `config.offspring` children by LLM crossover
+    of two parents or by LLM mutation of one. The requests of a generation run concurrently.
+
+    Args:
+        results (List[EvaluatedOptimizedFunctionResult]): Evaluated initial candidates, may include the original.
+        assistants (Dict[str, CodeOptimizerAssistant]): Assistant per backend.
+        source (str): Source of the original function.
+        import_statements (List[str]): Imports of the original function.
+        test_code (List[str]): Sources of the tests, for crossover prompts.
+        evaluate (Callable): Compiles and benchmarks children, returns the ones that work.
+        config (EvolutionConfig): Search settings.
+        rank (Callable, optional): Orders results best first. Defaults to benchmark.rank_results.
+        on_generation (Callable, optional): Called with the number and the evaluated children of every generation.
+
+    Returns:
+        The evaluated children of all generations.
+    """
+    rng = random.Random(config.seed)
+    budget = EvolutionBudget(config, assistants.values())
+    offspring: List[EvaluatedOptimizedFunctionResult] = []
+    for generation in range(1, config.max_generations + 1):
+        reason = budget.exhausted()
+        if reason is not None:
+            logger.info(f"Stopping the evolution after {generation - 1} generations: {reason}")
+            break
+        population = select_population(results + offspring, config.population_size, config.max_similarity, rank)
+        if not population:
+            raise AllGenerationsFailedError("All generations failed")
+
+        async def breed_all():
+            return await asyncio.gather(
+                *(
+                    breed(population, assistants, source, import_statements, test_code, generation, config, rng)
+                    for _ in range(config.offspring)
+                ),
+                return_exceptions=True,
+            )
+
+        children: List[Candidate] = []
+        for bred in asyncio.run(breed_all()):
+            if isinstance(bred, BaseException):
+                logger.opt(exception=bred).error(f"Error in LLM request of generation {generation}")
+                continue
+            children += bred
+        evaluated = evaluate(children)
+        offspring += evaluated
+        logger.info(
+            f"Generation {generation}: {len(evaluated)} of {len(children)} children work, "
+            f"{budget.elapsed_s:.0f}s and {budget.tokens_used} tokens spent"
+        )
+        if on_generation is not None:
+            on_generation(generation, evaluated)
+    return offspring
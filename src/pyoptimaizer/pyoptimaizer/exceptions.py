@@ -10,5 +10,13 @@ class CodeExecutionError(Exception):
     pass
 
 
-class CythonCompilerError(Exception):
-    pass
\ No newline at end of file
+class BuildError(Exception):
+    pass
+
+
+class CythonCompilerError(BuildError):
+    pass
+
+
+class CacheMissError(Exception):
+    pass
@@ -0,0 +1,344 @@
+import cProfile
+import importlib.abc
+import json
+import os
+import pstats
+import runpy
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from loguru import logger
+from pydantic import BaseModel
+
+import pyoptimaizer
+from pyoptimaizer.benchmark import rank_results
+from pyoptimaizer.runner import import_module_from_file
+from pyoptimaizer.source_utils import get_top_level_functions
+from pyoptimaizer.types import EvaluatedOptimizedFunctionResult
+
+
+class Hotspot(BaseModel):
+    file_path: str
+    function_name: str
+    calls: int
+    # time spent in the function itself
+    self_s: float
+    # time spent in the function and everything it calls
+    cumulative_s: float
+    # cumulative time as a fraction of the profiled run, the part of the run an optimization can attack
+    fraction: float
+
+    @property
+    def function_path(self) -> str:
+        return f"{self.file_path}::{self.function_name}"
+
+
+class HotspotOutcome(BaseModel):
+    hotspot: Hotspot
+    optimized_function_path: Optional[str] = None
+    function_speedup: Optional[float] = None
+    # end-to-end speedup predicted by Amdahl's law from the fraction and the function speedup
+    predicted_speedup: Optional[float] = None
+
+
+class HotspotReport(BaseModel):
+    command: List[str]
+    outcomes: List[HotspotOutcome]
+    baseline_s: float
+    optimized_s: Optional[float] = None
+
+    @property
+    def end_to_end_speedup(self) -> Optional[float]:
+        if not self.optimized_s:
+            return None
+        return self.baseline_s / self.optimized_s
+
+
+def amdahl_speedup(fraction: float, speedup: float) -> float:
+    """Overall speedup when `fraction` of the runtime becomes `speedup` times faster."""
+    return 1 / ((1 - fraction) + fraction / speedup)
+
+
+class _ReplacingLoader(importlib.abc.Loader):
+    """Executes a module with its own loader, then swaps in replacement functions."""
+
+    def __init__(self, loader, replacements: List[Tuple[str, str]]):
+        self.loader = loader
+        self.replacements = replacements
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.loader.exec_module(module)
+        _replace_functions(module, self.replacements)
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+
+class _ReplacingFinder(importlib.abc.MetaPathFinder):
+    """Swaps in replacement functions in a module as soon as it is imported, under any name."""
+
+    def __init__(self, replacements: Dict[str, List[Tuple[str, str]]]):
+        self.replacements = replacements
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        origin = os.path.realpath(spec.origin) if spec.origin else None
+        if origin not in self.replacements or spec.loader is None:
+            return None
+        spec.loader = _ReplacingLoader(spec.loader, self.replacements[origin])
+        return spec
+
+
+def _replace_functions(module, replacements: List[Tuple[str, str]]):
+    for function_name, replacement_path in replacements:
+        replacement = import_module_from_file(replacement_path)
+        setattr(module, function_name, getattr(replacement, function_name))
+
+
+def run_command_main():
+    """Entry point of the child process of `run_python_command`."""
+    spec = json.loads(sys.argv[1])
+    replacements: Dict[str, List[Tuple[str, str]]] = {}
+    for file_path, function_name, replacement_path in spec["replacements"]:
+        replacements.setdefault(os.path.realpath(file_path), []).append((function_name, replacement_path))
+    for module in list(sys.modules.values()):
+        origin = os.path.realpath(getattr(module, "__file__", None) or "")
+        if origin in replacements:
+            _replace_functions(module, replacements[origin])
+    sys.meta_path.insert(0, _ReplacingFinder(replacements))
+
+    argv = spec["argv"]
+    sys.path.insert(0, os.getcwd())
+    profiler = cProfile.Profile() if spec["profile_path"] else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        if argv[0] == "-m":
+            sys.argv = argv[1:]
+            runpy.run_module(argv[1], run_name="__main__", alter_sys=True)
+        else:
+            sys.argv = argv
+            runpy.run_path(argv[0], run_name="__main__")
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(spec["profile_path"])
+
+
+def run_python_command(
+    argv: Sequence[str],
+    cwd: Optional[Union[str, Path]] = None,
+    replacements: Sequence[Tuple[str, str, str]] = (),
+    profile_path: Optional[Union[str, Path]] = None,
+) -> float:
+    """Run a python command in a child process, e.g. ["-m", "pytest", "tests"] or ["script.py", "arg"].
+
+    Args:
+        argv (Sequence[str]): Arguments to python, a script or -m with a module.
+        cwd (Union[str, Path], optional): Working directory, it is also put on the path.
+        replacements: (file path, function name, pyx path) of functions to replace by compiled candidates.
+        profile_path (Union[str, Path], optional): Write a cProfile profile of the run to this file.
+
+    Returns:
+        float: Wall time of the command in seconds.
+    """
+    spec = {
+        "argv": list(argv),
+        "replacements": [[str(f), name, str(r)] for f, name, r in replacements],
+        "profile_path": str(profile_path) if profile_path else None,
+    }
+    env = dict(os.environ)
+    package_root = str(Path(pyoptimaizer.__file__).parent.parent)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in [package_root, env.get("PYTHONPATH")] if p)
+    start = time.perf_counter()
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "from pyoptimaizer.hotspots import run_command_main; run_command_main()",
+            json.dumps(spec),
+        ],
+        cwd=cwd,
+        env=env,
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+def find_hotspots(
+    stats: pstats.Stats,
+    project_root: Union[str, Path],
+    top_n: int = 3,
+    sort_by: str = "cumulative",
+) -> List[Hotspot]:
+    """Rank the top-level functions of a project in a profile.
+
+    Only functions the optimizer can handle are considered: defined at the top level of
+    a module under `project_root`, outside of test files and generated code.
+
+    Args:
+        stats (pstats.Stats): Profile of a run.
+        project_root (Union[str, Path]): Root directory of the project.
+        top_n (int): Number of hotspots to return.
+        sort_by (str): "cumulative" or "self" time.
+    """
+    if sort_by not in ("cumulative", "self"):
+        raise ValueError(f"Unknown sort key {sort_by}")
+    project_root = Path(project_root).resolve()
+    total_s = stats.total_tt  # type: ignore
+    top_level_functions: Dict[Path, List[str]] = {}
+
+    hotspots = []
+    for (file_name, _, function_name), (_, calls, self_s, cumulative_s, _) in stats.stats.items():  # type: ignore
+        file_path = Path(file_name)
+        if not file_path.is_file() or file_path.suffix != ".py":
+            continue
+        file_path = file_path.resolve()
+        if project_root not in file_path.parents or ".tmp" in file_path.parts:
+            continue
+        if file_path.name.startswith("test_") or "tests" in file_path.relative_to(project_root).parts:
+            continue
+        if file_path not in top_level_functions:
+            top_level_functions[file_path] = get_top_level_functions(file_path)
+        if function_name not in top_level_functions[file_path]:
+            continue
+        hotspots.append(
+            Hotspot(
+                file_path=str(file_path),
+                function_name=function_name,
+                calls=calls,
+                self_s=self_s,
+                cumulative_s=cumulative_s,
+                fraction=cumulative_s / total_s if total_s else 0.0,
+            )
+        )
+
+    key = (lambda h: h.cumulative_s) if sort_by == "cumulative" else (lambda h: h.self_s)
+    return sorted(hotspots, key=key, reverse=True)[:top_n]
+
+
+def profile_hotspots(
+    argv: Sequence[str],
+    project_root: Union[str, Path],
+    top_n: int = 3,
+    sort_by: str = "cumulative",
+) -> Tuple[List[Hotspot], float]:
+    """Profile a python command and find its hotspots, see `find_hotspots`.
+
+    Returns:
+        The hotspots and the wall time of the profiled run in seconds.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        profile_path = Path(directory) / "profile.prof"
+        wall_s = run_python_command(argv, project_root, profile_path=profile_path)
+        stats = pstats.Stats(str(profile_path))
+    return find_hotspots(stats, project_root, top_n, sort_by), wall_s
+
+
+def time_python_command(
+    argv: Sequence[str],
+    cwd: Union[str, Path],
+    replacements: Sequence[Tuple[str, str, str]] = (),
+    repeats: int = 3,
+) -> float:
+    """Median wall time of a python command in seconds, see `run_python_command`."""
+    return statistics.median(run_python_command(argv, cwd, replacements) for _ in range(repeats))
+
+
+def optimize_hotspots(
+    argv: Sequence[str],
+    project_root: Union[str, Path],
+    top_n: int = 3,
+    sort_by: str = "cumulative",
+    repeats: int = 3,
+    optimize: Optional[Callable[[str], List[EvaluatedOptimizedFunctionResult]]] = None,
+) -> HotspotReport:
+    """Profile a command, optimize its top-N hotspots one after the other and measure the
+    end-to-end speedup of the command with the best candidate of every hotspot swapped in.
+
+    Args:
+        argv (Sequence[str]): Arguments to python, e.g. ["-m", "pytest", "tests"] or ["script.py"].
+        project_root (Union[str, Path]): Root directory of the project, the command runs in it.
+        top_n (int): Number of hotspots to optimize.
+        sort_by (str): Rank hotspots by "cumulative" or "self" time.
+        repeats (int): Number of timed runs of the command, before and after optimizing.
+        optimize (Callable, optional): Optimizes a function path. Defaults to cythonize_function.
+    """
+    if optimize is None:
+        # imported lazily, the optimizer pulls in the LLM clients and the UI
+        from pyoptimaizer.optimize import cythonize_function
+
+        optimize = cythonize_function
+
+    hotspots, _ = profile_hotspots(argv, project_root, top_n, sort_by)
+    logger.info(
+        "Hotspots: " + ", ".join(f"{h.function_name} ({h.fraction:.0%})" for h in hotspots)
+    )
+    baseline_s = time_python_command(argv, project_root, repeats=repeats)
+
+    outcomes = []
+    replacements = []
+    for hotspot in hotspots:
+        outcome = HotspotOutcome(hotspot=hotspot)
+        outcomes.append(outcome)
+        try:
+            results = optimize(hotspot.function_path)
+        except Exception:
+            logger.exception(f"Could not optimize hotspot {hotspot.function_path}")
+            continue
+        best = rank_results(results)[0] if results else None
+        if best is None or best.user_feedback == "Original function" or best.speedup is None:
+            logger.info(f"No candidate beat {hotspot.function_name}, keeping the original")
+            continue
+        outcome.optimized_function_path = str(best.optimized_function_path)
+        outcome.function_speedup = best.speedup
+        outcome.predicted_speedup = amdahl_speedup(hotspot.fraction, best.speedup)
+        replacements.append((hotspot.file_path, hotspot.function_name, outcome.optimized_function_path))
+
+    report = HotspotReport(command=list(argv), outcomes=outcomes, baseline_s=baseline_s)
+    if replacements:
+        report.optimized_s = time_python_command(argv, project_root, replacements, repeats)
+    logger.info(format_report(report))
+    return report
+
+
+def format_report(report: HotspotReport) -> str:
+    lines = [f"Hotspots of `{' '.join(report.command)}` (baseline {report.baseline_s:.2f}s)"]
+    for outcome in report.outcomes:
+        hotspot = outcome.hotspot
+        line = (
+            f"{hotspot.function_path}: {hotspot.fraction:.1%} of the run "
+            f"(self {hotspot.self_s:.3f}s, cumulative {hotspot.cumulative_s:.3f}s, {hotspot.calls} calls)"
+        )
+        if outcome.function_speedup is not None and outcome.predicted_speedup is not None:
+            line += (
+                f", function {outcome.function_speedup:.2f}x faster, "
+                f"at most {outcome.predicted_speedup:.2f}x end-to-end"
+            )
+        else:
+            line += ", not optimized"
+        lines.append(line)
+    if report.end_to_end_speedup is not None:
+        lines.append(
+            f"End-to-end: {report.baseline_s:.2f}s -> {report.optimized_s:.2f}s "
+            f"({report.end_to_end_speedup:.2f}x faster)"
+        )
+    return "\n".join(lines)
@@ -1,9 +1,14 @@
+import importlib.util
+import json
+import threading
+import time
 from pathlib import Path
-from typing import List
+from typing import Any, Callable, Dict, List, Optional, Set
 
+from loguru import logger
+
+from pyoptimaizer.reporter import BackgroundReporter, Sink, WebSocketSink
 from pyoptimaizer.types import EvaluatedOptimizedFunctionResult
-from pyoptimaizer.websocket_client import WebSocketClient
-import plotly.graph_objects as go
 
 def OptimizeHeadingElement(to_optimize):
     return f"<h1>Opti🌽ing {to_optimize}</h1>"
@@ -23,6 +28,9 @@ def EvaluatedOptimizedFunctionResultHeader():
     <tr>
         <th>Optimized Function Path</th>
         <th>Runtime (ms)</th>
+        <th>Speedup</th>
+        <th>Peak Memory (KiB)</th>
+        <th>Branch</th>
         <th>Function Name</th>
         <th>User Feedback</th>
     </tr>
@@ -53,109 +61,412 @@ def StatusElement(status: str):
     </span>
     """
 
-def PlotlyGraph(results: List[EvaluatedOptimizedFunctionResult]):
-    # Create a plotly figure
-    fig = go.Figure()
-    results = sorted(results, key=lambda x: x.runtime_ms)
-    # Add a bar chart
-    fig.add_trace(go.Bar(
-        x=[result.optimized_function_path.stem for result in results],
-        y=[result.runtime_ms for result in results],
-        marker_color='rgb(55, 83, 109)'
-    ))
-
-    # Update the layout
-    fig.update_layout(
-        title='Optimization Results',
-        xaxis_tickfont_size=14,
-        yaxis=dict(
-            title='Runtime (ms)',
-            titlefont_size=16,
-            tickfont_size=14,
-        ),
-        xaxis=dict(
-            title='Function Name',
-            titlefont_size=16,
-            tickfont_size=14,
-        ),
-        barmode='group',
-        bargap=0.15, # gap between bars of adjacent location coordinates
-        bargroupgap=0.1 # gap between bars of the same location coordinates
+# plain plotly.js layouts, so the page can be sent before plotly is imported
+RUNTIME_LAYOUT = dict(
+    title=dict(text='Optimization Results'),
+    yaxis=dict(
+        title=dict(text='Runtime (ms)', font=dict(size=16)),
+        tickfont=dict(size=14),
+    ),
+    xaxis=dict(
+        title=dict(text='Function Name', font=dict(size=16)),
+        tickfont=dict(size=14),
+    ),
+    barmode='group',
+    bargap=0.15, # gap between bars of adjacent location coordinates
+    bargroupgap=0.1 # gap between bars of the same location coordinates
+)
+
+SCALING_LAYOUT = dict(
+    title=dict(text='Runtime over input size'),
+    yaxis=dict(
+        title=dict(text='Runtime (ms)', font=dict(size=16)),
+        type='log',
+        tickfont=dict(size=14),
+    ),
+    xaxis=dict(
+        title=dict(text='Input size', font=dict(size=16)),
+        type='log',
+        tickfont=dict(size=14),
+    ),
+)
+
+THREAD_SCALING_LAYOUT = dict(
+    title=dict(text='Speedup over threads'),
+    yaxis=dict(
+        title=dict(text='Speedup over one thread', font=dict(size=16)),
+        tickfont=dict(size=14),
+    ),
+    xaxis=dict(
+        title=dict(text='Threads', font=dict(size=16)),
+        tickfont=dict(size=14),
+    ),
+)
+
+RUNTIME_BAR_COLOR = 'rgb(55, 83, 109)'
+
+def get_plotlyjs():
+    # read from the plotly package without importing it, the page is sent before anything needs plotly
+    spec = importlib.util.find_spec('plotly')
+    return (Path(spec.origin).parent / 'package_data' / 'plotly.min.js').read_text(encoding='utf-8')
+
+def ScalingTrace(result: EvaluatedOptimizedFunctionResult):
+    # runtime over input size of one candidate, on log-log axes a power law is a straight line
+    import plotly.graph_objects as go
+
+    return go.Scatter(
+        x=[point.size for point in result.scaling.points],
+        y=[point.median_s * 1000 for point in result.scaling.points],
+        mode='lines+markers',
+        name=f"{Path(result.optimized_function_path).stem} (n^{result.scaling.exponent:.2f})",
+    )
+
+def ThreadScalingTrace(result: EvaluatedOptimizedFunctionResult):
+    # speedup over the number of threads of one parallel candidate
+    import plotly.graph_objects as go
+
+    points = result.thread_scaling.points
+    return go.Scatter(
+        x=[point.threads for point in points],
+        y=[point.speedup for point in points],
+        mode='lines+markers',
+        name=f"{Path(result.optimized_function_path).stem} ({points[-1].efficiency:.0%} efficiency)",
+        customdata=[point.efficiency for point in points],
+        hovertemplate='%{y:.2f}x on %{x} threads, %{customdata:.0%} efficiency',
     )
 
-    # Return the plotly figure as an html div
-    return fig.to_html(full_html=True)
+def LinearSpeedupTrace(max_threads: int):
+    return dict(
+        type='scatter',
+        x=[1, max_threads],
+        y=[1, max_threads],
+        mode='lines',
+        line=dict(dash='dash', color='gray'),
+        name='Linear speedup',
+    )
 
 def AcceptButton(path: str):
     return f"""
     <button onclick="accept('{path}')">Accept</button>
     """
 
-def EvaluatedOptimizedFunctionResultRow(result: EvaluatedOptimizedFunctionResult):
+def SpeedupElement(result: EvaluatedOptimizedFunctionResult):
+    if result.speedup is None or result.speedup_ci is None:
+        return ""
+    low, high = result.speedup_ci
+    return f"{result.speedup:.2f}x <small>({low:.2f}x - {high:.2f}x)</small>"
+
+def MemoryElement(result: EvaluatedOptimizedFunctionResult):
+    if result.memory is None:
+        return ""
+    return f"{result.memory.peak_bytes / 1024:.0f}"
+
+def branch(result: EvaluatedOptimizedFunctionResult):
+    # the initial candidate a result descends from, the initial candidates are their own branch
+    if result.lineage is None:
+        return None
+    return result.lineage.root or str(result.optimized_function_path)
+
+def BranchElement(result: EvaluatedOptimizedFunctionResult, winning_branch=None):
+    if result.lineage is None:
+        return ""
+    element = f"{Path(branch(result)).stem} <small>(generation {result.lineage.generation})</small>"
+    if winning_branch is not None and branch(result) == winning_branch:
+        return f"<b>{element}</b>"
+    return element
+
+def EvaluatedOptimizedFunctionResultRow(result: EvaluatedOptimizedFunctionResult, winning_branch=None):
     return f"""
     <tr>
         <td>
             {GotoCodeAElement(result.optimized_function_path)}
         </td>
         <td>{result.runtime_ms:5}</td>
+        <td>{SpeedupElement(result)}</td>
+        <td>{MemoryElement(result)}</td>
+        <td class="branch">{BranchElement(result, winning_branch)}</td>
         <td>{result.function_name}</td>
         <td>{result.user_feedback}</td>
         <td>{AcceptButton(result.optimized_function_path)}</td>
     </tr>
     """
 
-def TableOfEvaluatedOptimizedFunctionResults(results: List[EvaluatedOptimizedFunctionResult]):
-    results = sorted(results, key=lambda x: x.runtime_ms)
-    return f"""
-    <table
-        style="margin: 20px 0;"
-    >
-        {EvaluatedOptimizedFunctionResultHeader()}
-        {"".join([EvaluatedOptimizedFunctionResultRow(result) for result in results])}
-    </table>
-    """
+SHELL_SCRIPT = """
+const layouts = %(layouts)s;
+const bars = {};
+let winner = null;
+let maxThreads = 1;
+Plotly.newPlot('runtime', [], layouts.runtime);
+Plotly.newPlot('scaling', [], layouts.scaling);
+Plotly.newPlot('threads', [%(linear)s], layouts.threads);
 
-def BodyElement(function_name:str, results: List[EvaluatedOptimizedFunctionResult], status:str):
-    return f"""
-    <body>
-        {OptimizeHeadingElement(function_name)}
-        {StatusElement(status)}
-        {TableOfEvaluatedOptimizedFunctionResults(results)}
-        {PlotlyGraph(results)}
-    </body>
-    """
+function markWinner(tr) {
+    tr.classList.toggle('winning', winner !== null && tr.dataset.branch === winner);
+}
+
+function upsertRow(row) {
+    const body = document.getElementById('results').tBodies[0];
+    const template = document.createElement('tbody');
+    template.innerHTML = row.html.trim();
+    const tr = template.firstElementChild;
+    tr.dataset.key = row.key;
+    tr.dataset.runtime = row.runtime;
+    tr.dataset.branch = row.branch === null ? '' : row.branch;
+    markWinner(tr);
+    const old = body.querySelector(`tr[data-key="${CSS.escape(row.key)}"]`);
+    if (old) {
+        old.remove();
+    }
+    // keep the rows ordered by runtime without sorting the whole table
+    const slower = Array.from(body.querySelectorAll('tr[data-key]')).find(r => parseFloat(r.dataset.runtime) > row.runtime);
+    if (slower) {
+        slower.before(tr);
+    } else {
+        body.appendChild(tr);
+    }
+    bars[row.name] = row.runtime;
+}
 
-def Page(function_name:str, results: List[EvaluatedOptimizedFunctionResult], status:str):
-    return (f"""
+function addTraces(plot, traces) {
+    const div = document.getElementById(plot);
+    if (div.classList.contains('empty')) {
+        div.classList.remove('empty');
+        Plotly.Plots.resize(div);
+    }
+    Plotly.addTraces(div, traces);
+    if (plot === 'threads') {
+        maxThreads = Math.max(maxThreads, ...traces.map(trace => Math.max(...trace.x)));
+        Plotly.restyle(div, {x: [[1, maxThreads]], y: [[1, maxThreads]]}, [0]);
+    }
+}
+
+function applyDelta(delta) {
+    if (delta.status !== undefined) {
+        document.getElementById('status').innerHTML = delta.status;
+    }
+    if (delta.winner !== undefined) {
+        winner = delta.winner;
+        document.querySelectorAll('tr[data-key]').forEach(markWinner);
+    }
+    if (delta.rows.length > 0) {
+        delta.rows.forEach(upsertRow);
+        const names = Object.keys(bars).sort((a, b) => bars[a] - bars[b]);
+        Plotly.react('runtime', [{type: 'bar', x: names, y: names.map(name => bars[name]), marker: {color: '%(bar_color)s'}}], layouts.runtime);
+    }
+    for (const [plot, traces] of Object.entries(delta.traces)) {
+        if (traces.length > 0) {
+            addTraces(plot, traces);
+        }
+    }
+}
+
+window.addEventListener('message', event => applyDelta(event.data));
+vscode.postMessage({message_type: 'ready'});
+"""
+
+def Shell(function_name: str):
+    # the static part of the page, plotly.js is embedded here once and the results arrive as deltas
+    layouts = {
+        'runtime': RUNTIME_LAYOUT,
+        'scaling': SCALING_LAYOUT,
+        'threads': THREAD_SCALING_LAYOUT,
+    }
+    script = SHELL_SCRIPT % {
+        'layouts': json.dumps(layouts),
+        'linear': json.dumps(LinearSpeedupTrace(1)),
+        'bar_color': RUNTIME_BAR_COLOR,
+    }
+    return f"""
         <!DOCTYPE html>
         <html>
             <head>
+                <script>{get_plotlyjs()}</script>
                 <script>
                     vscode = acquireVsCodeApi();
-                    console.log("hello");
                     function gotocode(path) {{
-                        console.log("gotocode", path);
                         vscode.postMessage({{
                             message_type: 'open_code_file',
                             message_data: path
                         }});
                     }}
                     function accept(path) {{
-                        console.log("accept", path);
                         vscode.postMessage({{
                             message_type: 'accept',
                             message_data: path
                         }});
                     }}
                 </script>
+                <style>
+                    tr.winning td.branch {{ font-weight: bold; }}
+                    .graph.empty {{ display: none; }}
+                </style>
             </head>
             <body>
-                {BodyElement(function_name, results, status)}
+                {OptimizeHeadingElement(function_name)}
+                <div id="status"></div>
+                <table id="results" style="margin: 20px 0;">
+                    {EvaluatedOptimizedFunctionResultHeader()}
+                </table>
+                <div id="runtime" class="graph"></div>
+                <div id="scaling" class="graph empty"></div>
+                <div id="threads" class="graph empty"></div>
+                <script>{script}</script>
             </body>
         </html>
-""")
+"""
+
+def RowDelta(result: EvaluatedOptimizedFunctionResult):
+    return {
+        'key': str(result.optimized_function_path),
+        'name': Path(result.optimized_function_path).stem,
+        'runtime': result.runtime_ms,
+        'branch': branch(result),
+        'html': EvaluatedOptimizedFunctionResultRow(result),
+    }
+
+def row_fingerprint(result: EvaluatedOptimizedFunctionResult):
+    # everything a row shows, a row is only formatted and sent again when this changes
+    return (
+        result.runtime_ms,
+        result.speedup,
+        result.speedup_ci,
+        result.memory.peak_bytes if result.memory is not None else None,
+        result.user_feedback,
+        result.lineage.generation if result.lineage is not None else None,
+        branch(result),
+    )
+
+class IncrementalRenderer:
+    """Sends the shell of the page once per optimized function and after that only JSON deltas:
+    rows that are new or changed, the status, the winning branch and new traces of the graphs.
+
+    Updates that arrive within `min_interval_s` of the last message are coalesced into a single
+    delta, which is sent once the interval is over, so a fast stream of evaluated candidates
+    costs at most one message per interval.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[Dict[str, Any]], None],
+        min_interval_s: float = 0.25,
+        clock: Callable[[], float] = time.monotonic,
+        timer: Callable[[float, Callable[[], None]], Any] = threading.Timer,
+    ):
+        """
+        Args:
+            send (Callable): Delivers a message, e.g. BackgroundReporter.report. It should not block.
+            min_interval_s (float): Minimum time between two deltas.
+            clock (Callable): Current time in seconds.
+            timer (Callable): Makes a timer that calls a function after a delay in seconds, once started.
+        """
+        self.send = send
+        self.min_interval_s = min_interval_s
+        self.clock = clock
+        self.timer = timer
+        self._lock = threading.Lock()
+        self._function_name: Optional[str] = None
+        self._last_sent = 0.0
+        self._timer: Optional[threading.Timer] = None
+
+    def _reset(self, function_name: str):
+        self._function_name = function_name
+        self._fingerprints: Dict[str, tuple] = {}
+        self._traced: Dict[str, Set[str]] = {'scaling': set(), 'threads': set()}
+        self._status: Optional[str] = None
+        self._winner: Optional[str] = None
+        # the latest state of everything that changed since the last delta, keyed so later updates replace earlier ones
+        self._pending: Dict[str, Any] = {}
+        self._pending_rows: Dict[str, EvaluatedOptimizedFunctionResult] = {}
+        self._pending_traces: Dict[str, Dict[str, EvaluatedOptimizedFunctionResult]] = {'scaling': {}, 'threads': {}}
+        self.send({'type': 'shell', 'function_name': function_name, 'html': Shell(function_name)})
+
+    def update(self, function_name: str, results: List[EvaluatedOptimizedFunctionResult], status: str):
+        with self._lock:
+            if function_name != self._function_name:
+                self._reset(function_name)
+            self._collect(results, status)
+            if self._timer is not None:
+                return
+            wait_s = self._last_sent + self.min_interval_s - self.clock()
+            if wait_s <= 0:
+                self._flush()
+            else:
+                # not a daemon, so the last delta of a run is sent before the process exits
+                self._timer = self.timer(wait_s, self.flush)
+                self._timer.start()
+
+    def _collect(self, results: List[EvaluatedOptimizedFunctionResult], status: str):
+        if status != self._status:
+            self._status = status
+            self._pending['status'] = StatusElement(status)
+            self._pending['status_text'] = status
+        fastest = None
+        for result in results:
+            key = str(result.optimized_function_path)
+            fingerprint = row_fingerprint(result)
+            if self._fingerprints.get(key) != fingerprint:
+                self._fingerprints[key] = fingerprint
+                self._pending_rows[key] = result
+            if result.scaling is not None and key not in self._traced['scaling']:
+                self._traced['scaling'].add(key)
+                self._pending_traces['scaling'][key] = result
+            if result.thread_scaling is not None and key not in self._traced['threads']:
+                self._traced['threads'].add(key)
+                self._pending_traces['threads'][key] = result
+            if fastest is None or result.runtime_ms < fastest.runtime_ms:
+                fastest = result
+        winner = branch(fastest) if fastest is not None else None
+        if winner != self._winner:
+            self._winner = winner
+            self._pending['winner'] = winner
+
+    def flush(self):
+        """Send the pending delta now."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._timer = None
+        if not (self._pending or self._pending_rows or any(self._pending_traces.values())):
+            return
+        delta = {
+            'type': 'delta',
+            **self._pending,
+            # rows are only formatted here, once per delta, however often they changed in between
+            'rows': [RowDelta(result) for result in self._pending_rows.values()],
+            'traces': {
+                'scaling': [ScalingTrace(result) for result in self._pending_traces['scaling'].values()],
+                'threads': [ThreadScalingTrace(result) for result in self._pending_traces['threads'].values()],
+            },
+        }
+        self._pending = {}
+        self._pending_rows = {}
+        self._pending_traces = {'scaling': {}, 'threads': {}}
+        self._last_sent = self.clock()
+        try:
+            self.send(delta)
+        except Exception:
+            logger.exception("Error sending a UI update")
+
+_renderer: Optional[IncrementalRenderer] = None
+_reporter: Optional[BackgroundReporter] = None
+
+def configure_reporting(sink: Sink):
+    """Send the UI updates of `render` to a sink, on a background thread. Defaults to the VS Code extension."""
+    global _renderer, _reporter
+    _reporter = BackgroundReporter(sink)
+    _renderer = IncrementalRenderer(_reporter.report)
+
+def close_reporting(timeout: float = 2):
+    """Send the pending UI updates of `render` and stop reporting, for processes that exit without running atexit."""
+    global _renderer, _reporter
+    if _renderer is not None:
+        _renderer.flush()
+    if _reporter is not None:
+        _reporter.close(timeout)
+    _renderer, _reporter = None, None
 
 def render(function_name:str, results: List[EvaluatedOptimizedFunctionResult], status:str):
-    WebSocketClient.i().send({
-        Page(function_name, results, status)
-    })
\ No newline at end of file
+    if _renderer is None:
+        configure_reporting(WebSocketSink())
+    _renderer.update(function_name, results, status)
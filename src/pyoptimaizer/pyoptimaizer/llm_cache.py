@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from enum import Enum
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional, Union
+
+from loguru import logger
+
+from pyoptimaizer.build_cache import default_cache_dir as default_build_cache_dir
+from pyoptimaizer.exceptions import CacheMissError
+from pyoptimaizer.utils import jsonable
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletion
+
+
+class CacheMode(str, Enum):
+    # never read or write the cache, the default: a retry after a bad completion must get a new one
+    OFF = "off"
+    # answer from the cache when possible, store every new response that parses
+    READ_WRITE = "read_write"
+    # always ask the LLM and overwrite the cached responses
+    RECORD = "record"
+    # only answer from the cache, a miss raises CacheMissError instead of hitting the network
+    REPLAY = "replay"
+
+
+def default_cache_dir() -> Path:
+    """Get the directory of the LLM response cache, next to the build cache."""
+    return default_build_cache_dir().parent / "llm"
+
+
+def default_cache_mode() -> CacheMode:
+    """Get the cache mode, can be set with the PYOPTIMAIZER_LLM_CACHE environment variable.
+    Off by default, identical requests would otherwise always get the same completion."""
+    return CacheMode(os.environ.get("PYOPTIMAIZER_LLM_CACHE", CacheMode.OFF.value))
+
+
+def request_key(
+    model: str,
+    messages: List,
+    n: int,
+    response_format: Optional[dict] = None,
+    seed: Optional[int] = None,
+) -> str:
+    """Get the cache key of a chat completion request.
+    Messages are hashed in full, so a new prompt template version is a new key."""
+    request = {
+        "model": model,
+        "messages": [jsonable(m) for m in messages],
+        "n": n,
+        "response_format": response_format,
+        "seed": seed,
+    }
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+
+class LLMResponseCache:
+    """On-disk cache of chat completions, keyed by `request_key`.
+
+    Every entry is a json file with the full completion. Like the build cache, the
+    modification time of an entry is bumped on every hit and the least recently used
+    entries are evicted once the cache grows beyond `max_size_bytes`.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[Union[str, Path]] = None,
+        max_size_bytes: int = 64 * 1024 * 1024,
+        mode: Optional[CacheMode] = None,
+    ):
+        """
+        Args:
+            cache_dir (Union[str, Path], optional): Directory of the cache. Defaults to the user-wide cache.
+            max_size_bytes (int): Maximum size of all cached responses.
+            mode (CacheMode, optional): Defaults to the PYOPTIMAIZER_LLM_CACHE environment variable, or off.
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir else default_cache_dir()
+        self.max_size_bytes = max_size_bytes
+        self.mode = CacheMode(mode) if mode else default_cache_mode()
+        self._lock = threading.Lock()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def lookup(self, key: str) -> Optional["ChatCompletion"]:
+        """Get a cached response.
+
+        Returns:
+            The cached completion, or None when the LLM has to be asked.
+        Raises:
+            CacheMissError: In replay mode, when the response is not cached.
+        """
+        if self.mode in (CacheMode.OFF, CacheMode.RECORD):
+            return None
+        from openai.types.chat import ChatCompletion
+
+        entry = self._entry_path(key)
+        try:
+            completion = ChatCompletion.model_validate_json(entry.read_text())
+            os.utime(entry)
+        except (OSError, ValueError):
+            if self.mode == CacheMode.REPLAY:
+                raise CacheMissError(f"No cached LLM response for request {key[:12]}")
+            return None
+        logger.info(f"LLM cache hit for request {key[:12]}")
+        return completion
+
+    def store(self, key: str, completion: "ChatCompletion"):
+        """Store a response, unless one of its choices is not the json that was asked for."""
+        if self.mode in (CacheMode.OFF, CacheMode.REPLAY):
+            return
+        try:
+            for choice in completion.choices:
+                json.loads(choice.message.content or "")
+        except ValueError:
+            logger.info(f"Not caching LLM response {key[:12]}, it is not valid json")
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first, so concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(completion.model_dump_json())
+            os.replace(tmp_path, self._entry_path(key))
+        except OSError:
+            logger.warning(f"Could not store LLM response {key[:12]}")
+            Path(tmp_path).unlink(missing_ok=True)
+            return
+        self.evict()
+
+    def size_bytes(self) -> int:
+        return sum(f.stat().st_size for f in self.cache_dir.glob("*.json"))
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in `max_size_bytes`."""
+        with self._lock:
+            entries = []
+            for entry in self.cache_dir.glob("*.json"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry))
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in sorted(entries, key=lambda x: x[0]):
+                if total <= self.max_size_bytes:
+                    break
+                entry.unlink(missing_ok=True)
+                total -= size
+
+    def clear(self):
+        for entry in self.cache_dir.glob("*.json"):
+            entry.unlink(missing_ok=True)
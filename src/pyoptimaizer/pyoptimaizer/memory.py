@@ -0,0 +1,181 @@
+import ctypes
+import gc
+import os
+import shlex
+import subprocess
+import sys
+import sysconfig
+import tempfile
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from loguru import logger
+
+from pyoptimaizer.build_cache import default_cache_dir, extension_suffix, python_abi, source_digest
+from pyoptimaizer.types import MemoryUsage
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None  # type: ignore
+
+_PROC_STATUS = "/proc/self/status"
+_PROC_CLEAR_REFS = "/proc/self/clear_refs"
+
+
+def _read_status_kb(field: str) -> Optional[int]:
+    try:
+        with open(_PROC_STATUS) as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss() -> bool:
+    """Reset the peak resident set size of this process to its current size.
+    Only possible on Linux, returns whether it worked."""
+    try:
+        with open(_PROC_CLEAR_REFS, "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def current_rss_bytes() -> Optional[int]:
+    kb = _read_status_kb("VmRSS")
+    return kb * 1024 if kb is not None else None
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process, since the last reset_peak_rss."""
+    kb = _read_status_kb("VmHWM")
+    if kb is None:
+        if resource is None:
+            return 0
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+    return kb * 1024
+
+
+_ALLOCATION_COUNTER_SOURCE = Path(__file__).with_name("allocation_counter.c")
+# the loaded counter of this process, False when it cannot be built
+_allocation_counter = None
+
+
+def _build_allocation_counter(library_path: Path):
+    # a plain shared library, compiled with the compiler and flags Python was built with
+    include = sysconfig.get_paths()["include"]
+    command = [
+        *shlex.split(sysconfig.get_config_var("CC") or "cc"),
+        *shlex.split(sysconfig.get_config_var("CCSHARED") or ""),
+        "-O2",
+        f"-I{include}",
+        "-shared",
+        *(["-undefined", "dynamic_lookup"] if sys.platform == "darwin" else []),
+        str(_ALLOCATION_COUNTER_SOURCE),
+    ]
+    library_path.parent.mkdir(parents=True, exist_ok=True)
+    # compiled next to it first, so other processes never load a partial library
+    fd, tmp_path = tempfile.mkstemp(dir=library_path.parent, suffix=extension_suffix())
+    os.close(fd)
+    try:
+        subprocess.run([*command, "-o", tmp_path], check=True, capture_output=True)
+        os.replace(tmp_path, library_path)
+    finally:
+        Path(tmp_path).unlink(missing_ok=True)
+
+
+def allocation_counter():
+    """The counter of the allocations of the Python allocators, built and loaded on first use.
+    Its start() hooks the allocators and stop() removes the hooks and returns the count.
+    None where it cannot be built, e.g. without a C compiler or on Windows."""
+    global _allocation_counter
+    if _allocation_counter is None:
+        _allocation_counter = False
+        key = source_digest(_ALLOCATION_COUNTER_SOURCE.read_text() + python_abi())
+        library_path = default_cache_dir().parent / "tools" / f"allocation_counter_{key}{extension_suffix()}"
+        try:
+            if not library_path.exists():
+                _build_allocation_counter(library_path)
+            # PyDLL keeps the GIL during the calls, the allocators must not change under other threads
+            library = ctypes.PyDLL(str(library_path))
+            library.start.restype = None
+            library.stop.restype = ctypes.c_ulonglong
+            _allocation_counter = library
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.debug(f"Not counting allocations, the counter cannot be built: {e}")
+    return _allocation_counter or None
+
+
+def count_allocations(func: Callable[[], object]) -> Optional[int]:
+    """Number of allocations of the Python allocators during a call, including blocks it
+    freed again. None when the allocation counter is not available."""
+    counter = allocation_counter()
+    if counter is None:
+        return None
+    counter.start()
+    try:
+        func()
+    finally:
+        allocations = counter.stop()
+    # calling into the counter allocates a little by itself
+    counter.start()
+    overhead = counter.stop()
+    return max(0, allocations - overhead)
+
+
+def measure_memory(func: Callable[[], object]) -> MemoryUsage:
+    """Measure the memory a single call of a callable takes.
+
+    The call runs twice: once untraced for the peak resident set size, which also sees
+    memory that C code allocates with plain malloc, and for the number of allocations,
+    and once under tracemalloc for the peak of the Python allocators, which is exact
+    but misses such memory.
+    """
+    # workers benchmark many candidates in one process, so the peak of earlier ones must not count
+    gc.collect()
+    rss_peak = None
+    rss_before = current_rss_bytes() if reset_peak_rss() else None
+    # the counter only counts, it does not take memory of its own
+    allocations = count_allocations(func)
+    if allocations is None and rss_before is not None:
+        func()
+    if rss_before is not None:
+        rss_peak = max(0, peak_rss_bytes() - rss_before)
+
+    gc.collect()
+    blocks_before = sys.getallocatedblocks()
+    tracemalloc.start()
+    try:
+        func()
+        _, traced_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    gc.collect()
+    return MemoryUsage(
+        traced_peak_bytes=traced_peak,
+        rss_peak_bytes=rss_peak,
+        retained_blocks=max(0, sys.getallocatedblocks() - blocks_before),
+        allocations=allocations,
+    )
+
+
+def combine_memory(usages: Iterable[MemoryUsage]) -> Optional[MemoryUsage]:
+    """Worst case memory usage over several tests."""
+    usages = list(usages)
+    if not usages:
+        return None
+    rss_peaks = [u.rss_peak_bytes for u in usages if u.rss_peak_bytes is not None]
+    allocations = [u.allocations for u in usages if u.allocations is not None]
+    return MemoryUsage(
+        traced_peak_bytes=max(u.traced_peak_bytes for u in usages),
+        rss_peak_bytes=max(rss_peaks) if rss_peaks else None,
+        retained_blocks=max(u.retained_blocks for u in usages),
+        allocations=max(allocations) if allocations else None,
+    )
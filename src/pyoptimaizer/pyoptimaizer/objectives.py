@@ -0,0 +1,157 @@
+import math
+from typing import List, Literal, Optional, Tuple
+
+from pydantic import BaseModel
+
+from pyoptimaizer.benchmark import rank_results
+from pyoptimaizer.types import EvaluatedOptimizedFunctionResult
+
+
+class ObjectiveConfig(BaseModel):
+    # "runtime" ranks by runtime only, "pareto" by the fronts of runtime and peak memory,
+    # "weighted" by a weighted score of both
+    mode: Literal["runtime", "pareto", "weighted"] = "runtime"
+    # weights of the log runtime and the log peak memory in the weighted score,
+    # e.g. with equal weights 2x faster at 2x the memory is a tie
+    runtime_weight: float = 1.0
+    memory_weight: float = 1.0
+    # peak memories within this fraction of each other are a tie
+    memory_tolerance: float = 0.05
+    # added to every peak, so a few kilobytes more on a tiny peak do not count as a regression
+    memory_slack_bytes: int = 64 * 1024
+    # number of parents taken from the pareto front every refinement generation
+    max_parents: int = 2
+
+
+def peak_memory_bytes(result: EvaluatedOptimizedFunctionResult) -> Optional[int]:
+    if result.memory is None:
+        return None
+    return result.memory.peak_bytes
+
+
+def uses_less_memory(
+    a: EvaluatedOptimizedFunctionResult, b: EvaluatedOptimizedFunctionResult, config: ObjectiveConfig
+) -> bool:
+    """Whether a clearly takes less memory than b. Unmeasured memory is never less."""
+    peak_a, peak_b = peak_memory_bytes(a), peak_memory_bytes(b)
+    if peak_a is None or peak_b is None:
+        return False
+    return (peak_a + config.memory_slack_bytes) * (1 + config.memory_tolerance) < peak_b + config.memory_slack_bytes
+
+
+def runtime_interval(result: EvaluatedOptimizedFunctionResult) -> Tuple[float, float]:
+    """Confidence interval of the runtime in ms, from the speedup interval against the original.
+    A single point when the result has no interval."""
+    if result.speedup is None or result.speedup_ci is None:
+        return result.runtime_ms, result.runtime_ms
+    low, high = result.speedup_ci
+    return result.runtime_ms * result.speedup / high, result.runtime_ms * result.speedup / max(low, 1e-12)
+
+
+def dominates(
+    a: EvaluatedOptimizedFunctionResult,
+    b: EvaluatedOptimizedFunctionResult,
+    config: ObjectiveConfig,
+    runtime_a: Optional[Tuple[float, float]] = None,
+    runtime_b: Optional[Tuple[float, float]] = None,
+) -> bool:
+    """Whether a is at least as good as b in runtime and memory, and clearly better in one of them.
+    A result is clearly faster when its runtime interval lies below the other one, the intervals
+    default to `runtime_interval`."""
+    low_a, high_a = runtime_a or runtime_interval(a)
+    low_b, high_b = runtime_b or runtime_interval(b)
+    faster = high_a < low_b
+    slower = high_b < low_a
+    less_memory = uses_less_memory(a, b, config)
+    more_memory = uses_less_memory(b, a, config)
+    return not slower and not more_memory and (faster or less_memory)
+
+
+def pareto_fronts(
+    results: List[EvaluatedOptimizedFunctionResult], config: ObjectiveConfig
+) -> List[List[EvaluatedOptimizedFunctionResult]]:
+    """Sort results into non-dominated fronts: the first front holds the results no other
+    result dominates, the second those only the first front dominates, and so on."""
+    # every pair is compared, so compare the intervals instead of bootstrapping every pair
+    runtimes = {id(r): runtime_interval(r) for r in results}
+    fronts = []
+    remaining = list(results)
+    while remaining:
+        front = [
+            r
+            for r in remaining
+            if not any(dominates(o, r, config, runtimes[id(o)], runtimes[id(r)]) for o in remaining if o is not r)
+        ]
+        if not front:
+            # ties within the tolerances are not transitive, never get stuck on a cycle
+            front = remaining
+        fronts.append(front)
+        remaining = [r for r in remaining if not any(r is f for f in front)]
+    return fronts
+
+
+def weighted_score(result: EvaluatedOptimizedFunctionResult, config: ObjectiveConfig) -> float:
+    """Weighted sum of the log runtime and log peak memory, lower is better.
+    Logs make the score depend on ratios only, so runtime and memory need no common unit."""
+    score = config.runtime_weight * math.log(max(result.runtime_ms, 1e-9))
+    peak = peak_memory_bytes(result)
+    if peak is not None:
+        score += config.memory_weight * math.log(peak + config.memory_slack_bytes)
+    return score
+
+
+def rank_by_objectives(
+    results: List[EvaluatedOptimizedFunctionResult],
+    config: Optional[ObjectiveConfig] = None,
+    confidence: float = 0.95,
+) -> List[EvaluatedOptimizedFunctionResult]:
+    """Order results from best to worst on the configured objectives.
+    Within a pareto front, results are ordered by runtime as in rank_results."""
+    config = config or ObjectiveConfig()
+    if config.mode == "pareto":
+        return [r for front in pareto_fronts(results, config) for r in rank_results(front, confidence)]
+    if config.mode == "weighted":
+        return sorted(results, key=lambda r: weighted_score(r, config))
+    return rank_results(results, confidence)
+
+
+def refinable(results: List[EvaluatedOptimizedFunctionResult]) -> List[EvaluatedOptimizedFunctionResult]:
+    """The results that can be refined, in their order. The original function has no lineage,
+    the LLM never wrote it, so there is no code in its conversation to refine."""
+    return [result for result in results if result.lineage is not None]
+
+
+def select_parents(
+    results: List[EvaluatedOptimizedFunctionResult],
+    config: Optional[ObjectiveConfig] = None,
+    confidence: float = 0.95,
+) -> List[EvaluatedOptimizedFunctionResult]:
+    """Pick the results to refine in the next generation: the best result, or with pareto
+    ranking up to max_parents results of the first front, spread from fastest to leanest.
+    The original function is never picked, see refinable."""
+    config = config or ObjectiveConfig()
+    results = refinable(results)
+    if not results:
+        return []
+    if config.mode != "pareto":
+        return rank_by_objectives(results, config, confidence)[:1]
+    front = rank_results(pareto_fronts(results, config)[0], confidence)
+    if len(front) <= config.max_parents:
+        return front
+    # the ends of the front are the fastest and the leanest result, fill up evenly in between
+    step = (len(front) - 1) / max(config.max_parents - 1, 1)
+    return [front[round(i * step)] for i in range(config.max_parents)]
+
+
+def objective_feedback(result: EvaluatedOptimizedFunctionResult, config: Optional[ObjectiveConfig] = None) -> str:
+    """Feedback for refining a result, asking to reduce memory as well when it is an objective."""
+    config = config or ObjectiveConfig()
+    peak = peak_memory_bytes(result)
+    if config.mode == "runtime" or peak is None:
+        return result.user_feedback
+    allocations = result.memory.allocations if result.memory is not None else None
+    counted = f" in {allocations} allocations" if allocations is not None else ""
+    return (
+        f"{result.user_feedback}. It allocates {peak / 1024:.0f} KiB at its peak{counted}, "
+        "reduce its memory use as well as its runtime: avoid temporary copies and large intermediate allocations"
+    )
@@ -1,137 +1,171 @@
-import importlib
-import importlib.util
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
-import subprocess
 import sys
-from typing import IO, List, Tuple, Union, cast
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Sequence, Tuple
+from pyoptimaizer.annotation import annotation_feedback, read_annotation, worst_lines
+from pyoptimaizer.autotune import autotune_candidates, default_grid, replace_with_selected_builds, write_build_variant
+from pyoptimaizer.backends import available_backends, compile_pyx_to_so, get_backend
+from pyoptimaizer.benchmark import BenchmarkConfig, speedup
+from pyoptimaizer.build_cache import BuildCache
+from pyoptimaizer.capture import CORPUS_TEST_NAME, find_corpus
 from pyoptimaizer.display import display_ordered_runtimes
-from pyoptimaizer.exceptions import AllGenerationsFailedError, AllTestFailedError, CythonCompilerError
+from pyoptimaizer.evolution import EvolutionConfig, child_lineage, evolve
+from pyoptimaizer.exceptions import (
+    AllGenerationsFailedError,
+    AllTestFailedError,
+    BuildError,
+    CodeExecutionError,
+)
 from pyoptimaizer.html_display import render
-from pyoptimaizer.source_utils import get_imports, get_source_code_of_function
+from pyoptimaizer.memory import combine_memory
+from pyoptimaizer.objectives import ObjectiveConfig, objective_feedback, rank_by_objectives, refinable, select_parents
+from pyoptimaizer.parallel import PARALLEL_BACKEND, ParallelConfig, rank_by_threads, sweep_threads, thread_feedback
+from pyoptimaizer.source_utils import function_source
 from pyoptimaizer.assistants import (
     AssistantCodeOptimizationResult,
-    CythonCodeOptimizerAssistant,
+    AssistantCodeTestCreateResult,
+    CodeOptimizerAssistant,
     PythonTestCreatorAssistant,
 )
-from pyoptimaizer.types import EvaluatedOptimizedFunctionResult
-from pyoptimaizer.utils import Process, retry
-from pyoptimaizer.source_utils import get_lines_of_function
+from pyoptimaizer.racing import RaceConfig, SuccessiveHalvingRace
+from pyoptimaizer.runner import (
+    FaultyTestError,
+    get_all_test_functions_in_module,
+    import_module_from_file,
+    run_test_file_with_replacement_function,
+)
+from pyoptimaizer.results_store import ResultsStore
+from pyoptimaizer.scaling import ScalingConfig, generate_workload, rank_at_size, sweep_results
+from pyoptimaizer.stages import StageTimings
+from pyoptimaizer.throughput import (
+    RANKING_KEYS,
+    ThroughputConfig,
+    rank_by_throughput,
+    sweep_throughput,
+    throughput_feedback,
+)
+from pyoptimaizer.scheduler import (
+    BenchmarkScheduler,
+    available_cores,
+    partition_cores,
+)
+from pyoptimaizer.types import AnnotatedLine, BenchmarkResult, BuildConfig, EvaluatedOptimizedFunctionResult, Lineage
+from pyoptimaizer.utils import retry
+from pyoptimaizer.worker_pool import BenchmarkWorkerPool
 from loguru import logger
-from timeit import Timer
-from openai.types.chat import ChatCompletionMessage
-
-
-def get_all_test_functions_in_module(module):
-    """Get all functions in a module.
-    Args:
-        module: Module to get functions from.
-    """
-    funcs = []
-    for name in dir(module):
-        attr = getattr(module, name)
-        if callable(attr) and name.startswith("test"):
-            funcs.append(attr)
-    return funcs
-
-class FaultyTestError(Exception):
-    def __init__(self, test_name, function):
-        self.test_name = test_name
-        self.function = function
-        super().__init__(f"Error running test {test_name} with {function}")
-
-def run_test_file_with_replacement_function(
-    test_file_path, replacement_function_path, function_name
-):
-    """Run a test file with a cythonized function.
-    Args:
-        test_file (str): Path to the test file.
-        optimized_function_path (str): Path to the optimized function.
-        function_name (str): Name of the function to test.
-    """
-    test_module = import_module_from_file(test_file_path)
-    replacement_module = import_module_from_file(replacement_function_path)
-    replacement_func = getattr(replacement_module, function_name)
-    setattr(test_module, function_name, replacement_func)
-    # run tests
-    tests = get_all_test_functions_in_module(test_module)
-    # benchmark tests
-    avg_times = {}
-    for test in tests:
-        t = Timer(test)
-        try:
-            num_of_trials, total_time = t.autorange()
-        except Exception as e:
-            raise FaultyTestError(test.__name__, Path(replacement_function_path).stem) from e
-        avg_time = total_time / num_of_trials
-        print(f"{test.__name__}: avg {avg_time} (s) over {num_of_trials} trials")
-        avg_times[test.__name__] = avg_time
 
-    # TODO: lets return the avg of all tests for now (maybe replace with geometric mean or whatever)
-    return sum(avg_times.values()) / len(avg_times)
-
-
-def import_module_from_file(file_path: Union[str, Path]):
-    """Import a module from a file path.
-    Args:
-        file_path (Union[str, Path]): Path to the file to import.
-    """
-    file_path = Path(file_path)
-    module_name = file_path.stem
-    spec = importlib.util.spec_from_file_location(module_name, file_path)
-    if spec is None:  # import pyx from .so
-        # TODO: figure out how to handle pyximport better
-        so_files = list(file_path.parent.glob(f"{module_name}.*.so"))
-        # pick first one for now
-        file_path = so_files[0]
-        spec = importlib.util.spec_from_file_location(module_name, file_path)
-    module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(module)
-    return module
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletionMessage
 
 
 @retry(
     3,
     (
-        CythonCompilerError,
+        BuildError,
         AllTestFailedError,
         IndentationError,
         AllGenerationsFailedError,
     ), # type: ignore
 )
 def cythonize_function(
-    function_path: str, test_function_paths: List[str] = [], refine_depth=2
-):
+    function_path: str,
+    test_function_paths: List[str] = [],
+    refine_depth=2,
+    racing: bool = True,
+    stage_timings: Optional[StageTimings] = None,
+    scaling_config: Optional[ScalingConfig] = None,
+    objectives: Optional[ObjectiveConfig] = None,
+    autotune_top: int = 1,
+    backends: Sequence[str] = ("cython",),
+    parallel: Optional[ParallelConfig] = None,
+    throughput: Optional[ThroughputConfig] = None,
+    rank_by: str = "runtime",
+    evolution: Optional[EvolutionConfig] = None,
+    beam_width: int = 1,
+    results_store: Optional[ResultsStore] = None,
+    warm_start: int = 2,
+) -> List[EvaluatedOptimizedFunctionResult]:
     """Top-level function for optimizing a function.
     Creates new files in the user's workspace with the optimized function and tests.
 
     Args:
         function_path (str): Path to file with function, e.g. /path/to/file.py::function_name
         test_function_paths (List[str]): Paths to files with test functions, e.g. /path/to/test.py::test_function_name
+        refine_depth (int): Number of refinement generations.
+        racing (bool): Stop benchmarking clearly losing candidates early.
+        stage_timings (StageTimings, optional): Collects the time spent in every stage.
+        scaling_config (ScalingConfig, optional): Also time every candidate over a sweep of input sizes.
+            With a target size, the candidate that is fastest at that size is refined.
+        objectives (ObjectiveConfig, optional): Rank on runtime and peak memory, refining parents
+            from the pareto front or the best weighted score. Defaults to ranking on runtime.
+        autotune_top (int): Number of best candidates to rebuild with a grid of compiler flags
+            and Cython directives, see autotune. 0 disables autotuning.
+        backends (Sequence[str]): Backends that generate candidates, see backends.BACKENDS.
+            Their candidates compete in the same generations, backends that are not installed are skipped.
+        parallel (ParallelConfig, optional): Also generate OpenMP candidates and benchmark them on 1, 2, 4, ...
+            threads. Depending on `parallel.prefer`, the best single-thread or many-thread candidate is refined.
+        throughput (ThroughputConfig, optional): Also measure the calls per second of every candidate
+            called from several threads at once, and whether it releases the GIL.
+        rank_by (str): Ranking key of the refinement, "runtime" of a single call or "throughput" of
+            concurrent calls. Ranking by throughput measures it with the default settings when
+            `throughput` is not given.
+        evolution (EvolutionConfig, optional): Evolve a population with tournament selection, LLM crossover
+            and mutation until a generation or budget limit, instead of refining the best candidates
+            for `refine_depth` generations.
+        beam_width (int): Number of best candidates that are refined every generation. The refinements
+            of all beams are requested and evaluated concurrently, and every candidate records its branch.
+        results_store (ResultsStore, optional): Database the tests and the evaluated candidates are stored in.
+            Defaults to the user-wide store.
+        warm_start (int): Number of best candidates of earlier runs to start from, of the same function or
+            of a similar earlier version of it. The tests of an earlier run on the same function are reused.
+            0 starts from nothing, the results are still stored.
     """
+    if rank_by not in RANKING_KEYS:
+        raise ValueError(f"Unknown ranking key {rank_by}, choose from {', '.join(RANKING_KEYS)}")
+    if beam_width < 1:
+        raise ValueError(f"The beam width must be at least 1, got {beam_width}")
+    if rank_by == "throughput" and throughput is None:
+        throughput = ThroughputConfig()
+    stage_timings = stage_timings or StageTimings()
+    if parallel is not None and PARALLEL_BACKEND not in backends:
+        backends = tuple(backends) + (PARALLEL_BACKEND,)
     evaluated_results = []
     # get the relevant code from the file as a string
     function_file_path = Path(function_path.split("::")[0])
     function_name = function_path.split("::")[1]
 
-    imports = get_imports(function_file_path)
-    source = get_source_code_of_function(function_file_path, function_name)
+    imports, source = function_source(function_file_path, function_name)
     
     logger.info(f"Optimizing function {function_name} in {function_file_path}")
     render(function_name, evaluated_results, "Generating tests...")
 
+    results_store = results_store or ResultsStore()
+    stored_tests = results_store.load_tests(source) if warm_start > 0 else None
     nr_of_tests = 5
-    test_create_results, test_path = generate_tests(function_path, nr_of_tests)
+    with stage_timings.measure("generate_tests"):
+        if stored_tests is not None:
+            logger.info("Reusing the tests of an earlier run")
+            test_create_results = stored_tests
+            test_path = write_test_results_to_file(test_create_results, function_file_path, function_name)
+        else:
+            test_create_results, test_path = generate_tests(function_path, nr_of_tests)
     
     render(function_name, evaluated_results, "Tests generated! Generating code...")
 
     # get the relevant code from the test files as a string
-    coa = CythonCodeOptimizerAssistant()
-    results = coa.optimize_code_initial(
-        source,
-        choices=4,
-        import_statements=imports,
-        test_code=[test for result in test_create_results for test in result.new_tests],
-    )
+    assistants = {backend.name: CodeOptimizerAssistant(backend.name) for backend in available_backends(backends)}
+    if not assistants:
+        raise ValueError(f"None of the backends {', '.join(backends)} is installed")
+    results = []
+    with stage_timings.measure("optimize"):
+        for coa in assistants.values():
+            results += coa.optimize_code_initial(
+                source,
+                choices=max(1, 4 // len(assistants)),
+                import_statements=imports,
+                test_code=[test for result in test_create_results for test in result.new_tests],
+            )
 
     render(function_name, evaluated_results, "Optimization started! Ensuring tests are correct ...")
 
@@ -139,185 +173,698 @@ def cythonize_function(
     # see if importlib can help out
     sys.path.append(str(function_file_path.parent))
 
+    # time the original on a benchmark core, under the same conditions as the candidates
+    benchmark_config = BenchmarkConfig(cpu_affinity=partition_cores(available_cores())[0][:1])
+    race_config = RaceConfig() if racing else None
+    # benchmark on recorded production calls as well, when there are any
+    corpus_dir = find_corpus(function_file_path, function_name)
+    if corpus_dir is not None:
+        logger.info(f"Replaying recorded calls from {corpus_dir}")
+
     # run original one first
-    while True:
-        try:
-            original_timing = run_test_file_with_replacement_function(
-                test_path, function_file_path, function_name
-            )
-            break
-        except FaultyTestError as e:
-            # We assume this is an error in the generated test,
-            # so we delete this test from the file and try again
-            logger.exception("Error running original test, deleting faulty test")
-            for result in test_create_results:
-                if e.test_name in result.new_tests:
-                    result.new_tests.remove(e.test_name)
-            
-            test_path = write_test_results_to_file(test_create_results, function_file_path, function_name, test_path)
-            nr_of_tests -= 1
+    with stage_timings.measure("time_original"):
+        original_benchmark, test_path = time_original_function(
+            test_create_results, test_path, function_file_path, function_name, benchmark_config, corpus_dir
+        )
+    original_timing = original_benchmark.runtime_ms
+    # the tests are final now
+    results_store.store_tests(source, function_name, test_create_results)
+    if warm_start > 0:
+        results += [
+            candidate.as_seed()
+            for candidate in results_store.warm_start(source, function_name, test_create_results, warm_start)
+        ]
 
     evaluated_results += [
-        EvaluatedOptimizedFunctionResult(
-            function_name=function_name,
-            test_path=test_path,
-            optimized_function_path=function_file_path,
-            runtime_ms=original_timing,
-            user_feedback="Original function",
-            previous_messages=[],
-            error="",
-            test_that_failed_src="",
-        )
+        make_original_result(function_name, test_path, function_file_path, original_benchmark)
     ]
     render(function_name, evaluated_results, "Tests correct! Original function timed. Starting optimization...")
 
-    if nr_of_tests == 0:
-        raise AllTestFailedError("All tests failed, could not run original function")
-
-    # evaluate the results
-    evaluated_results += evaluate_optimized_function_results(
-        function_path, test_path, results
+    original_result = evaluated_results[0]
+    workload_path = None
+    if scaling_config is not None:
+        with stage_timings.measure("scaling"):
+            workload_path = generate_workload(function_path)
+
+    def measure_curves():
+        """Measure the scaling, thread scaling and throughput of the results that do not have them yet."""
+        if workload_path is not None:
+            with stage_timings.measure("scaling"):
+                sweep_results(evaluated_results, workload_path, scaling_config, benchmark_config.cpu_affinity)
+        if parallel is not None:
+            with stage_timings.measure("threads"):
+                sweep_threads(evaluated_results, test_path, parallel, corpus_dir=corpus_dir)
+        if throughput is not None:
+            with stage_timings.measure("throughput"):
+                sweep_throughput(evaluated_results, test_path, throughput, original_result, corpus_dir=corpus_dir)
+
+    measure_curves()
+
+    # the tests are final now, so workers can import them once for all generations
+    worker_pool = BenchmarkWorkerPool(
+        test_path, function_name, partition_cores(available_cores())[0], corpus_dir=corpus_dir
     )
-    render(function_name, evaluated_results, "Refining solutions...")
-    logger.info("Evaluated results")
-    display_ordered_runtimes(evaluated_results, original_timing)
-
-    # refine the best result
-    for i in range(refine_depth):
-        evaluated_results = sorted(evaluated_results, key=lambda x: x.runtime_ms)
-        try:
-            best_result = evaluated_results[0]
-        except IndexError:
-            raise AllGenerationsFailedError("All generations failed")
-
-        refined_results = refine_optimized_function(
-            best_result.previous_messages,
-            best_result.error,
-            best_result.test_that_failed_src,
-            best_result.runtime_ms,
-            best_result.user_feedback,
-            coa,
-        )
-
-        # evaluate the refined results
-        refined_evaluated_results = evaluate_optimized_function_results(
-            str(best_result.optimized_function_path) + "::" + function_name, test_path, refined_results
+    try:
+        # evaluate the results
+        evaluated_results += evaluate_optimized_function_results(
+            function_path,
+            test_path,
+            results,
+            benchmark_config=benchmark_config,
+            baseline=original_benchmark,
+            worker_pool=worker_pool,
+            race_config=race_config,
+            stage_timings=stage_timings,
         )
+        measure_curves()
+        render(function_name, evaluated_results, "Refining solutions...")
+        logger.info("Evaluated results")
+        display_ordered_runtimes(evaluated_results, original_timing)
+
+        if evolution is not None:
+
+            def evaluate(children):
+                return evaluate_optimized_function_results(
+                    function_path,
+                    test_path,
+                    children,
+                    benchmark_config=benchmark_config,
+                    baseline=original_benchmark,
+                    worker_pool=worker_pool,
+                    race_config=race_config,
+                    stage_timings=stage_timings,
+                )
+
+            def on_generation(generation, children):
+                display_ordered_runtimes(children, original_timing)
+                evaluated_results.extend(children)
+                measure_curves()
+                render(function_name, evaluated_results, f"Done evolving generation {generation}")
+
+            # the children are added to evaluated_results generation by generation
+            with stage_timings.measure("evolve"):
+                evolve(
+                    list(evaluated_results),
+                    assistants,
+                    source,
+                    imports,
+                    [test for result in test_create_results for test in result.new_tests],
+                    evaluate,
+                    evolution,
+                    rank=lambda results: rank_by_objectives(results, objectives, benchmark_config.confidence),
+                    on_generation=on_generation,
+                )
+
+        # refine the best results, the evolution replaces this hill climbing
+        for i in range(refine_depth if evolution is None else 0):
+            # only let a candidate overtake another one when it is significantly faster
+            evaluated_results = rank_by_objectives(evaluated_results, objectives, benchmark_config.confidence)
+            if scaling_config is not None and scaling_config.target_size is not None:
+                # the test inputs are small, rank by the predicted runtime at the size that matters
+                evaluated_results = rank_at_size(evaluated_results, scaling_config.target_size)
+                parents = refinable(evaluated_results)[:1]
+            elif rank_by == "throughput":
+                # the single call runtime does not matter when the callers hold on to the GIL
+                evaluated_results = rank_by_throughput(evaluated_results)
+                parents = refinable(evaluated_results)[:1]
+            elif parallel is not None and parallel.prefer == "many":
+                evaluated_results = rank_by_threads(evaluated_results, parallel.prefer)
+                parents = refinable(evaluated_results)[:1]
+            else:
+                parents = select_parents(evaluated_results, objectives, benchmark_config.confidence)
+            if beam_width > 1:
+                # keep the best branches alive, so a dead end of the fastest one does not stop the search
+                parents = [r for r in refinable(evaluated_results) if not r.raced_out][:beam_width] or parents
+            if not parents:
+                raise AllGenerationsFailedError("All generations failed")
+            best_result = parents[0]
+
+            with stage_timings.measure("refine"):
+                refined_results = refine_optimized_functions(
+                    parents,
+                    [
+                        throughput_feedback(parent, thread_feedback(parent, objective_feedback(parent, objectives)))
+                        for parent in parents
+                    ],
+                    assistants,
+                    i + 1,
+                )
+
+            # evaluate the refined results
+            refined_evaluated_results = evaluate_optimized_function_results(
+                function_path,
+                test_path,
+                refined_results,
+                benchmark_config=benchmark_config,
+                baseline=original_benchmark,
+                worker_pool=worker_pool,
+                race_config=race_config,
+                stage_timings=stage_timings,
+            )
 
-        logger.info(f"Finished refining function (depth {i})")
-
-        display_ordered_runtimes(
-            refined_evaluated_results, original_timing, best_result.runtime_ms
-        )
-        
-        evaluated_results += refined_evaluated_results
-        render(function_name, evaluated_results, f"Done refining on generation {i+1}")
+            logger.info(f"Finished refining function (depth {i})")
 
-    logger.info("Finished optimizing function")
+            display_ordered_runtimes(
+                refined_evaluated_results, original_timing, best_result.runtime_ms
+            )
+            
+            evaluated_results += refined_evaluated_results
+            measure_curves()
+            render(function_name, evaluated_results, f"Done refining on generation {i+1}")
+
+        if autotune_top > 0:
+            ranked = rank_by_objectives(evaluated_results, objectives, benchmark_config.confidence)
+            candidates = autotune_candidates(ranked, autotune_top)
+            render(function_name, evaluated_results, "Autotuning compiler flags and directives...")
+            with stage_timings.measure("autotune"):
+                tuned_results = autotune_optimized_function_results(
+                    function_path,
+                    test_path,
+                    candidates,
+                    benchmark_config=benchmark_config,
+                    baseline=original_benchmark,
+                    worker_pool=worker_pool,
+                    stage_timings=stage_timings,
+                )
+            # keep the default build, unless a variant is significantly faster, then the variant replaces it
+            evaluated_results = replace_with_selected_builds(
+                evaluated_results, candidates, tuned_results, benchmark_config.confidence
+            )
+            measure_curves()
+            render(function_name, evaluated_results, "Done autotuning")
+    finally:
+        try:
+            results_store.store_results(source, test_create_results, evaluated_results)
+        except Exception:
+            logger.exception(f"Error storing the results in {results_store.path}")
+        if worker_pool.mean_overhead_s is not None:
+            logger.info(f"Mean benchmark overhead per candidate: {worker_pool.mean_overhead_s * 1000:.1f}ms")
+        worker_pool.close()
+
+    logger.info(f"Finished optimizing function: {stage_timings.summary()}")
     display_ordered_runtimes(evaluated_results, original_timing)
     render(function_name, evaluated_results, "Tests generated! Starting optimization...")
+    return evaluated_results
+
+
+def time_original_function(
+    test_create_results: List[AssistantCodeTestCreateResult],
+    test_path,
+    function_file_path: Path,
+    function_name: str,
+    benchmark_config: BenchmarkConfig,
+    corpus_dir: Optional[Path] = None,
+) -> Tuple[BenchmarkResult, Path]:
+    """Benchmark the original function against the generated tests and the recorded calls in `corpus_dir`.
+    Tests that fail on the original function are removed from the test file.
+
+    Returns:
+        The benchmark of the original function and the path of the (rewritten) test file.
+    """
+    while True:
+        try:
+            original_benchmark = run_test_file_with_replacement_function(
+                test_path, function_file_path, function_name, benchmark_config, corpus_dir
+            )
+            return original_benchmark, test_path
+        except FaultyTestError as e:
+            if e.test_name == CORPUS_TEST_NAME:
+                raise CodeExecutionError(f"The original function fails on the recorded calls in {corpus_dir}") from e
+            # We assume this is an error in the generated test,
+            # so we delete this test from the file and try again
+            logger.exception("Error running original test, deleting faulty test")
+            for result in test_create_results:
+                result.new_tests = [
+                    test for test in result.new_tests
+                    if not test.lstrip().startswith(f"def {e.test_name}(")
+                ]
+            if not any(result.new_tests for result in test_create_results):
+                raise AllTestFailedError("All tests failed, could not run original function")
+
+            test_path = write_test_results_to_file(test_create_results, function_file_path, function_name)
+
+
+def make_original_result(
+    function_name: str, test_path, function_file_path: Path, original_benchmark: BenchmarkResult
+) -> EvaluatedOptimizedFunctionResult:
+    return EvaluatedOptimizedFunctionResult(
+        function_name=function_name,
+        test_path=test_path,
+        optimized_function_path=function_file_path,
+        runtime_ms=original_benchmark.runtime_ms,
+        user_feedback="Original function",
+        previous_messages=[],
+        error="",
+        test_that_failed_src="",
+        benchmark=original_benchmark,
+        speedup=1.0,
+        speedup_ci=(1.0, 1.0),
+        memory=combine_memory(original_benchmark.memory.values()),
+    )
 
 
 def evaluate_optimized_function_results(
     function_path: str,
     test_path: str,
     optimization_results: List[
-        Tuple[AssistantCodeOptimizationResult, List[ChatCompletionMessage]]
+        Tuple[AssistantCodeOptimizationResult, List["ChatCompletionMessage"]]
     ],
+    max_parallel_compiles: Optional[int] = None,
+    benchmark_slots: Optional[int] = None,
+    benchmark_timeout: float = 5,
+    build_cache: Optional[BuildCache] = None,
+    benchmark_config: Optional[BenchmarkConfig] = None,
+    baseline: Optional[BenchmarkResult] = None,
+    worker_pool: Optional[BenchmarkWorkerPool] = None,
+    race_config: Optional[RaceConfig] = None,
+    stage_timings: Optional[StageTimings] = None,
+    corpus_dir: Optional[Path] = None,
 ) -> List[EvaluatedOptimizedFunctionResult]:
     """Evaluate the results of optimizing a function.
+    Renders the intermediate results every time a candidate finishes.
     Args:
         function_path (str): Path to the function.
         test_path (str): Path to the test file.
-        optimized_function_path (str): Path to the optimized function.
-        function_name (str): Name of the function.
+        optimization_results: Results of the CodeOptimizerAssistant of each backend.
+        max_parallel_compiles (int, optional): Maximum number of concurrent compiles.
+        benchmark_slots (int, optional): Number of cores reserved for benchmarks.
+        benchmark_timeout (float): Maximum runtime of a single benchmark in seconds.
+        build_cache (BuildCache, optional): Cache of compiled candidates. Defaults to the user-wide cache.
+        benchmark_config (BenchmarkConfig, optional): Benchmark settings.
+        baseline (BenchmarkResult, optional): Benchmark of the original function, used to compute speedups.
+        worker_pool (BenchmarkWorkerPool, optional): Pre-warmed workers to benchmark on.
+            Defaults to a fresh process per candidate.
+        race_config (RaceConfig, optional): Race the candidates, dropping clearly losing ones early.
+        stage_timings (StageTimings, optional): Collects the time spent compiling and benchmarking.
+        corpus_dir (Path, optional): Recorded calls to replay as an extra benchmark when no worker pool is given.
     """
+    function_name = function_path.split("::")[1]
     evaluated_results = []
-    for idx, (result, previous_messages) in enumerate(optimization_results):
-        # Write to file next to original file as *_optimized.pyx
-        function_file_path = Path(function_path.split("::")[0])
-        function_name = function_path.split("::")[1]
-        directory = function_file_path.parent / ".tmp"
-        directory.mkdir(parents=True, exist_ok=True)
-        opt_pyx_path = directory / f"{function_file_path.stem}_{idx}.pyx"
-        with open(opt_pyx_path, "w") as f:
-            print(result.import_statements)
-            f.write("\n".join(result.import_statements))
-            f.write("\n")
-            f.write(result.cython_function)
-
-        # compile the optimized function
-        try:
-            compile_pyx_to_so(opt_pyx_path)
-        except CythonCompilerError as e:
-            logger.exception(f"Error compiling optimized function {idx}")
-            continue
+    for evaluated_result in iter_evaluated_optimized_function_results(
+        function_path,
+        test_path,
+        optimization_results,
+        max_parallel_compiles=max_parallel_compiles,
+        benchmark_slots=benchmark_slots,
+        benchmark_timeout=benchmark_timeout,
+        build_cache=build_cache,
+        benchmark_config=benchmark_config,
+        baseline=baseline,
+        worker_pool=worker_pool,
+        race_config=race_config,
+        stage_timings=stage_timings,
+        corpus_dir=corpus_dir,
+    ):
+        evaluated_results.append(evaluated_result)
+        render(function_name, evaluated_results, "Creating set of optimized functions...")
 
-        # then run optimized in seperate process
-        # Note: we have to run this in a separate process because the cythonized function
-        # can segfault and crash the main process
-        # In addition, we can of course parallelize this!
-        p = Process(
-            target=run_test_file_with_replacement_function,
-            args=(test_path, opt_pyx_path, function_name),
-        )
-        p.start()
-        p.join(5)
-        exc, tb = p.exception or (None, None)
-        if p.exitcode != 0 or exc:
-            logger.exception(f"Error running optimized function {idx}")
-            continue
-        timing = p.result
-
-        # TODO refine errors in the future, for now just log and skip
-        # functions that have errors
-        error = ""
-        test_that_failed_src = ""
-
-        evaluated_results.append(
-            EvaluatedOptimizedFunctionResult(
-                function_name=function_name,
-                test_path=test_path,
-                optimized_function_path=opt_pyx_path,
-                runtime_ms=timing,
-                user_feedback="Try to optimize this function further",
-                previous_messages=previous_messages,
-                error=error,
-                test_that_failed_src=test_that_failed_src,
-            )
+    return evaluated_results
+
+
+def iter_evaluated_optimized_function_results(
+    function_path: str,
+    test_path: str,
+    optimization_results: List[
+        Tuple[AssistantCodeOptimizationResult, List["ChatCompletionMessage"]]
+    ],
+    max_parallel_compiles: Optional[int] = None,
+    benchmark_slots: Optional[int] = None,
+    benchmark_timeout: float = 5,
+    build_cache: Optional[BuildCache] = None,
+    benchmark_config: Optional[BenchmarkConfig] = None,
+    baseline: Optional[BenchmarkResult] = None,
+    worker_pool: Optional[BenchmarkWorkerPool] = None,
+    race_config: Optional[RaceConfig] = None,
+    stage_timings: Optional[StageTimings] = None,
+    corpus_dir: Optional[Path] = None,
+) -> Iterator[EvaluatedOptimizedFunctionResult]:
+    """Compile and benchmark optimized functions in parallel, yielding each
+    evaluated result as soon as its benchmark finishes.
+
+    Compiles run concurrently on the cores that are not reserved for benchmarks.
+    Benchmarks run in separate processes, each pinned to its own reserved core,
+    either on the workers of a pre-warmed pool or in a fresh process per candidate.
+    If there are too few cores to keep them apart, all compiles finish before
+    the first benchmark starts so timings are not skewed.
+    Candidates that were compiled before are restored from the build cache.
+    When racing, candidates first get a short benchmark and only the ones that can
+    still beat the leader get more repeats, see SuccessiveHalvingRace. Each candidate
+    is yielded as soon as its own race is decided.
+
+    Args:
+        function_path (str): Path to the function.
+        test_path (str): Path to the test file.
+        optimization_results: Results of the CodeOptimizerAssistant of each backend.
+        max_parallel_compiles (int, optional): Maximum number of concurrent compiles.
+        benchmark_slots (int, optional): Number of cores reserved for benchmarks.
+        benchmark_timeout (float): Maximum runtime of a single benchmark in seconds.
+        build_cache (BuildCache, optional): Cache of compiled candidates. Defaults to the user-wide cache.
+        benchmark_config (BenchmarkConfig, optional): Benchmark settings.
+        baseline (BenchmarkResult, optional): Benchmark of the original function, used to compute speedups.
+        worker_pool (BenchmarkWorkerPool, optional): Pre-warmed workers to benchmark on.
+            Defaults to a fresh process per candidate.
+        race_config (RaceConfig, optional): Race the candidates, dropping clearly losing ones early.
+        stage_timings (StageTimings, optional): Collects the time spent compiling and benchmarking.
+        corpus_dir (Path, optional): Recorded calls to replay as an extra benchmark when no worker pool is given.
+    """
+    function_file_path = Path(function_path.split("::")[0])
+    function_name = function_path.split("::")[1]
+    build_cache = build_cache or BuildCache()
+    stage_timings = stage_timings or StageTimings()
+
+    benchmark_cores, compile_cores = partition_cores(available_cores(), benchmark_slots)
+    can_overlap = not set(benchmark_cores) & set(compile_cores)
+
+    compile_executor = ThreadPoolExecutor(
+        max_workers=max_parallel_compiles or len(compile_cores),
+        thread_name_prefix="compile",
+    )
+    scheduler = BenchmarkScheduler(benchmark_cores, timeout=benchmark_timeout)
+
+    # the scheduler and the pool pin every benchmark process to its own core
+    benchmark_config = (benchmark_config or BenchmarkConfig()).model_copy(
+        update={"cpu_affinity": None}
+    )
+
+    race = None
+    first_round_config = benchmark_config
+    if race_config is not None:
+        race = SuccessiveHalvingRace(race_config, benchmark_config, baseline)
+        first_round_config = race.round_config(0)
+
+    def start_benchmark(opt_pyx_path, config):
+        import_path = backend_by_path[opt_pyx_path].import_path(opt_pyx_path)
+        if worker_pool is not None:
+            return stage_timings.track("benchmark", worker_pool.submit(import_path, config))
+        return stage_timings.track(
+            "benchmark",
+            scheduler.submit(
+                run_test_file_with_replacement_function,
+                test_path,
+                import_path,
+                function_name,
+                config,
+                corpus_dir,
+            ),
         )
 
-        render(function_name, evaluated_results, "Creating set of optimized functions...")
+    def make_result(opt_pyx_path, previous_messages, benchmark, raced_out=False):
+        return make_evaluated_result(
+            function_name,
+            test_path,
+            opt_pyx_path,
+            previous_messages,
+            benchmark,
+            baseline,
+            raced_out,
+            backend_by_path[opt_pyx_path].name,
+            lineage_by_path[opt_pyx_path],
+            build_config_by_path[opt_pyx_path],
+        )
 
-    return evaluated_results
+    compiling = {}
+    benchmarking = {}
+    compiled = []
+    backend_by_path = {}
+    lineage_by_path = {}
+    build_config_by_path = {}
+    try:
+        # cheap builds first, so their benchmarks can start while the expensive ones compile
+        by_build_cost = sorted(
+            enumerate(optimization_results), key=lambda x: get_backend(x[1][0].backend).estimated_build_s
+        )
+        for idx, (result, previous_messages) in by_build_cost:
+            opt_pyx_path = write_optimized_function_to_pyx(function_file_path, result)
+            if opt_pyx_path in backend_by_path:
+                logger.info(f"Skipping optimized function {idx}, it is a duplicate of {opt_pyx_path.name}")
+                continue
+            backend = backend_by_path[opt_pyx_path] = get_backend(result.backend)
+            lineage_by_path[opt_pyx_path] = result.lineage
+            build_config_by_path[opt_pyx_path] = result.build_config
+            future = compile_executor.submit(
+                stage_timings.timed("compile", backend.build), opt_pyx_path, compile_cores, build_cache
+            )
+            compiling[future] = (idx, opt_pyx_path, previous_messages)
 
+        while compiling or benchmarking:
+            done, _ = wait(
+                list(compiling) + list(benchmarking), return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                if future in compiling:
+                    idx, opt_pyx_path, previous_messages = compiling.pop(future)
+                    try:
+                        future.result()
+                    except BuildError:
+                        logger.exception(f"Error building optimized function {idx}")
+                        continue
+                    compiled.append((idx, opt_pyx_path, previous_messages))
+                else:
+                    idx, opt_pyx_path, previous_messages, round_idx = benchmarking.pop(future)
+                    try:
+                        benchmark = future.result()
+                    except Exception:
+                        logger.exception(f"Error running optimized function {idx}")
+                        if race is not None:
+                            race.results.pop(opt_pyx_path, None)
+                        continue
+
+                    if race is None:
+                        yield make_result(opt_pyx_path, previous_messages, benchmark)
+                        continue
+                    raced_out = race.record(opt_pyx_path, benchmark, round_idx)
+                    if raced_out is None:
+                        benchmarking[start_benchmark(opt_pyx_path, race.round_config(round_idx + 1))] = (
+                            idx,
+                            opt_pyx_path,
+                            previous_messages,
+                            round_idx + 1,
+                        )
+                    else:
+                        yield make_result(opt_pyx_path, previous_messages, race.results[opt_pyx_path], raced_out)
+
+            # only start benchmarks next to compiles when they do not share cores
+            if can_overlap or not compiling:
+                for idx, opt_pyx_path, previous_messages in compiled:
+                    benchmarking[start_benchmark(opt_pyx_path, first_round_config)] = (
+                        idx,
+                        opt_pyx_path,
+                        previous_messages,
+                        0,
+                    )
+                compiled = []
+    finally:
+        # builds that did not start yet, shutdown(cancel_futures=True) needs Python 3.9
+        for future in compiling:
+            future.cancel()
+        compile_executor.shutdown(wait=True)
+        scheduler.shutdown(wait=True)
+
+
+def autotune_optimized_function_results(
+    function_path: str,
+    test_path,
+    candidates: List[EvaluatedOptimizedFunctionResult],
+    grid: Optional[List[BuildConfig]] = None,
+    max_parallel_compiles: Optional[int] = None,
+    benchmark_slots: Optional[int] = None,
+    benchmark_timeout: float = 5,
+    build_cache: Optional[BuildCache] = None,
+    benchmark_config: Optional[BenchmarkConfig] = None,
+    baseline: Optional[BenchmarkResult] = None,
+    worker_pool: Optional[BenchmarkWorkerPool] = None,
+    stage_timings: Optional[StageTimings] = None,
+    corpus_dir: Optional[Path] = None,
+) -> List[EvaluatedOptimizedFunctionResult]:
+    """Rebuild candidates with every configuration of a grid of compiler flags and Cython
+    directives, and benchmark the builds.
+    Builds run the full tests, so a configuration that breaks a candidate, e.g. by disabling
+    bounds checks it relies on, fails or crashes its benchmark and is dropped.
+    All compiles finish before the first benchmark starts, so timings are not skewed.
 
-def refine_optimized_function(
-    previous_messages: List[ChatCompletionMessage],
-    error: str,
-    test_that_failed_src: str,
-    runtime_ms: float,
-    user_feedback: str,
-    coa: CythonCodeOptimizerAssistant,
-) -> List[Tuple[AssistantCodeOptimizationResult, List[ChatCompletionMessage]]]:
-    """Refine the optimized function.
     Args:
-        previous_messages: List of previous messages.
-        error: Error message.
-        test_that_failed_src: Source code of the test that failed.
-        runtime_ms: Runtime in milliseconds.
-        user_feedback: User feedback.
-        coa: CythonCodeOptimizerAssistant instance.
+        function_path (str): Path to the function.
+        test_path (str): Path to the test file.
+        candidates (List[EvaluatedOptimizedFunctionResult]): Evaluated candidates built with the defaults.
+        grid (List[BuildConfig], optional): Configurations to try. Defaults to autotune.default_grid().
+        max_parallel_compiles (int, optional): Maximum number of concurrent compiles.
+        benchmark_slots (int, optional): Number of cores reserved for benchmarks.
+        benchmark_timeout (float): Maximum runtime of a single benchmark in seconds.
+        build_cache (BuildCache, optional): Cache of compiled candidates. Defaults to the user-wide cache.
+        benchmark_config (BenchmarkConfig, optional): Benchmark settings.
+        baseline (BenchmarkResult, optional): Benchmark of the original function, used to compute speedups.
+        worker_pool (BenchmarkWorkerPool, optional): Pre-warmed workers to benchmark on.
+            Defaults to a fresh process per build.
+        stage_timings (StageTimings, optional): Collects the time spent compiling and benchmarking.
+        corpus_dir (Path, optional): Recorded calls to replay as an extra benchmark when no worker pool is given.
     """
-    results = coa.refine_code(
-        error,
-        test_that_failed_src,
-        runtime_ms,
-        user_feedback,
-        choices=4,
+    function_name = function_path.split("::")[1]
+    grid = default_grid() if grid is None else grid
+    build_cache = build_cache or BuildCache()
+    stage_timings = stage_timings or StageTimings()
+    benchmark_cores, compile_cores = partition_cores(available_cores(), benchmark_slots)
+    benchmark_config = (benchmark_config or BenchmarkConfig()).model_copy(update={"cpu_affinity": None})
+
+    variants = [
+        (candidate, config, write_build_variant(candidate.optimized_function_path, config))
+        for candidate in candidates
+        for config in grid
+    ]
+    with ThreadPoolExecutor(
+        max_workers=max_parallel_compiles or len(compile_cores), thread_name_prefix="compile"
+    ) as compile_executor:
+        compiles = [
+            compile_executor.submit(
+                stage_timings.timed("compile", compile_pyx_to_so), variant_path, compile_cores, build_cache
+            )
+            for _, _, variant_path in variants
+        ]
+    compiled = []
+    for variant, future in zip(variants, compiles):
+        try:
+            future.result()
+        except BuildError:
+            logger.exception(f"Error compiling build {variant[1].name} of {variant[2].name}")
+            continue
+        compiled.append(variant)
+
+    tuned_results = []
+    with BenchmarkScheduler(benchmark_cores, timeout=benchmark_timeout) as scheduler:
+        benchmarks = []
+        for candidate, config, variant_path in compiled:
+            if worker_pool is not None:
+                future = worker_pool.submit(variant_path, benchmark_config)
+            else:
+                future = scheduler.submit(
+                    run_test_file_with_replacement_function,
+                    test_path,
+                    variant_path,
+                    function_name,
+                    benchmark_config,
+                    corpus_dir,
+                )
+            benchmarks.append(stage_timings.track("benchmark", future))
+        for (candidate, config, variant_path), future in zip(compiled, benchmarks):
+            try:
+                benchmark = future.result()
+            except Exception:
+                logger.exception(f"Build {config.name} of {variant_path.name} failed its tests")
+                continue
+            result = make_evaluated_result(
+                function_name,
+                test_path,
+                variant_path,
+                candidate.previous_messages,
+                benchmark,
+                baseline,
+                backend="cython",
+                lineage=child_lineage(
+                    candidate, candidate.lineage.generation if candidate.lineage else 0, "autotune"
+                ),
+                build_config=config,
+            )
+            tuned_results.append(result)
+    return tuned_results
+
+
+def make_evaluated_result(
+    function_name: str,
+    test_path,
+    opt_pyx_path: Path,
+    previous_messages: List["ChatCompletionMessage"],
+    benchmark: BenchmarkResult,
+    baseline: Optional[BenchmarkResult] = None,
+    raced_out: bool = False,
+    backend: str = "cython",
+    lineage: Optional[Lineage] = None,
+    build_config: Optional[BuildConfig] = None,
+) -> EvaluatedOptimizedFunctionResult:
+    speedup_estimate, speedup_ci = None, None
+    if baseline is not None:
+        speedup_estimate, speedup_ci = speedup(baseline, benchmark)
+
+    # point the next refinement at the Python interaction that is left
+    annotation = read_annotation(opt_pyx_path)
+
+    # TODO refine errors in the future, for now just log and skip
+    # functions that have errors
+    return EvaluatedOptimizedFunctionResult(
+        function_name=function_name,
+        test_path=test_path,
+        optimized_function_path=opt_pyx_path,
+        runtime_ms=benchmark.runtime_ms,
+        user_feedback=annotation_feedback(annotation) or "Try to optimize this function further",
         previous_messages=previous_messages,
+        error="",
+        test_that_failed_src="",
+        benchmark=benchmark,
+        speedup=speedup_estimate,
+        speedup_ci=speedup_ci,
+        raced_out=raced_out,
+        memory=combine_memory(benchmark.memory.values()),
+        annotation=annotation,
+        backend=backend,
+        lineage=lineage,
+        build_config=build_config,
+    )
+
+
+def write_optimized_function_to_pyx(
+    function_file_path: Path, result: AssistantCodeOptimizationResult
+) -> Path:
+    """Write an optimized function next to the original file as .tmp/*_{hash}.pyx, or with the
+    suffix of its backend. The file name is derived from the code, so the same candidate always gets the same path.
+    Args:
+        function_file_path (Path): Path to the file with the original function.
+        result (AssistantCodeOptimizationResult): Optimized function.
+    """
+    return get_backend(result.backend).write_candidate(
+        function_file_path, result.import_statements, result.cython_function
     )
-    return results
+
+
+def refine_optimized_functions(
+    parents: List[EvaluatedOptimizedFunctionResult],
+    user_feedback: List[str],
+    assistants: Dict[str, CodeOptimizerAssistant],
+    generation: int,
+) -> List[Tuple[AssistantCodeOptimizationResult, List["ChatCompletionMessage"]]]:
+    """Refine several evaluated results with concurrent LLM requests, one per parent.
+    A request that fails is logged and skipped, the children record the branch of their parent.
+    Args:
+        parents: Results to refine.
+        user_feedback: Feedback for every parent.
+        assistants: CodeOptimizerAssistant per backend, a parent is refined by the one of its backend.
+        generation: Generation of the children.
+    """
+
+    async def refine_all():
+        return await asyncio.gather(
+            *(
+                # a candidate is refined in the language it is written in
+                assistants.get(parent.backend or "cython", next(iter(assistants.values()))).refine_code_async(
+                    parent.error,
+                    parent.test_that_failed_src,
+                    parent.runtime_ms,
+                    feedback,
+                    choices=4,
+                    previous_messages=parent.previous_messages,
+                    python_interaction=worst_lines(parent.annotation),
+                )
+                for parent, feedback in zip(parents, user_feedback)
+            ),
+            return_exceptions=True,
+        )
+
+    refined_results = []
+    for parent, children in zip(parents, asyncio.run(refine_all())):
+        if isinstance(children, BaseException):
+            logger.opt(exception=children).error(f"Error refining {Path(parent.optimized_function_path).name}")
+            continue
+        for child, _ in children:
+            child.lineage = child_lineage(parent, generation, "refine")
+        refined_results += children
+    return refined_results
 
 
 def generate_tests(
@@ -331,8 +878,7 @@ def generate_tests(
     function_file_path = Path(function_path.split("::")[0])
     function_name = function_path.split("::")[1]
 
-    imports = get_imports(function_file_path)
-    source = get_source_code_of_function(function_file_path, function_name)
+    imports, source = function_source(function_file_path, function_name)
     tca = PythonTestCreatorAssistant()
     results = tca.create_tests(imports, source, number_of_tests, [])
     
@@ -356,11 +902,10 @@ def write_test_results_to_file(results, function_file_path, function_name, exist
 
     else:  # write to new file next to original file
         test_path = function_file_path.parent / f"test_{function_file_path.stem}.py"
-        for result in results:
-            with open(test_path, "w") as f:
-                f.write("# Autogenerated test file\n")
-                f.write(f"from {function_file_path.stem} import {function_name}\n")
-
+        with open(test_path, "w") as f:
+            f.write("# Autogenerated test file\n")
+            f.write(f"from {function_file_path.stem} import {function_name}\n")
+            for result in results:
                 for imp in result.import_statements:
                     f.write(imp)
                     f.write("\n")
@@ -368,23 +913,3 @@ def write_test_results_to_file(results, function_file_path, function_name, exist
                     f.write(test)
                     f.write("\n\n")
     return test_path
-
-def compile_pyx_to_so(pyx_path):
-    """Compile a pyx file to a shared object file.
-    Args:
-        pyx_path (str): Path to the pyx file.
-    """
-    with subprocess.Popen(
-        ["cythonize", "-i", "-a", pyx_path],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    ) as proc:
-        proc.stdout = cast(IO[bytes], proc.stdout)
-        proc.stderr = cast(IO[bytes], proc.stderr)
-        returncode = proc.wait()
-        stdout = proc.stdout.read()
-        stderr = proc.stderr.read()
-        print(stdout)
-        print(stderr, file=sys.stderr)
-        if returncode != 0:
-            raise CythonCompilerError(f"Error running cythonize for {pyx_path}")
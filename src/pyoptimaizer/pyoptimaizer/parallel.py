@@ -0,0 +1,160 @@
+import os
+from pathlib import Path
+from typing import List, Literal, Optional, Union
+
+from loguru import logger
+from pydantic import BaseModel
+
+from pyoptimaizer.backends import result_import_path
+from pyoptimaizer.benchmark import BenchmarkConfig
+from pyoptimaizer.runner import run_test_file_with_replacement_function
+from pyoptimaizer.scheduler import available_cores, run_in_process
+from pyoptimaizer.types import BenchmarkResult, EvaluatedOptimizedFunctionResult, ThreadScaling, ThreadScalingPoint
+
+PARALLEL_BACKEND = "cython_parallel"
+
+
+class ParallelConfig(BaseModel):
+    # largest number of threads of the sweep, defaults to all cores
+    max_threads: Optional[int] = None
+    # rank candidates by their runtime on a single thread, or by their best runtime over all thread counts
+    prefer: Literal["single", "many"] = "many"
+    benchmark: BenchmarkConfig = BenchmarkConfig(
+        repeats=5, min_sample_time_s=0.005, bootstrap_resamples=20, measure_memory=False
+    )
+
+
+def thread_counts(max_threads: int) -> List[int]:
+    """1, 2, 4, ... threads, up to and including max_threads."""
+    counts = []
+    threads = 1
+    while threads < max_threads:
+        counts.append(threads)
+        threads *= 2
+    return counts + [max(1, max_threads)]
+
+
+def run_with_threads(
+    threads: int,
+    test_path: Union[str, Path],
+    replacement_function_path: Union[str, Path],
+    function_name: str,
+    config: BenchmarkConfig,
+    corpus_dir: Optional[Path] = None,
+) -> BenchmarkResult:
+    """Benchmark a candidate on a number of OpenMP threads.
+    Meant to run in a fresh process: OpenMP reads OMP_NUM_THREADS once, when the candidate is imported."""
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    return run_test_file_with_replacement_function(
+        test_path, replacement_function_path, function_name, config, corpus_dir
+    )
+
+
+def measure_thread_scaling(
+    test_path: Union[str, Path],
+    replacement_function_path: Union[str, Path],
+    function_name: str,
+    config: ParallelConfig,
+    cores: Optional[List[int]] = None,
+    timeout: float = 60,
+    corpus_dir: Optional[Path] = None,
+) -> ThreadScaling:
+    """Benchmark a candidate on 1, 2, 4, ... threads, every run pinned to as many cores as it has threads.
+    Args:
+        test_path (Union[str, Path]): Test file to benchmark with.
+        replacement_function_path (Union[str, Path]): Path to import the candidate from.
+        function_name (str): Name of the function under test.
+        config (ParallelConfig): Sweep settings.
+        cores (List[int], optional): Cores to run the threads on. Defaults to all cores of this process.
+        timeout (float): Maximum runtime of the benchmark of a single thread count in seconds.
+        corpus_dir (Path, optional): Recorded calls to replay as an extra benchmark.
+    """
+    cores = cores or available_cores()
+    max_threads = min(config.max_threads or len(cores), len(cores))
+    runtimes = {}
+    for threads in thread_counts(max_threads):
+        benchmark_config = config.benchmark.model_copy(update={"cpu_affinity": cores[:threads]})
+        benchmark = run_in_process(
+            run_with_threads,
+            (threads, test_path, replacement_function_path, function_name, benchmark_config, corpus_dir),
+            cores[:threads],
+            timeout,
+        )
+        runtimes[threads] = benchmark.runtime_ms
+    single_ms = runtimes[1]
+    points = [
+        ThreadScalingPoint(
+            threads=threads,
+            runtime_ms=runtime_ms,
+            speedup=single_ms / runtime_ms,
+            efficiency=single_ms / runtime_ms / threads,
+        )
+        for threads, runtime_ms in runtimes.items()
+    ]
+    return ThreadScaling(points=points)
+
+
+def sweep_threads(
+    results: List[EvaluatedOptimizedFunctionResult],
+    test_path: Union[str, Path],
+    config: ParallelConfig,
+    cores: Optional[List[int]] = None,
+    timeout: float = 60,
+    corpus_dir: Optional[Path] = None,
+):
+    """Measure the thread scaling of the parallel results that do not have it yet, in place.
+    The sweeps run one after another, since every sweep needs all cores. Raced out results are skipped."""
+    pending = [
+        r
+        for r in results
+        if r.backend == PARALLEL_BACKEND and r.thread_scaling is None and not r.raced_out and not r.error
+    ]
+    for result in pending:
+        path = Path(result.optimized_function_path)
+        try:
+            result.thread_scaling = measure_thread_scaling(
+                test_path,
+                result_import_path(result),
+                result.function_name,
+                config,
+                cores,
+                timeout,
+                corpus_dir,
+            )
+        except Exception:
+            logger.exception(f"Error measuring the thread scaling of {path.name}")
+            continue
+        best = result.thread_scaling.best
+        logger.info(
+            f"{path.stem}: {best.speedup:.2f}x on {best.threads} threads, "
+            f"{best.efficiency:.0%} parallel efficiency"
+        )
+
+
+def many_thread_runtime_ms(result: EvaluatedOptimizedFunctionResult) -> float:
+    """Best runtime of a result over all thread counts, its single thread runtime when it is not parallel."""
+    if result.thread_scaling is None:
+        return result.runtime_ms
+    return min(result.runtime_ms, result.thread_scaling.best.runtime_ms)
+
+
+def rank_by_threads(
+    results: List[EvaluatedOptimizedFunctionResult], prefer: str = "many"
+) -> List[EvaluatedOptimizedFunctionResult]:
+    """Order results by their best runtime on many threads, fastest first.
+    With prefer="single" the order is kept, the benchmarks already run on a single thread."""
+    if prefer == "single":
+        return list(results)
+    return sorted(results, key=many_thread_runtime_ms)
+
+
+def thread_feedback(result: EvaluatedOptimizedFunctionResult, user_feedback: str) -> str:
+    """Extend the feedback for refining a parallel result with how well it scales."""
+    if result.thread_scaling is None:
+        return user_feedback
+    last = result.thread_scaling.points[-1]
+    return (
+        f"{user_feedback}. On {last.threads} threads it is {last.speedup:.2f}x faster than on one thread, "
+        f"a parallel efficiency of {last.efficiency:.0%}. Improve the scaling: parallelize the outer loops, "
+        "give every thread enough work, and avoid shared writes and serial sections"
+    )
@@ -0,0 +1,428 @@
+import asyncio
+import contextlib
+import functools
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Awaitable, List, Optional, Sequence, Set, Tuple
+
+from loguru import logger
+
+from pyoptimaizer.annotation import worst_lines
+from pyoptimaizer.assistants import (
+    AssistantCodeOptimizationResult,
+    AssistantCodeTestCreateResult,
+    CodeOptimizerAssistant,
+    PythonTestCreatorAssistant,
+)
+from pyoptimaizer.backends import available_backends, get_backend
+from pyoptimaizer.benchmark import BenchmarkConfig, is_significantly_faster, rank_results
+from pyoptimaizer.build_cache import BuildCache
+from pyoptimaizer.capture import find_corpus
+from pyoptimaizer.display import display_ordered_runtimes
+from pyoptimaizer.evolution import child_lineage
+from pyoptimaizer.exceptions import (
+    AllGenerationsFailedError,
+    AllTestFailedError,
+    BuildError,
+)
+from pyoptimaizer.html_display import render
+from pyoptimaizer.optimize import (
+    make_evaluated_result,
+    make_original_result,
+    time_original_function,
+    write_optimized_function_to_pyx,
+    write_test_results_to_file,
+)
+from pyoptimaizer.results_store import ResultsStore
+from pyoptimaizer.scheduler import available_cores, partition_cores
+from pyoptimaizer.source_utils import function_source
+from pyoptimaizer.stages import StageTimings
+from pyoptimaizer.types import EvaluatedOptimizedFunctionResult, Lineage
+from pyoptimaizer.utils import retry
+from pyoptimaizer.worker_pool import BenchmarkWorkerPool
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletionMessage
+
+Candidate = Tuple[AssistantCodeOptimizationResult, List["ChatCompletionMessage"]]
+
+
+class _Pipeline:
+    """State of a single pipelined optimization run, see `cythonize_function_async`."""
+
+    def __init__(
+        self,
+        function_path: str,
+        refine_depth: int,
+        choices: int,
+        nr_of_tests: int,
+        max_parallel_compiles: Optional[int],
+        benchmark_slots: Optional[int],
+        build_cache: Optional[BuildCache],
+        stage_timings: Optional[StageTimings],
+        backends: Sequence[str] = ("cython",),
+        results_store: Optional[ResultsStore] = None,
+        warm_start: int = 2,
+    ):
+        self.function_path = function_path
+        self.function_file_path = Path(function_path.split("::")[0])
+        self.function_name = function_path.split("::")[1]
+        self.refine_depth = refine_depth
+        self.choices = choices
+        self.nr_of_tests = nr_of_tests
+        self.build_cache = build_cache or BuildCache()
+        self.stage_timings = stage_timings or StageTimings()
+        self.results_store = results_store or ResultsStore()
+        self.warm_start = warm_start
+
+        self.imports, self.source = function_source(self.function_file_path, self.function_name)
+        # benchmark on recorded production calls as well, when there are any
+        self.corpus_dir = find_corpus(self.function_file_path, self.function_name)
+        self.assistants = {
+            backend.name: CodeOptimizerAssistant(backend=backend.name) for backend in available_backends(backends)
+        }
+        if not self.assistants:
+            raise ValueError(f"None of the backends {', '.join(backends)} is installed")
+        self.tca = PythonTestCreatorAssistant()
+
+        self.benchmark_cores, self.compile_cores = partition_cores(available_cores(), benchmark_slots)
+        # time the original on a benchmark core, under the same conditions as the candidates
+        self.benchmark_config = BenchmarkConfig(cpu_affinity=self.benchmark_cores[:1])
+        self.compile_executor = ThreadPoolExecutor(
+            max_workers=max_parallel_compiles or len(self.compile_cores),
+            thread_name_prefix="compile",
+        )
+        self.compile_slots = asyncio.Semaphore(max_parallel_compiles or len(self.compile_cores))
+        # when compiles and benchmarks have to share cores, a benchmark waits for a free compile slot
+        can_overlap = not set(self.benchmark_cores) & set(self.compile_cores)
+        self.benchmark_guard = contextlib.nullcontext() if can_overlap else self.compile_slots
+
+        self.test_create_results: Optional[List[AssistantCodeTestCreateResult]] = None
+        self.test_path: Optional[Path] = None
+        self.worker_pool: Optional[BenchmarkWorkerPool] = None
+        self.original: Optional[EvaluatedOptimizedFunctionResult] = None
+        self.best: Optional[EvaluatedOptimizedFunctionResult] = None
+        self.evaluated_results: List[EvaluatedOptimizedFunctionResult] = []
+        self.refinements = 0
+        self.written: Set[Path] = set()
+        self.pending: Set[asyncio.Task] = set()
+
+    def spawn(self, coro: Awaitable) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self.pending.add(task)
+        return task
+
+    def render(self, status: str):
+        render(self.function_name, self.evaluated_results, status)
+
+    async def prepare_tests(self):
+        """Generate the tests, or reuse those of an earlier run, time the original function,
+        start the benchmark workers and queue the best candidates of earlier runs."""
+        loop = asyncio.get_running_loop()
+        stored_tests = None
+        if self.warm_start > 0:
+            stored_tests = await loop.run_in_executor(None, self.results_store.load_tests, self.source)
+        with self.stage_timings.measure("generate_tests"):
+            if stored_tests is not None:
+                logger.info("Reusing the tests of an earlier run")
+                test_create_results = stored_tests
+            else:
+                test_create_results = await self.tca.create_tests_async(
+                    self.imports, self.source, self.nr_of_tests, []
+                )
+        test_path = write_test_results_to_file(
+            test_create_results, self.function_file_path, self.function_name
+        )
+        self.render("Tests generated! Timing the original function...")
+
+        original_benchmark, self.test_path = await loop.run_in_executor(
+            None,
+            self.stage_timings.timed("time_original", time_original_function),
+            test_create_results,
+            test_path,
+            self.function_file_path,
+            self.function_name,
+            self.benchmark_config,
+            self.corpus_dir,
+        )
+        self.original = self.best = make_original_result(
+            self.function_name, self.test_path, self.function_file_path, original_benchmark
+        )
+        self.evaluated_results.append(self.original)
+        self.render("Tests correct! Original function timed.")
+
+        # the tests are final now
+        self.test_create_results = test_create_results
+        await loop.run_in_executor(
+            None, self.results_store.store_tests, self.source, self.function_name, test_create_results
+        )
+        if self.warm_start > 0:
+            seeds = await loop.run_in_executor(
+                None,
+                self.results_store.warm_start,
+                self.source,
+                self.function_name,
+                test_create_results,
+                self.warm_start,
+            )
+            for seed in seeds:
+                self.spawn(self.evaluate(seed.as_seed()))
+
+        # the tests are final now, so workers can import them once for all candidates
+        self.worker_pool = await loop.run_in_executor(
+            None,
+            functools.partial(
+                BenchmarkWorkerPool,
+                self.test_path,
+                self.function_name,
+                self.benchmark_cores,
+                corpus_dir=self.corpus_dir,
+            ),
+        )
+
+    async def generate(self, request: Awaitable[List[Candidate]], stage: str, lineage: Optional[Lineage] = None):
+        """Wait for an LLM request and queue its candidates for compilation."""
+        try:
+            with self.stage_timings.measure(stage):
+                candidates = await request
+        except Exception:
+            logger.exception(f"Error in LLM request for {stage}")
+            return
+        for result, previous_messages in candidates:
+            if lineage is not None:
+                result.lineage = lineage
+            self.spawn(self.evaluate((result, previous_messages)))
+
+    async def evaluate(self, candidate: Candidate):
+        """Compile a candidate as soon as a compile slot is free, then benchmark it once the tests are ready."""
+        result, previous_messages = candidate
+        opt_pyx_path = write_optimized_function_to_pyx(self.function_file_path, result)
+        if opt_pyx_path in self.written:
+            logger.info(f"Skipping {opt_pyx_path.name}, it is a duplicate")
+            return
+        self.written.add(opt_pyx_path)
+        backend = get_backend(result.backend)
+
+        loop = asyncio.get_running_loop()
+        async with self.compile_slots:
+            try:
+                await loop.run_in_executor(
+                    self.compile_executor,
+                    self.stage_timings.timed("compile", backend.build),
+                    opt_pyx_path,
+                    self.compile_cores,
+                    self.build_cache,
+                )
+            except BuildError:
+                logger.exception(f"Error building {opt_pyx_path.name}")
+                return
+
+        await self.tests_ready
+        assert self.worker_pool is not None and self.original is not None
+        # the pool pins every benchmark process to its own core
+        config = self.benchmark_config.model_copy(update={"cpu_affinity": None})
+        async with self.benchmark_guard:
+            try:
+                benchmark = await asyncio.wrap_future(
+                    self.stage_timings.track("benchmark", self.worker_pool.submit(backend.import_path(opt_pyx_path), config))
+                )
+            except Exception:
+                logger.exception(f"Error running {opt_pyx_path.name}")
+                return
+
+        evaluated = make_evaluated_result(
+            self.function_name,
+            self.test_path,
+            opt_pyx_path,
+            previous_messages,
+            benchmark,
+            self.original.benchmark,
+            backend=backend.name,
+            lineage=result.lineage,
+            build_config=result.build_config,
+        )
+        self.evaluated_results.append(evaluated)
+        self.render("Creating set of optimized functions...")
+
+        assert self.best is not None
+        if is_significantly_faster(evaluated, self.best, self.benchmark_config.confidence):
+            self.best = evaluated
+            logger.info(f"New best candidate {opt_pyx_path.name}: {evaluated.runtime_ms:.3f}ms")
+            self.refine(evaluated)
+
+    def refine(self, result: EvaluatedOptimizedFunctionResult):
+        """Start a refinement of a result, unless the refinement budget is spent."""
+        if self.refinements >= self.refine_depth:
+            return
+        self.refinements += 1
+        logger.info(f"Refining {Path(result.optimized_function_path).name} ({self.refinements}/{self.refine_depth})")
+        # a candidate is refined in the language it is written in
+        coa = self.assistants.get(result.backend or "cython", next(iter(self.assistants.values())))
+        self.spawn(
+            self.generate(
+                coa.refine_code_async(
+                    result.error,
+                    result.test_that_failed_src,
+                    result.runtime_ms,
+                    result.user_feedback,
+                    choices=self.choices,
+                    previous_messages=result.previous_messages,
+                    python_interaction=worst_lines(result.annotation),
+                ),
+                "refine",
+                child_lineage(result, self.refinements, "refine"),
+            )
+        )
+
+    async def run(self):
+        sys.path.append(str(self.function_file_path.parent))
+        self.render("Generating tests and code...")
+
+        self.tests_ready = self.spawn(self.prepare_tests())
+        # every choice is a separate request, so each one is compiled as soon as it arrives.
+        # The initial optimization does not need the tests, so it runs next to the test generation.
+        # The seed keeps the identical requests apart in the response cache.
+        # Every backend gets its own requests, the cheapest builds come back first.
+        for coa in self.assistants.values():
+            for seed in range(self.choices):
+                self.spawn(
+                    self.generate(
+                        coa.optimize_code_initial_async(
+                            self.source, choices=1, import_statements=self.imports, seed=seed
+                        ),
+                        "optimize",
+                    )
+                )
+
+        try:
+            while self.pending:
+                # tasks spawn new tasks while we wait, so wait on a copy
+                done, _ = await asyncio.wait(set(self.pending), return_when=asyncio.FIRST_COMPLETED)
+                self.pending -= done
+                for task in done:
+                    # errors of candidates are logged where they happen, only the tests are fatal
+                    task.result()
+                if not self.pending:
+                    # nothing in flight anymore, spend the remaining budget on the best candidate
+                    candidates = [r for r in self.evaluated_results if r is not self.original]
+                    if not candidates:
+                        raise AllGenerationsFailedError("All generations failed")
+                    if self.refinements < self.refine_depth:
+                        self.refine(rank_results(candidates, self.benchmark_config.confidence)[0])
+        finally:
+            for task in self.pending:
+                task.cancel()
+            await asyncio.gather(*self.pending, return_exceptions=True)
+            # cancelling the tasks cancelled their queued builds, shutdown(cancel_futures=True) needs Python 3.9
+            self.compile_executor.shutdown(wait=True)
+            if self.test_create_results is not None:
+                try:
+                    self.results_store.store_results(self.source, self.test_create_results, self.evaluated_results)
+                except Exception:
+                    logger.exception(f"Error storing the results in {self.results_store.path}")
+            if self.worker_pool is not None:
+                if self.worker_pool.mean_overhead_s is not None:
+                    logger.info(
+                        f"Mean benchmark overhead per candidate: {self.worker_pool.mean_overhead_s * 1000:.1f}ms"
+                    )
+                self.worker_pool.close()
+
+        return rank_results(self.evaluated_results, self.benchmark_config.confidence)
+
+
+async def cythonize_function_async(
+    function_path: str,
+    refine_depth: int = 2,
+    choices: int = 4,
+    nr_of_tests: int = 5,
+    max_parallel_compiles: Optional[int] = None,
+    benchmark_slots: Optional[int] = None,
+    build_cache: Optional[BuildCache] = None,
+    stage_timings: Optional[StageTimings] = None,
+    backends: Sequence[str] = ("cython",),
+    results_store: Optional[ResultsStore] = None,
+    warm_start: int = 2,
+) -> List[EvaluatedOptimizedFunctionResult]:
+    """Optimize a function like `cythonize_function`, but overlap all stages.
+
+    Test generation and the initial optimization requests start together, every choice is
+    compiled as soon as its response arrives, and candidates are benchmarked as soon as they
+    are compiled and the tests are ready. A refinement of a candidate starts as soon as it is
+    confirmed to be significantly faster than the best so far, instead of after a full generation.
+    Candidates are not raced, since they do not arrive together.
+
+    Args:
+        function_path (str): Path to file with function, e.g. /path/to/file.py::function_name
+        refine_depth (int): Maximum number of refinement requests.
+        choices (int): Number of candidates per LLM request.
+        nr_of_tests (int): Number of tests to generate.
+        max_parallel_compiles (int, optional): Maximum number of concurrent compiles.
+        benchmark_slots (int, optional): Number of cores reserved for benchmarks.
+        build_cache (BuildCache, optional): Cache of compiled candidates. Defaults to the user-wide cache.
+        stage_timings (StageTimings, optional): Collects the time spent in every stage.
+        backends (Sequence[str]): Backends that generate candidates, see backends.BACKENDS.
+        results_store (ResultsStore, optional): Database the tests and the evaluated candidates are stored in.
+            Defaults to the user-wide store.
+        warm_start (int): Number of best candidates of earlier runs to start from, see `cythonize_function`.
+            With 0 the tests of an earlier run are not reused either.
+
+    Returns:
+        All evaluated results, including the original, from fastest to slowest.
+    """
+    start = time.perf_counter()
+    pipeline = _Pipeline(
+        function_path,
+        refine_depth,
+        choices,
+        nr_of_tests,
+        max_parallel_compiles,
+        benchmark_slots,
+        build_cache,
+        stage_timings,
+        backends,
+        results_store,
+        warm_start,
+    )
+    logger.info(f"Optimizing function {pipeline.function_name} in {pipeline.function_file_path}")
+    evaluated_results = await pipeline.run()
+
+    logger.info(
+        f"Finished optimizing function in {time.perf_counter() - start:.1f}s: {pipeline.stage_timings.summary()}"
+    )
+    assert pipeline.original is not None
+    display_ordered_runtimes(evaluated_results, pipeline.original.runtime_ms)
+    render(pipeline.function_name, evaluated_results, "Done optimizing")
+    return evaluated_results
+
+
+@retry(
+    3,
+    (
+        BuildError,
+        AllTestFailedError,
+        IndentationError,
+        AllGenerationsFailedError,
+    ), # type: ignore
+)
+def cythonize_function_pipelined(
+    function_path: str,
+    test_function_paths: List[str] = [],
+    refine_depth=2,
+    stage_timings: Optional[StageTimings] = None,
+    backends: Sequence[str] = ("cython",),
+    results_store: Optional[ResultsStore] = None,
+    warm_start: int = 2,
+) -> List[EvaluatedOptimizedFunctionResult]:
+    """Blocking entry point of `cythonize_function_async`, with the same arguments as `cythonize_function`."""
+    return asyncio.run(
+        cythonize_function_async(
+            function_path,
+            refine_depth=refine_depth,
+            stage_timings=stage_timings,
+            backends=backends,
+            results_store=results_store,
+            warm_start=warm_start,
+        )
+    )
@@ -0,0 +1,96 @@
+from typing import Dict, Hashable, Optional
+
+from loguru import logger
+from pydantic import BaseModel
+
+from pyoptimaizer.benchmark import BenchmarkConfig, merge_results, speedup
+from pyoptimaizer.types import BenchmarkResult
+
+
+class RaceConfig(BaseModel):
+    # number of benchmark rounds, the last round uses the full number of repeats
+    rounds: int = 3
+    # factor by which the number of repeats grows every round
+    growth: float = 2.0
+    # a candidate is only dropped when the leader is at least this much faster, with confidence.
+    # The bootstrap is overconfident on the few samples of the first rounds, the margin makes up for it.
+    elimination_margin: float = 1.1
+    min_repeats: int = 3
+
+    def round_config(self, config: BenchmarkConfig, round_idx: int) -> BenchmarkConfig:
+        """Benchmark settings of a round, with a short budget in the first rounds."""
+        rounds_left = self.rounds - 1 - round_idx
+        repeats = max(self.min_repeats, round(config.repeats / self.growth**rounds_left))
+        return config.model_copy(update={"repeats": repeats})
+
+
+def is_clearly_slower(
+    candidate: BenchmarkResult,
+    leader: BenchmarkResult,
+    config: BenchmarkConfig,
+    margin: float = 1.0,
+) -> bool:
+    """Whether the leader is more than `margin` times faster than the candidate with the configured confidence."""
+    try:
+        _, (low, _) = speedup(
+            candidate, leader, resamples=config.bootstrap_resamples, confidence=config.confidence
+        )
+    except ValueError:
+        return False
+    return low > margin
+
+
+class SuccessiveHalvingRace:
+    """Spends benchmark time only on candidates that can still win.
+
+    Every candidate first gets a short benchmark, and after every round of a candidate it
+    is dropped when it is clearly slower than the leader (the fastest candidate so far or
+    the reference), judged by confidence bounds. Otherwise it is benchmarked again with more
+    repeats and its samples are pooled. Candidates advance independently, so every candidate
+    is final as soon as its own rounds are done rather than when the slowest one is.
+    """
+
+    def __init__(
+        self,
+        race_config: RaceConfig,
+        benchmark_config: BenchmarkConfig,
+        reference: Optional[BenchmarkResult] = None,
+    ):
+        """
+        Args:
+            race_config (RaceConfig): Race settings.
+            benchmark_config (BenchmarkConfig): Benchmark settings of the final round.
+            reference (BenchmarkResult, optional): A result the candidates must beat, e.g. the original.
+        """
+        self.race_config = race_config
+        self.benchmark_config = benchmark_config
+        self.reference = reference
+        # pooled result of every candidate that is still racing or finished
+        self.results: Dict[Hashable, BenchmarkResult] = {}
+
+    def round_config(self, round_idx: int) -> BenchmarkConfig:
+        return self.race_config.round_config(self.benchmark_config, round_idx)
+
+    def leader(self) -> BenchmarkResult:
+        contenders = list(self.results.values()) + ([self.reference] if self.reference else [])
+        return min(contenders, key=lambda r: r.geometric_mean_s)
+
+    def record(self, key: Hashable, result: BenchmarkResult, round_idx: int) -> Optional[bool]:
+        """Pool the result of a round of a candidate.
+
+        Returns:
+            None when the candidate goes on to round `round_idx + 1`, True when it is dropped
+            and False when it finished its last round. The pooled result is in `results`.
+        """
+        if key in self.results:
+            result = merge_results(self.results[key], result, self.round_config(round_idx))
+        self.results[key] = result
+        if round_idx == self.race_config.rounds - 1:
+            return False
+        leader = self.leader()
+        if leader is not result and is_clearly_slower(
+            result, leader, self.benchmark_config, self.race_config.elimination_margin
+        ):
+            logger.info(f"Race round {round_idx}: dropped {key}")
+            return True
+        return None
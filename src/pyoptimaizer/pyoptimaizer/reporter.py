@@ -0,0 +1,226 @@
+import atexit
+import json
+from abc import ABC, abstractmethod
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, Optional, Union
+
+from loguru import logger
+
+# the VS Code extension listens here while a webview panel is open
+DEFAULT_URL = "ws://localhost:8085"
+
+Message = Dict[str, Any]
+
+
+def serialize(message: Message) -> str:
+    if not any(message.get("traces", {}).values()):
+        return json.dumps(message)
+    # deltas can carry plotly traces, imported lazily since most messages have none
+    from plotly.utils import PlotlyJSONEncoder
+
+    return json.dumps(message, cls=PlotlyJSONEncoder)
+
+
+def merge_deltas(older: Optional[Message], newer: Message) -> Message:
+    """A single delta with the effect of applying `older` and then `newer`, see html_display.IncrementalRenderer."""
+    if older is None:
+        return newer
+    rows = {row["key"]: row for row in older["rows"]}
+    rows.update((row["key"], row) for row in newer["rows"])
+    return {
+        **older,
+        **newer,
+        "rows": list(rows.values()),
+        "traces": {plot: older["traces"].get(plot, []) + traces for plot, traces in newer["traces"].items()},
+    }
+
+
+class Sink(ABC):
+    """Destination of UI messages. `send` may block and raises when the destination is not reachable."""
+
+    @abstractmethod
+    def send(self, message: Message):
+        ...
+
+    def close(self):
+        pass
+
+
+class WebSocketSink(Sink):
+    """Sends messages to the webview of the VS Code extension, connecting on the first send."""
+
+    def __init__(self, url: str = DEFAULT_URL, open_timeout: float = 2):
+        self.url = url
+        self.open_timeout = open_timeout
+        self.connection = None
+
+    def send(self, message: Message):
+        if self.connection is None:
+            # imported lazily, headless runs do not need it
+            import websockets.sync.client
+
+            self.connection = websockets.sync.client.connect(
+                self.url, open_timeout=self.open_timeout, max_size=None
+            )
+        self.connection.send(serialize(message))
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+
+class JsonlSink(Sink):
+    """Appends every message as a line to a file, for runs without a UI. The html of a page is left out."""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.file = None
+
+    def send(self, message: Message):
+        if message["type"] == "shell":
+            message = {key: value for key, value in message.items() if key != "html"}
+        if self.file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.file = open(self.path, "a")
+        self.file.write(serialize(message) + "\n")
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class PipeSink(Sink):
+    """Sends messages to the parent process over a multiprocessing connection, see daemon."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def send(self, message: Message):
+        self.connection.send(serialize(message))
+
+
+class BackgroundReporter:
+    """Delivers UI messages to a sink on a background thread, so a slow or absent UI never
+    stalls the optimization.
+
+    The queue is bounded: when it is full, a new delta is merged into the last queued one, so
+    intermediate frames are dropped but no row is lost. A new page replaces everything that
+    was not sent yet. When the sink fails, the reporter reconnects with exponential backoff,
+    and sends the page with the merged state of all earlier deltas again, since the UI on the
+    other end may have been restarted.
+    """
+
+    def __init__(
+        self,
+        sink: Sink,
+        max_queue: int = 16,
+        min_backoff_s: float = 0.5,
+        max_backoff_s: float = 30,
+    ):
+        self.sink = sink
+        self.max_queue = max_queue
+        self.min_backoff_s = min_backoff_s
+        self.max_backoff_s = max_backoff_s
+        # number of frames merged into a later one because the queue was full
+        self.dropped = 0
+        self._queue: Deque[Message] = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        # a message was taken from the queue and is not delivered yet
+        self._busy = False
+        # the last page that was sent and the merged deltas sent after it, to restore the UI after reconnecting
+        self._shell: Optional[Message] = None
+        self._state: Optional[Message] = None
+        self._thread = threading.Thread(target=self._run, name="reporter", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def report(self, message: Message):
+        """Queue a message, never blocks."""
+        with self._condition:
+            if message["type"] == "shell":
+                self._queue.clear()
+                self._queue.append(message)
+            elif len(self._queue) >= self.max_queue and self._queue[-1]["type"] == "delta":
+                self._queue[-1] = merge_deltas(self._queue[-1], message)
+                self.dropped += 1
+            else:
+                self._queue.append(message)
+            self._condition.notify()
+
+    def _next(self) -> Optional[Message]:
+        with self._condition:
+            while not self._queue and not self._closed:
+                self._condition.wait()
+            self._busy = bool(self._queue)
+            return self._queue.popleft() if self._queue else None
+
+    def _done(self):
+        with self._condition:
+            self._busy = False
+            self._condition.notify_all()
+
+    def _send(self, message: Message, restore: bool):
+        if restore and message["type"] == "delta" and self._shell is not None:
+            self.sink.send(self._shell)
+            if self._state is not None:
+                self.sink.send(self._state)
+        self.sink.send(message)
+        if message["type"] == "shell":
+            self._shell, self._state = message, None
+        else:
+            self._state = merge_deltas(self._state, message)
+
+    def _run(self):
+        backoff_s = self.min_backoff_s
+        restore = False
+        while True:
+            message = self._next()
+            if message is None:
+                return
+            try:
+                self._send(message, restore)
+            except Exception as e:
+                if not restore:
+                    logger.warning(f"UI not reachable, retrying in the background: {e}")
+                self.sink.close()
+                restore = True
+                with self._condition:
+                    if self._closed:
+                        return
+                    # retry the message first, later frames are merged into it
+                    if self._queue and self._queue[0]["type"] == "delta" and message["type"] == "delta":
+                        self._queue[0] = merge_deltas(message, self._queue[0])
+                    elif not (self._queue and self._queue[0]["type"] == "shell"):
+                        self._queue.appendleft(message)
+                    self._busy = False
+                    self._condition.wait_for(lambda: self._closed, backoff_s)
+                backoff_s = min(backoff_s * 2, self.max_backoff_s)
+                continue
+            if restore:
+                logger.info("UI reconnected")
+            backoff_s = self.min_backoff_s
+            restore = False
+            self._done()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the queue is empty, returns False on a timeout."""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._queue and not self._busy, timeout)
+
+    def close(self, timeout: float = 2):
+        """Send what is queued within `timeout` seconds, then stop."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        self.sink.close()
+        atexit.unregister(self.close)
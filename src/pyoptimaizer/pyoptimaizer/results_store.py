@@ -0,0 +1,302 @@
+import ast
+import hashlib
+import json
+import sqlite3
+import textwrap
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional, Tuple, Union
+
+from loguru import logger
+from pydantic import BaseModel
+
+from pyoptimaizer.assistants import AssistantCodeOptimizationResult, AssistantCodeTestCreateResult
+from pyoptimaizer.backends import get_backend
+from pyoptimaizer.build_cache import default_cache_dir as default_build_cache_dir
+from pyoptimaizer.build_cache import source_digest
+from pyoptimaizer.evolution import code_similarity
+from pyoptimaizer.types import BuildConfig, EvaluatedOptimizedFunctionResult, Lineage
+from pyoptimaizer.utils import jsonable
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletionMessage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS functions (
+    function_key TEXT PRIMARY KEY,
+    function_name TEXT NOT NULL,
+    source TEXT NOT NULL,
+    suite_key TEXT NOT NULL,
+    tests TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS candidates (
+    function_key TEXT NOT NULL,
+    suite_key TEXT NOT NULL,
+    candidate_key TEXT NOT NULL,
+    function_name TEXT NOT NULL,
+    backend TEXT,
+    code TEXT NOT NULL,
+    build_config TEXT,
+    runtime_ms REAL NOT NULL,
+    speedup REAL,
+    error TEXT NOT NULL,
+    benchmark TEXT,
+    lineage TEXT,
+    previous_messages TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (function_key, suite_key, candidate_key)
+);
+"""
+
+
+def default_store_path() -> Path:
+    """Get the path of the results database, next to the build cache."""
+    return default_build_cache_dir().parent / "results.sqlite3"
+
+
+def function_key(source: str) -> str:
+    """Hash of the syntax tree of a function, so comments and formatting do not change it."""
+    tree = ast.parse(textwrap.dedent(source))
+    return hashlib.sha256(ast.dump(tree).encode()).hexdigest()
+
+
+def suite_key(test_create_results: List[AssistantCodeTestCreateResult]) -> str:
+    """Hash of the syntax trees of a test suite."""
+    h = hashlib.sha256()
+    for result in test_create_results:
+        for code in result.import_statements + result.new_tests:
+            h.update(function_key(code).encode())
+    return h.hexdigest()
+
+
+class StoredCandidate(BaseModel):
+    """A candidate of an earlier run."""
+    function_name: str
+    backend: Optional[str] = None
+    # full source of the candidate file, including the header of its backend and build config
+    code: str
+    build_config: Optional[BuildConfig] = None
+    runtime_ms: float
+    speedup: Optional[float] = None
+    error: str = ""
+    lineage: Optional[Lineage] = None
+    previous_messages: List = []
+    # similarity of the function it optimized to the function of the lookup, 1.0 for the same function
+    similarity: float = 1.0
+
+    def as_seed(self) -> Tuple[AssistantCodeOptimizationResult, List["ChatCompletionMessage"]]:
+        """The candidate as an optimization result, to evaluate it again in a new run."""
+        header = get_backend(self.backend or "cython").header
+        code = self.code[len(header):] if self.code.startswith(header) else self.code
+        # candidates are written as the header, the imports, a newline and the code,
+        # split it the same way so the seed is written to the path it was stored from
+        imports, _, code = code.partition("\n")
+        result = AssistantCodeOptimizationResult(
+            reasoning="Best candidate of an earlier run",
+            cython_function=code,
+            import_statements=[imports] if imports else [],
+            backend=self.backend or "cython",
+            lineage=Lineage(operator="warm_start"),
+            # the code still has the header of its build config, so it is not autotuned again
+            build_config=self.build_config,
+        )
+        return result, self.previous_messages
+
+
+class ResultsStore:
+    """SQLite database of the tests and the evaluated candidates of every run.
+
+    Functions are keyed by the hash of their syntax tree and candidates by the keys of
+    the function and of the test suite they were evaluated on, so a run on an unchanged
+    function can reuse the tests and start from the best candidates of the earlier runs.
+    Only the best `max_candidates` candidates of the `max_functions` most recently
+    optimized functions are kept.
+    """
+
+    def __init__(
+        self,
+        path: Optional[Union[str, Path]] = None,
+        max_candidates: int = 20,
+        max_functions: int = 200,
+    ):
+        """
+        Args:
+            path (Union[str, Path], optional): Database file. Defaults to the user-wide cache directory.
+            max_candidates (int): Maximum number of stored candidates per function.
+            max_functions (int): Maximum number of stored functions, the least recently optimized ones are removed.
+        """
+        self.path = Path(path) if path else default_store_path()
+        self.max_candidates = max_candidates
+        self.max_functions = max_functions
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # every call gets its own connection, so the store can be used from any thread
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        connection.executescript(SCHEMA)
+        return connection
+
+    def _prune(self, connection: sqlite3.Connection, key: str):
+        # working candidates first, then like _candidates
+        connection.execute(
+            "DELETE FROM candidates WHERE function_key = ? AND rowid NOT IN ("
+            "SELECT rowid FROM candidates WHERE function_key = ? "
+            "ORDER BY error != '', speedup IS NULL, speedup DESC, runtime_ms LIMIT ?)",
+            (key, key, self.max_candidates),
+        )
+        connection.execute(
+            "DELETE FROM functions WHERE function_key NOT IN ("
+            "SELECT function_key FROM functions ORDER BY updated_at DESC LIMIT ?)",
+            (self.max_functions,),
+        )
+        connection.execute(
+            "DELETE FROM candidates WHERE function_key NOT IN (SELECT function_key FROM functions)"
+        )
+
+    def store_tests(self, source: str, function_name: str, test_create_results: List[AssistantCodeTestCreateResult]):
+        """Store the final tests of a function, replacing the tests of earlier runs."""
+        tests = json.dumps([result.model_dump() for result in test_create_results])
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO functions VALUES (?, ?, ?, ?, ?, ?)",
+                (function_key(source), function_name, source, suite_key(test_create_results), tests, time.time()),
+            )
+            self._prune(connection, function_key(source))
+
+    def load_tests(self, source: str) -> Optional[List[AssistantCodeTestCreateResult]]:
+        """The tests of an earlier run on the same function, None when it was never optimized."""
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT tests FROM functions WHERE function_key = ?", (function_key(source),)
+            ).fetchone()
+        if row is None:
+            return None
+        return [AssistantCodeTestCreateResult.model_validate(result) for result in json.loads(row["tests"])]
+
+    def store_results(
+        self,
+        source: str,
+        test_create_results: List[AssistantCodeTestCreateResult],
+        results: List[EvaluatedOptimizedFunctionResult],
+    ):
+        """Store evaluated candidates, the original function is left out.
+        A candidate that was stored before is overwritten with its latest evaluation.
+        The tests of the function have to be stored first, see `store_tests`."""
+        key, suite = function_key(source), suite_key(test_create_results)
+        rows = []
+        for result in results:
+            if result.lineage is None or result.raced_out:
+                continue
+            try:
+                code = Path(result.optimized_function_path).read_text()
+            except OSError:
+                logger.warning(f"Could not store {result.optimized_function_path}, it was removed")
+                continue
+            rows.append(
+                (
+                    key,
+                    suite,
+                    source_digest(code, 64),
+                    result.function_name,
+                    result.backend,
+                    code,
+                    result.build_config.model_dump_json() if result.build_config else None,
+                    result.runtime_ms,
+                    result.speedup,
+                    result.error,
+                    result.benchmark.model_dump_json() if result.benchmark else None,
+                    result.lineage.model_dump_json(),
+                    json.dumps([jsonable(message) for message in result.previous_messages]),
+                    time.time(),
+                )
+            )
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO candidates VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self._prune(connection, key)
+
+    def _candidates(self, connection: sqlite3.Connection, where: str, params: tuple, limit: int) -> List[StoredCandidate]:
+        # the speedup was measured against the original on the same machine and day, the runtime was not
+        rows = connection.execute(
+            f"SELECT * FROM candidates WHERE error = '' AND {where} "
+            "ORDER BY speedup IS NULL, speedup DESC, runtime_ms LIMIT ?",
+            params + (limit,),
+        ).fetchall()
+        return [
+            StoredCandidate(
+                function_name=row["function_name"],
+                backend=row["backend"],
+                code=row["code"],
+                build_config=BuildConfig.model_validate_json(row["build_config"]) if row["build_config"] else None,
+                runtime_ms=row["runtime_ms"],
+                speedup=row["speedup"],
+                error=row["error"],
+                lineage=Lineage.model_validate_json(row["lineage"]) if row["lineage"] else None,
+                previous_messages=json.loads(row["previous_messages"]),
+            )
+            for row in rows
+        ]
+
+    def best_candidates(
+        self,
+        source: str,
+        test_create_results: List[AssistantCodeTestCreateResult],
+        limit: int,
+    ) -> List[StoredCandidate]:
+        """The fastest working candidates of the same function on the same tests, best first."""
+        with closing(self._connect()) as connection:
+            return self._candidates(
+                connection,
+                "function_key = ? AND suite_key = ?",
+                (function_key(source), suite_key(test_create_results)),
+                limit,
+            )
+
+    def similar_candidates(
+        self, source: str, function_name: str, limit: int, min_similarity: float = 0.8
+    ) -> List[StoredCandidate]:
+        """The fastest working candidates of the earlier versions of a function with the same name,
+        of the most similar version first. Versions less similar than `min_similarity` are left out."""
+        key = function_key(source)
+        with closing(self._connect()) as connection:
+            versions = connection.execute(
+                "SELECT function_key, source FROM functions WHERE function_name = ? AND function_key != ?",
+                (function_name, key),
+            ).fetchall()
+            scored = [(code_similarity(source, row["source"]), row["function_key"]) for row in versions]
+            candidates = []
+            for similarity, version_key in sorted(scored, reverse=True):
+                if similarity < min_similarity or len(candidates) >= limit:
+                    break
+                for candidate in self._candidates(
+                    connection, "function_key = ?", (version_key,), limit - len(candidates)
+                ):
+                    candidate.similarity = similarity
+                    candidates.append(candidate)
+        return candidates
+
+    def warm_start(
+        self,
+        source: str,
+        function_name: str,
+        test_create_results: List[AssistantCodeTestCreateResult],
+        limit: int,
+        min_similarity: float = 0.8,
+    ) -> List[StoredCandidate]:
+        """Candidates to seed a new run with: the best ones of the same function, or when it changed,
+        the best ones of its most similar earlier version."""
+        candidates = self.best_candidates(source, test_create_results, limit)
+        if candidates:
+            logger.info(f"Starting from {len(candidates)} candidates of earlier runs")
+            return candidates
+        candidates = self.similar_candidates(source, function_name, limit, min_similarity)
+        if candidates:
+            logger.info(
+                f"Starting from {len(candidates)} candidates of an earlier version of {function_name} "
+                f"({candidates[0].similarity:.0%} similar)"
+            )
+        return candidates
@@ -0,0 +1,165 @@
+import importlib
+import importlib.util
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence, Union
+
+from pyoptimaizer.capture import Call, corpus_workload, load_corpus
+from pyoptimaizer.benchmark import BenchmarkConfig, benchmark_callable, calls_per_second, pinned, summarize
+from pyoptimaizer.memory import measure_memory
+from pyoptimaizer.types import BenchmarkResult, ThroughputPoint
+
+
+def get_all_test_functions_in_module(module):
+    """Get all functions in a module.
+    Args:
+        module: Module to get functions from.
+    """
+    funcs = []
+    for name in dir(module):
+        attr = getattr(module, name)
+        if callable(attr) and name.startswith("test"):
+            funcs.append(attr)
+    return funcs
+
+class FaultyTestError(Exception):
+    def __init__(self, test_name, function):
+        self.test_name = test_name
+        self.function = function
+        super().__init__(f"Error running test {test_name} with {function}")
+
+def run_test_file_with_replacement_function(
+    test_file_path,
+    replacement_function_path,
+    function_name,
+    config: Optional[BenchmarkConfig] = None,
+    corpus_dir: Optional[Union[str, Path]] = None,
+) -> BenchmarkResult:
+    """Run a test file with a cythonized function.
+    Args:
+        test_file (str): Path to the test file.
+        optimized_function_path (str): Path to the optimized function.
+        function_name (str): Name of the function to test.
+        config (BenchmarkConfig, optional): Benchmark settings.
+        corpus_dir (Union[str, Path], optional): Recorded calls to replay as an extra benchmark, see capture.
+    """
+    test_module = import_test_module_with_replacement(test_file_path, replacement_function_path, function_name)
+    corpus = load_corpus(corpus_dir) if corpus_dir else None
+    return benchmark_test_module(
+        test_module, Path(replacement_function_path).stem, config, corpus, function_name
+    )
+
+
+def import_test_module_with_replacement(test_file_path, replacement_function_path, function_name):
+    """Import a test module with the function under test replaced by the one of another file."""
+    test_module = import_module_from_file(test_file_path)
+    replacement_module = import_module_from_file(replacement_function_path)
+    replacement_func = getattr(replacement_module, function_name)
+    setattr(test_module, function_name, replacement_func)
+    return test_module
+
+
+def run_test_file_throughput(
+    test_file_path,
+    replacement_function_path,
+    function_name,
+    threads: Sequence[int],
+    duration_s: float = 0.2,
+    corpus_dir: Optional[Union[str, Path]] = None,
+) -> List[ThroughputPoint]:
+    """Run the tests of a test file from several threads at once and measure the calls per second,
+    where a call is a single run of one test.
+    Args:
+        test_file_path (str): Path to the test file.
+        replacement_function_path (str): Path to the optimized function.
+        function_name (str): Name of the function to test.
+        threads (Sequence[int]): Numbers of concurrent callers to measure, the scaling is against 1.
+        duration_s (float): Time to keep calling per number of callers.
+        corpus_dir (Union[str, Path], optional): Recorded calls to replay as an extra test, see capture.
+    """
+    test_module = import_test_module_with_replacement(test_file_path, replacement_function_path, function_name)
+    tests = get_all_test_functions_in_module(test_module)
+    if corpus_dir:
+        tests.append(corpus_workload(getattr(test_module, function_name), load_corpus(corpus_dir)))
+    for test in tests:
+        try:
+            # warm up, and fail before starting any threads
+            test()
+        except Exception as e:
+            raise FaultyTestError(test.__name__, Path(replacement_function_path).stem) from e
+    rates = {k: calls_per_second(tests, k, duration_s) for k in sorted(set(threads) | {1})}
+    points = [ThroughputPoint(threads=k, calls_per_s=rate, scaling=rate / rates[1]) for k, rate in rates.items()]
+    for point in points:
+        print(f"{point.threads} threads: {point.calls_per_s:.0f} calls/s ({point.scaling:.2f}x)")
+    return points
+
+
+def benchmark_test_module(
+    test_module,
+    function_label: str,
+    config: Optional[BenchmarkConfig] = None,
+    corpus: Optional[List[Call]] = None,
+    function_name: Optional[str] = None,
+) -> BenchmarkResult:
+    """Benchmark all tests of an already imported test module.
+    Args:
+        test_module: Module containing the tests, with the function under test already replaced.
+        function_label (str): Name of the function under test, used in errors.
+        config (BenchmarkConfig, optional): Benchmark settings.
+        corpus (List[Call], optional): Recorded calls, replayed against `function_name` of the module
+            as an extra benchmark named "corpus".
+        function_name (str, optional): Name of the function under test, required with a corpus.
+    """
+    config = config or BenchmarkConfig()
+    # run tests
+    tests = get_all_test_functions_in_module(test_module)
+    if corpus:
+        # looked up now, after the function under test was replaced
+        tests.append(corpus_workload(getattr(test_module, function_name), corpus))
+    # benchmark tests
+    timings = {}
+    start = time.perf_counter()
+    with pinned(config.cpu_affinity):
+        for test in tests:
+            try:
+                timing = benchmark_callable(test.__name__, test, config)
+            except Exception as e:
+                raise FaultyTestError(test.__name__, function_label) from e
+            print(
+                f"{test.__name__}: median {timing.median_s} (s), IQR {timing.iqr_s} (s) "
+                f"over {len(timing.samples_s)} samples of {timing.loops} loops"
+            )
+            timings[test.__name__] = timing
+
+        memory = {}
+        if config.measure_memory:
+            # tracemalloc slows the calls down, so memory is measured after timing
+            for test in tests:
+                memory[test.__name__] = measure_memory(test)
+
+    result = summarize(timings)
+    result.duration_s = time.perf_counter() - start
+    result.memory = memory
+    return result
+
+
+def import_module_from_file(file_path: Union[str, Path]):
+    """Import a module from a file path.
+    Args:
+        file_path (Union[str, Path]): Path to the file to import.
+    """
+    file_path = Path(file_path)
+    module_name = file_path.stem
+    if file_path.suffix == ".so":
+        # extension modules are named like module.cpython-311-x86_64-linux-gnu.so
+        module_name = file_path.name.split(".")[0]
+    spec = importlib.util.spec_from_file_location(module_name, file_path)
+    if spec is None:  # import pyx from .so
+        # TODO: figure out how to handle pyximport better
+        so_files = list(file_path.parent.glob(f"{module_name}.*.so"))
+        # pick first one for now
+        file_path = so_files[0]
+        spec = importlib.util.spec_from_file_location(module_name, file_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
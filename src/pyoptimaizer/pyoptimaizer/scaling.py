@@ -0,0 +1,180 @@
+import math
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+
+from loguru import logger
+from pydantic import BaseModel
+
+from pyoptimaizer.backends import result_import_path
+from pyoptimaizer.benchmark import BenchmarkConfig, benchmark_callable
+from pyoptimaizer.runner import import_module_from_file
+from pyoptimaizer.scheduler import BenchmarkScheduler
+from pyoptimaizer.types import EvaluatedOptimizedFunctionResult, ScalingCurve, ScalingPoint
+
+
+class ScalingConfig(BaseModel):
+    # input sizes of the sweep: min_size, min_size * growth, ... up to max_size
+    min_size: int = 16
+    max_size: int = 2**20
+    growth: float = 4.0
+    # stop the sweep once a single call takes longer than this, larger sizes are extrapolated
+    max_call_s: float = 0.5
+    # rank candidates by their predicted runtime at this input size
+    target_size: Optional[int] = None
+    # number of the largest measured sizes the power law is fitted to, small sizes mostly measure call overhead
+    fit_points: int = 3
+    benchmark: BenchmarkConfig = BenchmarkConfig(repeats=5, min_sample_time_s=0.005, bootstrap_resamples=20)
+
+
+def sweep_sizes(config: ScalingConfig) -> List[int]:
+    """Geometric sweep of input sizes, including the target size when it is in range."""
+    sizes = []
+    size = float(config.min_size)
+    while size <= config.max_size:
+        sizes.append(int(round(size)))
+        size *= config.growth
+    if config.target_size is not None and config.min_size <= config.target_size <= config.max_size:
+        sizes.append(config.target_size)
+    return sorted(set(sizes))
+
+
+def fit_power_law(points: Sequence[ScalingPoint]) -> Tuple[float, float]:
+    """Least squares fit of runtime = coefficient * size ** exponent in log-log space.
+
+    Returns:
+        (exponent, coefficient)
+    """
+    if len(points) == 1:
+        return 0.0, points[0].median_s
+    xs = [math.log(p.size) for p in points]
+    ys = [math.log(max(p.median_s, 1e-12)) for p in points]
+    x_mean, y_mean = sum(xs) / len(xs), sum(ys) / len(ys)
+    variance = sum((x - x_mean) ** 2 for x in xs)
+    exponent = sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, ys)) / variance
+    return exponent, math.exp(y_mean - exponent * x_mean)
+
+
+def measure_scaling(
+    func: Callable, make_arguments: Callable[[int], Tuple[tuple, dict]], config: ScalingConfig
+) -> ScalingCurve:
+    """Time a function over a sweep of input sizes and fit a power law to the largest ones.
+    Args:
+        func (Callable): Function to time.
+        make_arguments (Callable): Workload generator, gets a size and returns (args, kwargs).
+        config (ScalingConfig): Sweep settings.
+    """
+    points = []
+    for size in sweep_sizes(config):
+        args, kwargs = make_arguments(size)
+        timing = benchmark_callable(f"n={size}", lambda: func(*args, **kwargs), config.benchmark)
+        points.append(ScalingPoint(size=size, median_s=timing.median_s))
+        if timing.median_s > config.max_call_s:
+            break
+    exponent, coefficient = fit_power_law(points[-config.fit_points :])
+    return ScalingCurve(points=points, exponent=exponent, coefficient=coefficient)
+
+
+def run_scaling_sweep(
+    workload_file_path: Union[str, Path],
+    replacement_function_path: Union[str, Path],
+    function_name: str,
+    config: ScalingConfig,
+) -> ScalingCurve:
+    """Measure the scaling curve of a candidate, with the inputs of a workload file.
+    Meant to run in a separate process, like run_test_file_with_replacement_function."""
+    workload = import_module_from_file(workload_file_path)
+    replacement_module = import_module_from_file(replacement_function_path)
+    curve = measure_scaling(getattr(replacement_module, function_name), workload.make_arguments, config)
+    print(
+        f"{Path(replacement_function_path).stem}: runtime ~ n^{curve.exponent:.2f} "
+        f"over {len(curve.points)} sizes up to n={curve.points[-1].size}"
+    )
+    return curve
+
+
+def sweep_results(
+    results: List[EvaluatedOptimizedFunctionResult],
+    workload_file_path: Union[str, Path],
+    config: ScalingConfig,
+    cores: Optional[List[int]] = None,
+    timeout: float = 60,
+):
+    """Measure the scaling curves of the results that do not have one yet, in place.
+    Every sweep runs in a separate process pinned to one of the cores, so a crashing
+    candidate cannot take down the main process. Raced out results are skipped.
+    Args:
+        results (List[EvaluatedOptimizedFunctionResult]): Evaluated results, including the original.
+        workload_file_path (Union[str, Path]): File with the `make_arguments(n)` workload generator.
+        config (ScalingConfig): Sweep settings.
+        cores (List[int], optional): Cores to run the sweeps on.
+        timeout (float): Maximum runtime of a single sweep in seconds.
+    """
+    pending = [r for r in results if r.scaling is None and not r.raced_out and not r.error]
+    with BenchmarkScheduler(cores, timeout=timeout) as scheduler:
+        futures = [
+            (
+                result,
+                scheduler.submit(
+                    run_scaling_sweep,
+                    workload_file_path,
+                    result_import_path(result),
+                    result.function_name,
+                    config,
+                ),
+            )
+            for result in pending
+        ]
+        for result, future in futures:
+            try:
+                result.scaling = future.result()
+            except Exception:
+                logger.exception(f"Error measuring the scaling of {Path(result.optimized_function_path).name}")
+
+
+def workload_file_path(function_file_path: Union[str, Path]) -> Path:
+    """Path of the workload generator of a file, next to it."""
+    function_file_path = Path(function_file_path)
+    return function_file_path.parent / f"workload_{function_file_path.stem}.py"
+
+
+def generate_workload(function_path: str) -> Path:
+    """Write the workload generator of a function, asking the LLM for it.
+    An existing workload file is kept, so users can write their own `make_arguments(n)`.
+    Args:
+        function_path (str): Path to file with function, e.g. /path/to/file.py::function_name
+    """
+    # imported lazily, so sweeps in benchmark processes do not pull in the LLM clients
+    from pyoptimaizer.assistants import WorkloadGeneratorAssistant
+    from pyoptimaizer.source_utils import function_source
+
+    function_file_path = Path(function_path.split("::")[0])
+    function_name = function_path.split("::")[1]
+    path = workload_file_path(function_file_path)
+    if path.exists():
+        logger.info(f"Using existing workload {path}")
+        return path
+
+    # from the project index, so methods and nested functions are found like everywhere else
+    imports, source = function_source(function_file_path, function_name)
+    results = WorkloadGeneratorAssistant().create_workload(imports, source)
+    if not results:
+        raise ValueError(f"Could not generate a workload for {function_name}")
+    with open(path, "w") as f:
+        f.write("# Autogenerated benchmark workload, make_arguments(n) returns (args, kwargs) of size n\n")
+        for imp in imports + results[0].import_statements:
+            f.write(imp)
+            f.write("\n")
+        f.write("\n\n")
+        f.write(results[0].make_arguments)
+        f.write("\n")
+    return path
+
+
+def rank_at_size(
+    results: List[EvaluatedOptimizedFunctionResult], target_size: int
+) -> List[EvaluatedOptimizedFunctionResult]:
+    """Order results by their predicted runtime at the target size, fastest first.
+    Results without a scaling curve go last, in their original order."""
+    with_curve = [r for r in results if r.scaling is not None]
+    without_curve = [r for r in results if r.scaling is None]
+    return sorted(with_curve, key=lambda r: r.scaling.predict_s(target_size)) + without_curve  # type: ignore
@@ -0,0 +1,140 @@
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from pyoptimaizer.utils import Process
+
+
+def available_cores() -> List[int]:
+    """Get the cores this process is allowed to run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cores(
+    cores: List[int], benchmark_slots: Optional[int] = None
+) -> Tuple[List[int], List[int]]:
+    """Split cores into a set reserved for benchmarks and a set for compiling.
+
+    When there are not enough cores to keep benchmarks and compiles apart,
+    both sets are the same and the caller should avoid overlapping them.
+
+    Args:
+        cores (List[int]): Cores to partition.
+        benchmark_slots (int, optional): Number of cores to reserve for benchmarks.
+            Defaults to half of the cores.
+    """
+    if len(cores) < 2:
+        return list(cores), list(cores)
+    if benchmark_slots is None:
+        benchmark_slots = len(cores) // 2
+    benchmark_slots = max(1, min(benchmark_slots, len(cores) - 1))
+    return list(cores[:benchmark_slots]), list(cores[benchmark_slots:])
+
+
+def set_process_affinity(pid: int, cores: Optional[Iterable[int]]):
+    """Pin a process to a set of cores, if the platform supports it."""
+    if not cores or not hasattr(os, "sched_setaffinity"):
+        return
+    try:
+        os.sched_setaffinity(pid, set(cores))
+    except OSError:
+        logger.warning(f"Could not set cpu affinity of process {pid}")
+
+
+class BenchmarkCrashedError(Exception):
+    def __init__(self, message, exitcode=None):
+        self.exitcode = exitcode
+        super().__init__(message)
+
+
+def run_in_process(target: Callable, args: tuple, cpu_affinity: Optional[List[int]], timeout: float):
+    """Run `target(*args)` in a separate process pinned to `cpu_affinity` and return its result.
+
+    Raises the exception of the target, or a BenchmarkCrashedError when the process died or timed out.
+    """
+    # Note: we have to run this in a separate process because the cythonized function
+    # can segfault and crash the main process
+    p = Process(target=target, args=args, cpu_affinity=cpu_affinity)
+    p.start()
+    p.join(timeout)
+    if p.is_alive():
+        p.terminate()
+        p.join()
+        raise BenchmarkCrashedError(f"Benchmark timed out after {timeout} seconds", p.exitcode)
+    exc, tb = p.exception or (None, None)
+    if exc:
+        raise BenchmarkCrashedError(exc, p.exitcode)
+    if p.exitcode != 0:
+        raise BenchmarkCrashedError(f"Benchmark process exited with code {p.exitcode}", p.exitcode)
+    return p.result
+
+
+class BenchmarkScheduler:
+    """Runs benchmark processes concurrently, each pinned to its own core.
+
+    A benchmark only starts when one of the reserved cores is free, so two
+    benchmarks never share a core and never compete for the same caches.
+    """
+
+    def __init__(self, cores: Optional[List[int]] = None, timeout: float = 5):
+        """
+        Args:
+            cores (List[int], optional): Cores to hand out to benchmarks, one benchmark per core.
+                Defaults to a single core of this machine.
+            timeout (float): Maximum runtime of a single benchmark process in seconds.
+        """
+        self.cores = cores or available_cores()[:1]
+        self.timeout = timeout
+        self._free_cores: "queue.Queue[int]" = queue.Queue()
+        for core in self.cores:
+            self._free_cores.put(core)
+        self._threads: List[threading.Thread] = []
+
+    def submit(self, target: Callable, *args: Any) -> Future:
+        """Schedule `target(*args)` in a separate, pinned process.
+
+        The returned future resolves to the return value of the target, or raises
+        the exception of the target or a BenchmarkCrashedError when the process died.
+        """
+        # Note: we use plain threads instead of a ThreadPoolExecutor, because processes
+        # forked from executor threads exit with code 1 on shutdown
+        future: Future = Future()
+        thread = threading.Thread(
+            target=self._run_into_future, args=(future, target, args), daemon=True
+        )
+        self._threads.append(thread)
+        thread.start()
+        return future
+
+    def _run_into_future(self, future: Future, target: Callable, args: tuple):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(self._run(target, args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def _run(self, target: Callable, args: tuple):
+        core = self._free_cores.get()
+        try:
+            return run_in_process(target, args, [core], self.timeout)
+        finally:
+            self._free_cores.put(core)
+
+    def shutdown(self, wait: bool = True):
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
@@ -1,55 +1,348 @@
 import ast
+import hashlib
+import os
+import threading
 from pathlib import Path
-from typing import List, Union, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
 from loguru import logger
+from pydantic import BaseModel
+
+# directories that never hold code of the project
+SKIPPED_DIRECTORIES = {"__pycache__", "node_modules", "site-packages", "build", "dist"}
+
+
+class FunctionInfo(BaseModel):
+    file_path: str
+    # dotted module name, relative to the root of the index
+    module: str
+    name: str
+    # like __qualname__, e.g. "Kernel.run" for a method and "outer.<locals>.inner" for a nested function
+    qualname: str
+    # "function", "method" or "nested"
+    kind: str
+    start_line: int
+    end_line: int
+    source: str
+    # callees as written, e.g. "helper", "np.sum" or "self.step", see ProjectIndex.callees
+    calls: List[str] = []
+
+
+class ModuleInfo(BaseModel):
+    file_path: str
+    module: str
+    mtime_ns: int
+    size: int
+    digest: str
+    # source of every top-level import statement
+    imports: List[str]
+    # local name of every import, to the dotted name it refers to
+    imported_names: Dict[str, str]
+    functions: Dict[str, FunctionInfo]
+
+
+def _dotted_name(node: ast.AST) -> Optional[str]:
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return ".".join(reversed(parts))
+
+
+def _calls(function_node: ast.AST) -> List[str]:
+    # in the order of the source, calls of nested functions and classes belong to those
+    calls = []
+    stack = list(reversed(list(ast.iter_child_nodes(function_node))))
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+            continue
+        if isinstance(node, ast.Call):
+            name = _dotted_name(node.func)
+            if name is not None and name not in calls:
+                calls.append(name)
+        stack.extend(reversed(list(ast.iter_child_nodes(node))))
+    return calls
+
+
+def _imported_names(node: Union[ast.Import, ast.ImportFrom], module: str, is_package: bool) -> Dict[str, str]:
+    if isinstance(node, ast.Import):
+        # "import a.b" binds a, "import a.b as c" binds c to a.b
+        return {
+            alias.asname or alias.name.split(".")[0]: alias.name if alias.asname else alias.name.split(".")[0]
+            for alias in node.names
+        }
+    base = node.module or ""
+    if node.level:
+        package = module.split(".") if is_package else module.split(".")[:-1]
+        package = package[: len(package) - node.level + 1]
+        base = ".".join(package + ([base] if base else []))
+    return {alias.asname or alias.name: f"{base}.{alias.name}" if base else alias.name for alias in node.names}
+
+
+def parse_module(source: str, file_path: str, module: str) -> Tuple[List[str], Dict[str, str], Dict[str, FunctionInfo]]:
+    """Get the top-level imports, the imported names and every function, method and nested function of a module."""
+    tree = ast.parse(source)
+    lines = source.split("\n")
+    is_package = Path(file_path).name == "__init__.py"
+
+    imports = []
+    imported_names: Dict[str, str] = {}
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            imports.append("\n".join(lines[node.lineno - 1 : node.end_lineno]))
+            imported_names.update(_imported_names(node, module, is_package))
+
+    functions: Dict[str, FunctionInfo] = {}
+
+    def visit(body: List[ast.stmt], prefix: str, kind: str):
+        for node in body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                qualname = prefix + node.name
+                functions[qualname] = FunctionInfo(
+                    file_path=file_path,
+                    module=module,
+                    name=node.name,
+                    qualname=qualname,
+                    kind=kind,
+                    start_line=node.lineno,
+                    end_line=node.end_lineno,
+                    source="\n".join(lines[node.lineno - 1 : node.end_lineno]),
+                    calls=_calls(node),
+                )
+                visit(node.body, f"{qualname}.<locals>.", "nested")
+            elif isinstance(node, ast.ClassDef):
+                visit(node.body, f"{prefix}{node.name}.", "method" if kind == "function" else kind)
+            elif isinstance(node, (ast.If, ast.Try, ast.With, ast.For, ast.While)):
+                # e.g. functions defined under `if sys.platform == ...`
+                for field in ("body", "orelse", "finalbody"):
+                    visit(getattr(node, field, []), prefix, kind)
+                for handler in getattr(node, "handlers", []):
+                    visit(handler.body, prefix, kind)
+
+    visit(tree.body, "", "function")
+    return imports, imported_names, functions
+
+
+class ProjectIndex:
+    """Index of the functions, imports and call edges of the Python files of a project.
+
+    Every file is parsed once. A file is parsed again only when its modification time or
+    size changed and its content hash changed too, so after that every lookup is a dict
+    lookup. Files are indexed on first use, or all at once with `index_project`.
+    """
+
+    def __init__(self, root: Optional[Union[str, Path]] = None):
+        """
+        Args:
+            root (Union[str, Path], optional): Root of the project, module names are relative to it.
+                Defaults to the directory of every file.
+        """
+        self.root = Path(root).resolve() if root else None
+        # number of files that were parsed, for tests and logging
+        self.parses = 0
+        self._modules: Dict[Path, ModuleInfo] = {}
+        self._by_module_name: Dict[str, Path] = {}
+        self._by_name: Dict[str, List[FunctionInfo]] = {}
+        self._callers: Optional[Dict[Tuple[str, str], List[FunctionInfo]]] = None
+        self._lock = threading.RLock()
+
+    def module_name(self, file_path: Path) -> str:
+        """Dotted name of the module of a file, e.g. pkg.kernels for <root>/pkg/kernels.py."""
+        if self.root is not None and self.root in file_path.parents:
+            parts = list(file_path.relative_to(self.root).with_suffix("").parts)
+        else:
+            parts = [file_path.stem]
+        if parts[-1] == "__init__" and len(parts) > 1:
+            parts = parts[:-1]
+        return ".".join(parts)
+
+    def module(self, file_path: Union[str, Path]) -> ModuleInfo:
+        """The index of a file, parsed again only when it changed."""
+        file_path = Path(file_path).resolve()
+        stat = file_path.stat()
+        with self._lock:
+            cached = self._modules.get(file_path)
+            if cached is not None and (cached.mtime_ns, cached.size) == (stat.st_mtime_ns, stat.st_size):
+                return cached
+            content = file_path.read_bytes()
+            digest = hashlib.sha256(content).hexdigest()
+            if cached is not None and cached.digest == digest:
+                # touched, not changed
+                cached.mtime_ns, cached.size = stat.st_mtime_ns, stat.st_size
+                return cached
+
+            module = self.module_name(file_path)
+            imports, imported_names, functions = parse_module(content.decode("utf-8"), str(file_path), module)
+            self.parses += 1
+            info = ModuleInfo(
+                file_path=str(file_path),
+                module=module,
+                mtime_ns=stat.st_mtime_ns,
+                size=stat.st_size,
+                digest=digest,
+                imports=imports,
+                imported_names=imported_names,
+                functions=functions,
+            )
+            if cached is not None:
+                for function in cached.functions.values():
+                    self._by_name[function.name].remove(function)
+            for function in functions.values():
+                self._by_name.setdefault(function.name, []).append(function)
+            self._modules[file_path] = info
+            self._by_module_name[module] = file_path
+            self._callers = None
+            return info
+
+    def function(self, file_path: Union[str, Path], qualname: str) -> Optional[FunctionInfo]:
+        """A function of a file by its qualified name, None when the file does not define it."""
+        return self.module(file_path).functions.get(qualname)
+
+    def imports(self, file_path: Union[str, Path]) -> List[str]:
+        """The top-level import statements of a file."""
+        return self.module(file_path).imports
+
+    def find(self, name: str) -> List[FunctionInfo]:
+        """Every indexed function, method or nested function called `name`."""
+        with self._lock:
+            return list(self._by_name.get(name, []))
+
+    def files(self, root: Optional[Union[str, Path]] = None) -> Iterator[Path]:
+        """The Python files under `root`, leaving out hidden, cache and build directories."""
+        root = Path(root or self.root or ".")
+        for directory, directories, file_names in os.walk(root):
+            directories[:] = sorted(
+                d for d in directories if not d.startswith(".") and d not in SKIPPED_DIRECTORIES
+            )
+            for file_name in sorted(file_names):
+                if file_name.endswith(".py"):
+                    yield Path(directory) / file_name
+
+    def index_project(self, root: Optional[Union[str, Path]] = None) -> int:
+        """Index every Python file under `root`, defaults to the root of the index.
+        Files that do not parse are skipped. Returns the number of indexed files."""
+        indexed = 0
+        for file_path in self.files(root):
+            try:
+                self.module(file_path)
+            except (SyntaxError, UnicodeDecodeError, OSError) as e:
+                logger.debug(f"Not indexing {file_path}: {e}")
+                continue
+            indexed += 1
+        return indexed
+
+    def _resolve_dotted(self, dotted: str) -> Optional[FunctionInfo]:
+        # the longest prefix that is an indexed module, the rest is the qualified name in it
+        parts = dotted.split(".")
+        for split in range(len(parts) - 1, 0, -1):
+            file_path = self._by_module_name.get(".".join(parts[:split]))
+            if file_path is not None:
+                return self._modules[file_path].functions.get(".".join(parts[split:]))
+        return None
+
+    def resolve_call(self, function: FunctionInfo, call: str) -> Optional[FunctionInfo]:
+        """The indexed function a call of `function` refers to, None for calls outside the index."""
+        module = self.module(function.file_path)
+        first, _, rest = call.partition(".")
+        scope = function.qualname.split(".")
+        if first in ("self", "cls") and rest and "." not in rest and function.kind == "method":
+            return module.functions.get(".".join(scope[:-1] + [rest]))
+        if not rest:
+            # nested functions of the enclosing functions first, then the module
+            while scope:
+                candidate = module.functions.get(".".join(scope + ["<locals>", call]))
+                if candidate is not None:
+                    return candidate
+                scope = scope[:-1]
+                while scope and scope[-1] == "<locals>":
+                    scope = scope[:-1]
+            if call in module.functions:
+                return module.functions[call]
+        if first in module.imported_names:
+            with self._lock:
+                return self._resolve_dotted(".".join(filter(None, [module.imported_names[first], rest])))
+        return None
+
+    def callees(self, function: FunctionInfo) -> List[FunctionInfo]:
+        """The indexed functions `function` calls."""
+        callees = []
+        for call in function.calls:
+            callee = self.resolve_call(function, call)
+            if callee is not None and callee not in callees:
+                callees.append(callee)
+        return callees
+
+    def callers(self, function: FunctionInfo) -> List[FunctionInfo]:
+        """The indexed functions that call `function`."""
+        with self._lock:
+            if self._callers is None:
+                callers: Dict[Tuple[str, str], List[FunctionInfo]] = {}
+                for module in list(self._modules.values()):
+                    for caller in module.functions.values():
+                        for callee in self.callees(caller):
+                            callers.setdefault((callee.file_path, callee.qualname), []).append(caller)
+                self._callers = callers
+            return list(self._callers.get((function.file_path, function.qualname), []))
+
+
+_project_index: Optional[ProjectIndex] = None
+
+
+def project_index() -> ProjectIndex:
+    """The index shared by every lookup of this process."""
+    global _project_index
+    if _project_index is None:
+        _project_index = ProjectIndex()
+    return _project_index
+
+
+def function_source(function_file_path: Union[str, Path], function_name: str) -> Tuple[List[str], str]:
+    """Get the imports of a file and the source of a function in it, from the project index, so the
+    file is only parsed again when it changed."""
+    index = project_index()
+    function = index.function(function_file_path, function_name)
+    if function is None:
+        raise ValueError(f"No function {function_name} in {function_file_path}")
+    return index.imports(function_file_path), function.source
+
 
 def get_lines_of_function(
     file_path: Union[str, Path], function_name: str
 ) -> Tuple[int, int]:
     """
-    Get the source code of a function from a file.
-    Note: only works for functions defined at the top level of the file.
+    Get the first and last line of a function in a file, (0, 0) when the file does not define it.
+    The name can be qualified, e.g. Kernel.run for a method.
     """
-    file_path = Path(file_path)
-    py_file = file_path.read_text()
-
-    function_node = [
-        n
-        for n in ast.parse(file_path.read_text()).body
-        if isinstance(n, ast.FunctionDef) and n.name == function_name
-    ]
-    if not function_node:
+    function = project_index().function(file_path, function_name)
+    if function is None:
         return 0,0
-    function_node = function_node[0]
-    start_line, end_line = function_node.lineno, function_node.end_lineno
-    return start_line, end_line
+    return function.start_line, function.end_line
 
 
 def get_source_code_of_function(file_path: Union[str, Path], function_name: str) -> str:
     """
     Get the source code of a function from a file.
-    Note: only works for functions defined at the top level of the file.
+    The name can be qualified, e.g. Kernel.run for a method.
     """
-    start_line, end_line = get_lines_of_function(file_path, function_name)
-    py_file = file_path.read_text()
-    function_code = "\n".join(py_file.split("\n")[start_line - 1 : end_line])
-    return function_code
+    function = project_index().function(file_path, function_name)
+    return function.source if function is not None else ""
 
 
 def get_imports(file_path: Union[str, Path]) -> List[str]:
     """
     Get the imports from a file.
-    Note: only works for functions defined at the top level of the file.
-    """
-    file_path = Path(file_path)
-    py_file = file_path.read_text()
-    imports = [
-        n
-        for n in ast.parse(py_file).body
-        if isinstance(n, (ast.Import, ast.ImportFrom))
-    ]
-    imports_list = []
-    for i in imports:
-        start_line, end_line = i.lineno, i.end_lineno
-        imports_list.append("\n".join(py_file.split("\n")[start_line - 1 : end_line]))
-    return imports_list
+    Note: only the imports at the top level of the file.
+    """
+    return list(project_index().imports(file_path))
+
+
+def get_top_level_functions(file_path: Union[str, Path]) -> List[str]:
+    """
+    Get the names of all functions defined at the top level of a file.
+    """
+    functions = project_index().module(file_path).functions.values()
+    return [function.name for function in functions if function.kind == "function" and "." not in function.qualname]
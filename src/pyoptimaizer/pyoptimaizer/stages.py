@@ -0,0 +1,67 @@
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+# stages of an optimization run, in the order they first start
+STAGES = (
+    "generate_tests",
+    "optimize",
+    "time_original",
+    "compile",
+    "benchmark",
+    "scaling",
+    "threads",
+    "throughput",
+    "refine",
+    "evolve",
+    "autotune",
+)
+
+
+class StageTimings:
+    """Time spent in every stage of an optimization run.
+
+    Stages can run concurrently (compiles next to benchmarks, or all of them in the
+    pipelined mode), so the times of the stages can add up to more than the wall time.
+    """
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    @contextmanager
+    def measure(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def timed(self, stage: str, func: Callable) -> Callable:
+        """Wrap a function, so every call is added to a stage."""
+
+        def wrapper(*args, **kwargs):
+            with self.measure(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    def track(self, stage: str, future: Future) -> Future:
+        """Add the time until a future is done to a stage."""
+        start = time.perf_counter()
+        future.add_done_callback(lambda _: self.add(stage, time.perf_counter() - start))
+        return future
+
+    def summary(self) -> str:
+        return ", ".join(
+            f"{stage} {self.seconds[stage]:.2f}s ({self.counts[stage]}x)"
+            for stage in sorted(self.seconds, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES))
+        )
@@ -0,0 +1,212 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+from loguru import logger
+from pydantic import BaseModel
+
+from pyoptimaizer.assistants import (
+    AssistantCodeOptimizationResult,
+    AssistantCodeOptimizationResults,
+    AssistantCodeTestCreateResult,
+)
+
+# gets the request body, returns the content of every choice
+Responder = Callable[[dict], List[str]]
+
+
+class KernelScript(BaseModel):
+    """Canned LLM answers for a single function."""
+
+    function_name: str
+    tests: AssistantCodeTestCreateResult
+    # candidates of the initial optimization, handed out round robin over the choices
+    candidates: List[AssistantCodeOptimizationResult]
+    # candidates of a refinement, defaults to the initial candidates
+    refined_candidates: List[AssistantCodeOptimizationResult] = []
+
+
+def _last_query(request: dict) -> dict:
+    try:
+        return json.loads(request["messages"][-1]["content"])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return {}
+
+
+def scripted_responder(scripts: List[KernelScript]) -> Responder:
+    """Answer the requests of the assistants from kernel scripts.
+
+    The kind of request is derived from the query the assistants send: test creation
+    sends the function as `python_function`, an initial optimization as `python_code`
+    and a refinement its `runtime_ms`. The function is looked up by name in the query,
+    or for a refinement, in the earlier messages of the conversation. A refinement
+    without a known function gets no candidates.
+    """
+    by_name: Dict[str, KernelScript] = {script.function_name: script for script in scripts}
+
+    def find_script(text: str) -> Optional[KernelScript]:
+        for name, script in by_name.items():
+            if f"def {name}(" in text:
+                return script
+        return None
+
+    def respond(request: dict) -> List[str]:
+        query = _last_query(request)
+        n = request.get("n") or 1
+        if "python_function" in query:
+            script = find_script(query["python_function"])
+            if script is None:
+                raise KeyError("No script for the requested function")
+            return [script.tests.model_dump_json()] * n
+
+        if "python_code" in query:
+            script = find_script(query["python_code"])
+            if script is None:
+                raise KeyError("No script for the requested function")
+            candidates = script.candidates
+        else:
+            script = find_script(json.dumps(request["messages"]))
+            if script is None:
+                # a refinement without the earlier conversation, e.g. of the original function
+                return [AssistantCodeOptimizationResults(optimized_functions=[]).model_dump_json()] * n
+            candidates = script.refined_candidates or script.candidates
+        # spread the candidates over the choices, starting at the seed so separate requests differ
+        offset = request.get("seed") or 0
+        return [
+            AssistantCodeOptimizationResults(
+                optimized_functions=[candidates[(offset + i) % len(candidates)]]
+            ).model_dump_json()
+            for i in range(n)
+        ]
+
+    return respond
+
+
+def completion_body(request: dict, contents: List[str]) -> dict:
+    return {
+        "id": f"chatcmpl-standin-{random.getrandbits(32):08x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "standin"),
+        "choices": [
+            {
+                "index": i,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }
+            for i, content in enumerate(contents)
+        ],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+class StandInLLMServer:
+    """OpenAI compatible server on localhost, answering chat completions with a responder.
+
+    Lets the whole pipeline run and be benchmarked offline. Latency and failures can be
+    injected to mimic a real endpoint. Point the assistants at it with
+    `openai_url=server.base_url`, or by setting the OPENAI_BASE_URL environment variable.
+    """
+
+    def __init__(
+        self,
+        responder: Responder,
+        latency_s: float = 0.0,
+        failure_rate: float = 0.0,
+        failure_status: int = 500,
+        seed: int = 0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        """
+        Args:
+            responder (Responder): Gets the request body, returns the content of every choice.
+            latency_s (float): Delay before every response, in seconds.
+            failure_rate (float): Fraction of the requests that fail with `failure_status`.
+            failure_status (int): HTTP status of injected failures.
+            seed (int): Seed of the failure injection.
+            host (str): Interface to listen on.
+            port (int): Port to listen on, defaults to a free port.
+        """
+        self.responder = responder
+        self.latency_s = latency_s
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.requests: List[dict] = []
+        self.failures = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(f"Stand-in LLM: {format % args}")
+
+            def _send_json(self, status: int, body: dict):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                    return
+                server._respond(self, request)
+
+        return Handler
+
+    def _respond(self, handler, request: dict):
+        with self._lock:
+            self.requests.append(request)
+            fail = self._rng.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        if fail:
+            handler._send_json(
+                self.failure_status, {"error": {"message": "Injected failure", "type": "server_error"}}
+            )
+            return
+        try:
+            contents = self.responder(request)
+        except Exception as e:
+            logger.exception("Stand-in LLM could not answer a request")
+            handler._send_json(400, {"error": {"message": repr(e), "type": "invalid_request_error"}})
+            return
+        handler._send_json(200, completion_body(request, contents))
+
+    def start(self) -> "StandInLLMServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
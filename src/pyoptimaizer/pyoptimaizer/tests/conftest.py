@@ -0,0 +1,7 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Keep the build cache, the LLM cache and the results store of every test out of the user's cache."""
+    monkeypatch.setenv("PYOPTIMAIZER_CACHE_DIR", str(tmp_path / "cache"))
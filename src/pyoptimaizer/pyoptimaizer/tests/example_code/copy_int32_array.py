@@ -0,0 +1,6 @@
+import numpy as np
+
+def copy_int32_array(a, b):
+    np.copyto(b, a)
+
+
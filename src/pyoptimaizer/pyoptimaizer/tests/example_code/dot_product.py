@@ -0,0 +1,5 @@
+def dot_product(a, b):
+    result = 0.0
+    for i in range(len(a)):
+        result += a[i] * b[i]
+    return result
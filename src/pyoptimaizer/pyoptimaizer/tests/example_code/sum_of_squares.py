@@ -0,0 +1,5 @@
+def sum_of_squares(values):
+    total = 0
+    for value in values:
+        total += value * value
+    return total
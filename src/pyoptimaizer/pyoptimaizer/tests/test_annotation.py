@@ -0,0 +1,60 @@
+import json
+import subprocess
+
+from pyoptimaizer.annotation import annotation_feedback, read_annotation, worst_lines
+from pyoptimaizer.assistants import CythonCodeOptimizerAssistant
+
+KERNEL = """\
+def total(values):
+    s = 0
+    for v in values:
+        s += v * 2
+    return s
+
+
+cpdef double typed_total(double[:] xs):
+    cdef double s = 0
+    cdef Py_ssize_t i
+    for i in range(xs.shape[0]):
+        s += xs[i]
+    return s
+"""
+
+
+def test_parses_python_interaction_per_line(tmp_path):
+    pyx_path = tmp_path / "kernel.pyx"
+    pyx_path.write_text(KERNEL)
+    assert read_annotation(pyx_path) is None
+    subprocess.run(["cythonize", "-a", str(pyx_path)], check=True, capture_output=True)
+
+    annotation = read_annotation(pyx_path)
+    by_line = {line.line_number: line for line in annotation.lines}
+    assert by_line[3].source == "    for v in values:"
+    assert any("iterates over a Python object" in hint for hint in by_line[3].hints)
+    assert any("boxed arithmetic" in hint for hint in by_line[4].hints)
+    assert any("boundscheck" in hint for hint in by_line[12].hints)
+    assert any("wraparound" in hint for hint in by_line[12].hints)
+    # typed declarations and the typed loop do not touch Python
+    assert 9 not in by_line and 11 not in by_line
+    assert annotation.total_score == sum(line.score for line in annotation.lines)
+
+    worst = worst_lines(annotation, n=2)
+    # signatures are left out, their argument conversion is unavoidable
+    assert [line.line_number for line in worst] == [3, 4]
+    assert annotation_feedback(annotation) is not None
+    assert annotation_feedback(None) is None
+
+
+def test_refine_query_carries_worst_lines(tmp_path):
+    pyx_path = tmp_path / "kernel.pyx"
+    pyx_path.write_text(KERNEL)
+    subprocess.run(["cythonize", "-a", str(pyx_path)], check=True, capture_output=True)
+    annotation = read_annotation(pyx_path)
+
+    coa = CythonCodeOptimizerAssistant(openai_api_key="unused")
+    messages = coa._refine_messages(
+        "", "", 1.0, annotation_feedback(annotation), [], python_interaction=worst_lines(annotation)
+    )
+    query = json.loads(messages[-1]["content"])
+    assert query["python_interaction"][0]["line_number"] == 3
+    assert query["python_interaction"][0]["hints"]
@@ -0,0 +1,91 @@
+import sys
+
+from pyoptimaizer.autotune import build_header, default_grid, replace_with_selected_builds, select_build, write_build_variant
+from pyoptimaizer.benchmark import BenchmarkConfig
+from pyoptimaizer.build_cache import BuildCache
+from pyoptimaizer.optimize import autotune_optimized_function_results, compile_pyx_to_so, make_evaluated_result
+from pyoptimaizer.runner import run_test_file_with_replacement_function
+from pyoptimaizer.tests.test_benchmark import fake_result
+from pyoptimaizer.types import BuildConfig
+
+CONFIG = BenchmarkConfig(repeats=3, min_sample_time_s=0.001, bootstrap_resamples=10)
+
+# reads the last element through a negative index, which needs wraparound
+LAST_PLUS_SUM = """\
+cpdef double last_plus_sum(double[:] xs):
+    cdef double s = xs[-1]
+    cdef Py_ssize_t i
+    for i in range(xs.shape[0]):
+        s += xs[i]
+    return s
+"""
+
+
+def test_default_grid_and_header():
+    grid = default_grid()
+    names = [config.name for config in grid]
+    assert len(names) == len(set(names)) == 5
+    assert "default_checked" not in names
+    header = build_header(BuildConfig(name="x", compiler_flags=["-O3"], directives={"boundscheck": False}))
+    assert header == "# cython: boundscheck=False\n# distutils: extra_compile_args = -O3\n"
+
+
+def test_drops_builds_that_break_the_tests(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / "kernel.py").write_text(
+        "def last_plus_sum(xs):\n    return xs[-1] + sum(xs)\n"
+    )
+    (tmp_path / "test_kernel.py").write_text(
+        "import numpy as np\nfrom kernel import last_plus_sum\n\n"
+        "def test_last_plus_sum():\n"
+        "    assert last_plus_sum(np.arange(10000, dtype=np.float64)) == 9999 + 49995000\n"
+    )
+    pyx_path = tmp_path / ".tmp" / "kernel_candidate.pyx"
+    pyx_path.parent.mkdir()
+    pyx_path.write_text(LAST_PLUS_SUM)
+    build_cache = BuildCache(tmp_path / "builds")
+    compile_pyx_to_so(pyx_path, build_cache=build_cache)
+    baseline = run_test_file_with_replacement_function(
+        tmp_path / "test_kernel.py", tmp_path / "kernel.py", "last_plus_sum", CONFIG
+    )
+    candidate = make_evaluated_result(
+        "last_plus_sum",
+        tmp_path / "test_kernel.py",
+        pyx_path,
+        [],
+        run_test_file_with_replacement_function(tmp_path / "test_kernel.py", pyx_path, "last_plus_sum", CONFIG),
+        baseline,
+    )
+
+    grid = [
+        BuildConfig(name="O3", compiler_flags=["-O3"]),
+        BuildConfig(name="nowrap", directives={"wraparound": False, "boundscheck": False}),
+    ]
+    tuned = autotune_optimized_function_results(
+        f"{tmp_path / 'kernel.py'}::last_plus_sum",
+        tmp_path / "test_kernel.py",
+        [candidate],
+        grid=grid,
+        benchmark_config=CONFIG,
+        baseline=baseline,
+        build_cache=build_cache,
+    )
+    assert [result.build_config.name for result in tuned] == ["O3"]
+    assert tuned[0].optimized_function_path == write_build_variant(pyx_path, grid[0])
+    assert tuned[0].speedup is not None
+    assert select_build(candidate, tuned) in [candidate, tuned[0]]
+    sys.modules.pop("kernel", None)
+
+
+def test_selected_build_replaces_the_candidate():
+    original = fake_result("kernel.py", [1.0])
+    fast = fake_result("kernel_a.pyx", [0.1])
+    close = fake_result("kernel_b.pyx", [0.2])
+    tuned = [
+        fake_result("kernel_a_native.pyx", [0.05]).model_copy(update={"build_config": BuildConfig(name="native")}),
+        fake_result("kernel_b_native.pyx", [0.199]).model_copy(update={"build_config": BuildConfig(name="native")}),
+    ]
+    results = replace_with_selected_builds([original, fast, close], [fast, close], tuned)
+    # the clearly faster variant takes the place of its candidate, the close one is dropped
+    assert results == [original, tuned[0], close]
+
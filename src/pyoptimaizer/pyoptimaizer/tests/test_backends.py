@@ -0,0 +1,90 @@
+import sys
+
+import pytest
+
+import pyoptimaizer.optimize as optimize
+from pyoptimaizer.assistants import AssistantCodeOptimizationResult
+from pyoptimaizer.backends import BACKENDS, available_backends, get_backend
+from pyoptimaizer.benchmark import BenchmarkConfig
+from pyoptimaizer.build_cache import BuildCache
+from pyoptimaizer.exceptions import BuildError
+from pyoptimaizer.runner import run_test_file_with_replacement_function
+
+CONFIG = BenchmarkConfig(repeats=3, min_sample_time_s=0.001, bootstrap_resamples=10)
+
+SLOW_SQUARES = """def sum_squares(xs):
+    return sum(x * x for x in xs)
+"""
+
+NUMPY_SQUARES = """def sum_squares(xs):
+    xs = np.asarray(xs, dtype=np.float64)
+    return float(np.dot(xs, xs))
+"""
+
+CYTHON_SQUARES = """cpdef double sum_squares(double[:] xs):
+    cdef double s = 0
+    cdef Py_ssize_t i
+    for i in range(xs.shape[0]):
+        s += xs[i] * xs[i]
+    return s
+"""
+
+
+def candidate(code, backend):
+    return AssistantCodeOptimizationResult(
+        reasoning="", cython_function=code, import_statements=["import numpy as np"], backend=backend
+    )
+
+
+def write_function(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / "norms.py").write_text(SLOW_SQUARES)
+    (tmp_path / "test_norms.py").write_text(
+        "import numpy as np\nfrom norms import sum_squares\n\n"
+        "def test_sum_squares():\n"
+        "    assert sum_squares(np.arange(1000, dtype=np.float64)) == 332833500\n"
+    )
+
+
+def test_available_backends_are_ordered_by_build_cost(monkeypatch):
+    monkeypatch.setattr(BACKENDS["pythran"], "available", lambda: False)
+    names = [backend.name for backend in available_backends(["cython", "pythran", "numpy"])]
+    assert names == ["numpy", "cython"]
+    with pytest.raises(ValueError):
+        get_backend("fortran")
+
+
+def test_numpy_candidate_is_built_and_benchmarked(tmp_path, monkeypatch):
+    write_function(tmp_path, monkeypatch)
+    numpy_backend = get_backend("numpy")
+    path = numpy_backend.write_candidate(tmp_path / "norms.py", ["import numpy as np"], NUMPY_SQUARES)
+    assert path.suffix == ".py" and "numpy" in path.name
+    numpy_backend.build(path)
+    benchmark = run_test_file_with_replacement_function(tmp_path / "test_norms.py", path, "sum_squares", CONFIG)
+    assert benchmark.runtime_ms > 0
+
+    broken = numpy_backend.write_candidate(tmp_path / "norms.py", [], "def sum_squares(xs)\n    return 0\n")
+    with pytest.raises(BuildError):
+        numpy_backend.build(broken)
+    sys.modules.pop("norms", None)
+
+
+def test_backends_compete_in_one_generation(tmp_path, monkeypatch):
+    write_function(tmp_path, monkeypatch)
+    monkeypatch.setattr(optimize, "render", lambda *args: None)
+    baseline = run_test_file_with_replacement_function(
+        tmp_path / "test_norms.py", tmp_path / "norms.py", "sum_squares", CONFIG
+    )
+
+    results = optimize.evaluate_optimized_function_results(
+        f"{tmp_path / 'norms.py'}::sum_squares",
+        tmp_path / "test_norms.py",
+        [(candidate(CYTHON_SQUARES, "cython"), []), (candidate(NUMPY_SQUARES, "numpy"), [])],
+        build_cache=BuildCache(tmp_path / "builds"),
+        benchmark_config=CONFIG,
+        baseline=baseline,
+    )
+
+    assert sorted(result.backend for result in results) == ["cython", "numpy"]
+    assert all(result.speedup > 1 for result in results)
+    sys.modules.pop("norms", None)
@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+from pyoptimaizer import html_display
+from pyoptimaizer.assistants import AssistantCodeOptimizationResult
+from pyoptimaizer.html_display import BranchElement, IncrementalRenderer
+from pyoptimaizer.optimize import refine_optimized_functions
+from pyoptimaizer.types import EvaluatedOptimizedFunctionResult, Lineage
+
+
+class SlowOptimizer:
+    """Answers every refinement after a delay, with one child per request."""
+
+    def __init__(self, delay_s=0.2, failing=()):
+        self.delay_s = delay_s
+        self.failing = failing
+        self.feedback = []
+
+    async def refine_code_async(self, error, test_that_failed_src, runtime_ms, user_feedback, choices=4, previous_messages=[], python_interaction=[]):
+        self.feedback.append(user_feedback)
+        await asyncio.sleep(self.delay_s)
+        if user_feedback in self.failing:
+            raise RuntimeError("rate limited")
+        child = AssistantCodeOptimizationResult(
+            reasoning="", cython_function=f"# from {user_feedback}", import_statements=[], backend="numpy"
+        )
+        return [(child, [])]
+
+
+def result(path, runtime_ms, lineage=None):
+    return EvaluatedOptimizedFunctionResult(
+        function_name="kernel",
+        test_path="test_kernel.py",
+        optimized_function_path=path,
+        runtime_ms=runtime_ms,
+        user_feedback="Try to optimize this function further",
+        previous_messages=[],
+        error="",
+        test_that_failed_src="",
+        backend="numpy",
+        lineage=lineage,
+    )
+
+
+def test_beams_are_refined_concurrently():
+    optimizer = SlowOptimizer(delay_s=0.2, failing=["c"])
+    initial = result("kernel_a.py", 1.0, Lineage())
+    refined = result("kernel_b.py", 2.0, Lineage(generation=1, operator="refine", parents=["kernel_x.py"], root="kernel_x.py"))
+    failing = result("kernel_c.py", 3.0, Lineage())
+
+    start = time.perf_counter()
+    children = refine_optimized_functions([initial, refined, failing], ["a", "b", "c"], {"numpy": optimizer}, 2)
+    elapsed = time.perf_counter() - start
+
+    # three requests of 0.2s at once, the failing one is skipped
+    assert elapsed < 0.5
+    assert sorted(optimizer.feedback) == ["a", "b", "c"]
+    assert [child.cython_function for child, _ in children] == ["# from a", "# from b"]
+    first, second = (child.lineage for child, _ in children)
+    assert (first.generation, first.operator, first.parents, first.root) == (2, "refine", ["kernel_a.py"], "kernel_a.py")
+    # a branch keeps the initial candidate it started from
+    assert second.root == "kernel_x.py"
+
+
+def test_table_highlights_the_winning_branch(monkeypatch):
+    winner = result("kernel_b.py", 1.0, Lineage(generation=2, operator="refine", parents=["kernel_a.py"], root="kernel_a.py"))
+    root = result("kernel_a.py", 2.0, Lineage())
+    other = result("kernel_c.py", 3.0, Lineage())
+    original = result("kernel.py", 4.0)
+
+    assert BranchElement(winner, "kernel_a.py") == "<b>kernel_a <small>(generation 2)</small></b>"
+    assert BranchElement(other, "kernel_a.py") == "kernel_c <small>(generation 0)</small>"
+    assert BranchElement(original) == ""
+    # the page highlights the rows of the branch the delta names the winner
+    monkeypatch.setattr(html_display, "get_plotlyjs", lambda: "")
+    messages = []
+    IncrementalRenderer(messages.append).update("kernel", [other, original, root, winner], "Done")
+    delta = messages[-1]
+    assert delta["winner"] == "kernel_a.py"
+    assert [row["key"] for row in delta["rows"] if row["branch"] == delta["winner"]] == ["kernel_a.py", "kernel_b.py"]
@@ -0,0 +1,68 @@
+import random
+
+from pyoptimaizer.benchmark import (
+    BenchmarkConfig,
+    benchmark_callable,
+    geometric_mean,
+    rank_results,
+    speedup,
+    summarize,
+)
+from pyoptimaizer.types import EvaluatedOptimizedFunctionResult, TimingDistribution
+
+
+def fake_timing(name, center, noise, n=20, seed=0):
+    rng = random.Random(seed)
+    samples = [center * (1 + rng.uniform(-noise, noise)) for _ in range(n)]
+    samples.sort()
+    return TimingDistribution(
+        test_name=name,
+        loops=1,
+        samples_s=samples,
+        median_s=samples[n // 2],
+        iqr_s=0.0,
+        ci_low_s=samples[0],
+        ci_high_s=samples[-1],
+    )
+
+
+def fake_result(name, centers, noise=0.05, seed=0):
+    benchmark = summarize(
+        {f"test_{i}": fake_timing(f"test_{i}", c, noise, seed=seed + i) for i, c in enumerate(centers)}
+    )
+    return EvaluatedOptimizedFunctionResult(
+        function_name="f",
+        test_path="test_f.py",
+        optimized_function_path=name,
+        runtime_ms=benchmark.runtime_ms,
+        user_feedback="",
+        previous_messages=[],
+        error="",
+        test_that_failed_src="",
+        benchmark=benchmark,
+    )
+
+
+def test_benchmark_callable_collects_distribution():
+    config = BenchmarkConfig(repeats=5, min_sample_time_s=0.001, bootstrap_resamples=100)
+    timing = benchmark_callable("test_sum", lambda: sum(range(100)), config)
+    assert len(timing.samples_s) == 5
+    assert timing.ci_low_s <= timing.median_s <= timing.ci_high_s
+    assert timing.iqr_s >= 0
+
+
+def test_geometric_mean_speedup_weighs_tests_equally():
+    baseline = fake_result("original", [1.0, 0.001], noise=0.01).benchmark
+    candidate = fake_result("candidate", [0.5, 0.0005], noise=0.01, seed=10).benchmark
+    point, (low, high) = speedup(baseline, candidate)
+    assert 1.8 < low <= point <= high < 2.2
+    assert abs(geometric_mean([2.0, 8.0]) - 4.0) < 1e-9
+
+
+def test_rank_results_ignores_insignificant_differences():
+    original = fake_result("original", [1.0, 1.0], noise=0.2)
+    # within the noise of the original, must not overtake it
+    noisy = fake_result("noisy", [0.97, 0.98], noise=0.2, seed=5)
+    fast = fake_result("fast", [0.1, 0.1], seed=7)
+    ranked = rank_results([original, noisy, fast])
+    assert [r.optimized_function_path for r in ranked] == ["fast", "original", "noisy"]
@@ -0,0 +1,48 @@
+from pyoptimaizer.build_cache import BuildCache, extension_suffix
+
+
+def write_fake_build(directory, name, source, size=10):
+    pyx_path = directory / f"{name}.pyx"
+    pyx_path.write_text(source)
+    (directory / f"{name}{extension_suffix()}").write_bytes(b"x" * size)
+    (directory / f"{name}.html").write_text("<html></html>")
+    return pyx_path
+
+
+def test_restore_after_store(tmp_path):
+    cache = BuildCache(tmp_path / "cache")
+    build_dir = tmp_path / "build"
+    build_dir.mkdir()
+    pyx_path = write_fake_build(build_dir, "fib_abc", "cpdef int f(): return 1")
+    assert not cache.restore(pyx_path)
+    cache.store(pyx_path)
+
+    # remove the artifacts, a hit must bring them back
+    for artifact in build_dir.glob("fib_abc.*"):
+        if artifact.suffix != ".pyx":
+            artifact.unlink()
+    assert cache.restore(pyx_path)
+    assert (build_dir / f"fib_abc{extension_suffix()}").exists()
+    assert (build_dir / "fib_abc.html").exists()
+
+    # different flags or source must miss
+    assert not cache.restore(pyx_path, ["-O3"])
+    pyx_path.write_text("cpdef int f(): return 2")
+    assert not cache.restore(pyx_path)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = BuildCache(tmp_path / "cache", max_size_bytes=2500)
+    build_dir = tmp_path / "build"
+    build_dir.mkdir()
+    first = write_fake_build(build_dir, "first", "1", size=1000)
+    cache.store(first)
+    second = write_fake_build(build_dir, "second", "2", size=1000)
+    cache.store(second)
+    third = write_fake_build(build_dir, "third", "3", size=1000)
+    cache.store(third)
+
+    assert not cache.restore(first)
+    assert cache.restore(second)
+    assert cache.restore(third)
+    assert cache.size_bytes() <= 2500
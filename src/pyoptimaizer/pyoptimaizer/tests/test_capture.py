@@ -0,0 +1,56 @@
+import sys
+
+import numpy as np
+
+from pyoptimaizer.benchmark import BenchmarkConfig
+from pyoptimaizer.capture import CORPUS_TEST_NAME, capture, find_corpus, load_corpus, record_calls
+from pyoptimaizer.runner import run_test_file_with_replacement_function
+from pyoptimaizer.worker_pool import BenchmarkWorkerPool
+
+CONFIG = BenchmarkConfig(repeats=3, min_sample_time_s=0.001, bootstrap_resamples=10)
+
+
+def test_records_arrays_as_memory_maps(tmp_path):
+    @record_calls(tmp_path / "kernels.py", sample_rate=1.0, max_samples=2, min_array_bytes=1024)
+    def scale(values, factor=1):
+        return values * factor
+
+    big = np.arange(1000, dtype=np.int64)
+    scale(big, factor=2)
+    scale([1, 2, 3])
+    scale([4])
+
+    corpus_dir = find_corpus(tmp_path / "kernels.py", "scale")
+    assert corpus_dir is not None
+    calls = load_corpus(corpus_dir)
+    assert len(calls) == 2
+    (array,), kwargs = calls[0]
+    assert isinstance(array, np.memmap) and (array == big).all() and kwargs == {"factor": 2}
+    assert calls[1] == (([1, 2, 3],), {})
+    # replaying must not modify the corpus, even when the function writes into its arguments
+    array[0] = -1
+    assert load_corpus(corpus_dir)[0][0][0][0] == 0
+
+
+def test_replays_corpus_next_to_the_tests(tmp_path, monkeypatch):
+    (tmp_path / "square.py").write_text("def square(x):\n    return x * x\n")
+    (tmp_path / "test_square.py").write_text(
+        "from square import square\n\ndef test_square():\n    assert square(3) == 9\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    import square
+
+    with capture(square, "square", sample_rate=1.0) as recorder:
+        for x in range(5):
+            square.square(x)
+    assert recorder.samples == 5
+    corpus_dir = find_corpus(tmp_path / "square.py", "square")
+
+    result = run_test_file_with_replacement_function(
+        tmp_path / "test_square.py", tmp_path / "square.py", "square", CONFIG, corpus_dir
+    )
+    assert set(result.tests) == {"test_square", CORPUS_TEST_NAME}
+
+    with BenchmarkWorkerPool(tmp_path / "test_square.py", "square", timeout=30, corpus_dir=corpus_dir) as pool:
+        assert set(pool.benchmark(tmp_path / "square.py", CONFIG).tests) == {"test_square", CORPUS_TEST_NAME}
+    sys.modules.pop("square")
@@ -0,0 +1,199 @@
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+from pyoptimaizer import daemon, html_display
+
+
+def fake_optimize(function_path, test_functions=(), options=None):
+    """Reports progress like a real optimization, for as many seconds as the first test function says."""
+    steps = int(float(test_functions[0]) / 0.05)
+    for step in range(steps + 1):
+        html_display.render("kernel", [], f"Step {step} of {steps}")
+        time.sleep(0.05)
+    return {"function_path": function_path}
+
+
+class Client:
+    def __init__(self, port, token):
+        self.socket = socket.create_connection(("127.0.0.1", port), timeout=20)
+        self.file = self.socket.makefile("rb")
+        self.ids = 0
+        self.notifications = []
+        self.authenticated = self.call("authenticate", token=token)
+
+    def call(self, method, **params):
+        self.ids += 1
+        request = {"jsonrpc": "2.0", "id": self.ids, "method": method, "params": params}
+        self.socket.sendall((json.dumps(request) + "\n").encode())
+        while True:
+            message = json.loads(self.file.readline())
+            if message.get("id") == self.ids:
+                return message
+            self.notifications.append(message)
+
+    def wait_finished(self, job_id):
+        while True:
+            for message in self.notifications:
+                if message["method"] == "finished" and message["params"]["job_id"] == job_id:
+                    return message["params"]["update"]
+            self.notifications.append(json.loads(self.file.readline()))
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+def connect(server, token=None):
+    return Client(server.server_address[1], token or server.token)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    # the real plotly.js is megabytes
+    monkeypatch.setattr(html_display, "get_plotlyjs", lambda: "/* plotly.js */")
+    monkeypatch.setitem(daemon.JOBS, "optimize", fake_optimize)
+    monkeypatch.setattr(daemon, "CANCEL_GRACE_S", 1)
+    server = daemon.DaemonServer(("127.0.0.1", 0), max_jobs=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.jobs.cancel_all()
+    server.server_close()
+
+
+def test_optimize_streams_progress_and_result(server):
+    client = connect(server)
+    response = client.call("optimize", function_path="kernel.py::kernel", test_functions=["0.2"])
+    job_id = response["result"]["job_id"]
+
+    finished = client.wait_finished(job_id)
+    assert finished["state"] == "done"
+    assert finished["result"] == {"function_path": "kernel.py::kernel"}
+    updates = [m["params"]["update"] for m in client.notifications if m["method"] == "progress"]
+    assert updates[0]["type"] == "shell" and "/* plotly.js */" in updates[0]["html"]
+    assert all(update["type"] == "delta" for update in updates[1:])
+
+    status = client.call("status", job_id=job_id)["result"]
+    assert status["state"] == "done" and status["status"].startswith("Step")
+    client.close()
+
+
+def test_concurrent_jobs_and_cancel(server):
+    client = connect(server)
+    slow = client.call("optimize", function_path="slow.py::kernel", test_functions=["30"])["result"]["job_id"]
+    fast = client.call("optimize", function_path="fast.py::kernel", test_functions=["0.1"])["result"]["job_id"]
+
+    # the fast job finishes while the slow one still runs
+    assert client.wait_finished(fast)["state"] == "done"
+    assert client.call("status", job_id=slow)["result"]["state"] == "running"
+
+    start = time.perf_counter()
+    assert client.call("cancel", job_id=slow)["result"] == {"cancelled": True}
+    assert client.wait_finished(slow)["state"] == "cancelled"
+    assert time.perf_counter() - start < 10
+    assert client.call("cancel", job_id=slow)["result"] == {"cancelled": False}
+    assert {job["state"] for job in client.call("status")["result"]} == {"done", "cancelled"}
+    client.close()
+
+
+def test_late_subscriber_gets_the_current_page(server):
+    client = connect(server)
+    job_id = client.call("optimize", function_path="kernel.py::kernel", test_functions=["0.1"])["result"]["job_id"]
+    client.wait_finished(job_id)
+
+    other = connect(server)
+    assert other.call("subscribe", job_id=job_id)["result"] == {"subscribed": job_id}
+    finished = other.wait_finished(job_id)
+    assert finished["state"] == "done"
+    assert [m["params"]["update"]["type"] for m in other.notifications][:2] == ["shell", "delta"]
+    client.close()
+    other.close()
+
+
+def test_errors(server):
+    client = connect(server)
+    assert client.call("frobnicate")["error"]["code"] == daemon.METHOD_NOT_FOUND
+    assert client.call("optimize", path="kernel.py")["error"]["code"] == daemon.INVALID_PARAMS
+    response = client.call("optimize", function_path="kernel.py::kernel", options={"unknown": 1})
+    assert response["error"]["code"] == daemon.INVALID_PARAMS and "unknown" in response["error"]["message"]
+    assert client.call("status", job_id="42")["error"]["code"] == daemon.INVALID_PARAMS
+    assert server.jobs.jobs == {}
+    client.close()
+
+
+def test_accept_copies_the_candidate(server, tmp_path):
+    candidate = tmp_path / "kernel_cython_1.pyx"
+    candidate.write_text("def kernel(): pass\n")
+    client = connect(server)
+    response = client.call("accept", candidate_path=str(candidate), original_path=str(tmp_path / "kernel.py"))
+    assert response["result"] == {"path": str(tmp_path / "kernel_optimized.pyx")}
+    assert (tmp_path / "kernel_optimized.pyx").read_text() == candidate.read_text()
+    client.close()
+
+
+def test_connections_must_authenticate(server):
+    client = connect(server, token="guessed")
+    assert client.authenticated["error"]["code"] == daemon.UNAUTHORIZED
+    # the connection is closed
+    assert client.file.readline() == b""
+    client.close()
+
+    unauthenticated = socket.create_connection(("127.0.0.1", server.server_address[1]), timeout=20)
+    unauthenticated.sendall((json.dumps({"jsonrpc": "2.0", "id": 1, "method": "status"}) + "\n").encode())
+    file = unauthenticated.makefile("rb")
+    assert json.loads(file.readline())["error"]["code"] == daemon.UNAUTHORIZED
+    assert file.readline() == b""
+    unauthenticated.close()
+
+
+def test_connection_is_closed_on_a_line_that_is_not_json_rpc(server):
+    # e.g. a form that a web page posts to the port, with a JSON-RPC request in its body
+    browser = socket.create_connection(("127.0.0.1", server.server_address[1]), timeout=20)
+    request = json.dumps({"jsonrpc": "2.0", "id": 1, "method": "shutdown"})
+    browser.sendall(f"POST / HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n{request}\n".encode())
+    file = browser.makefile("rb")
+    assert json.loads(file.readline())["error"]["code"] == daemon.PARSE_ERROR
+    assert file.readline() == b""
+    browser.close()
+
+    client = connect(server)
+    client.socket.sendall(b"[1, 2]\n")
+    assert json.loads(client.file.readline())["error"]["code"] == daemon.INVALID_REQUEST
+    assert client.file.readline() == b""
+    client.close()
+
+
+def test_port_file_is_private(tmp_path):
+    port_file = tmp_path / "storage" / "daemon.json"
+    daemon.write_private_file(port_file, json.dumps({"token": "secret"}))
+    assert json.loads(port_file.read_text()) == {"token": "secret"}
+    if os.name == "posix":
+        assert port_file.stat().st_mode & 0o777 == 0o600
+    assert list(port_file.parent.iterdir()) == [port_file]
+
+
+def test_serve_without_numpy(tmp_path, monkeypatch):
+    # numpy is optional, an import of it fails like on an install without it
+    monkeypatch.setitem(sys.modules, "numpy", None)
+    port_file = tmp_path / "storage" / "daemon.json"
+    thread = threading.Thread(target=daemon.serve, args=(port_file,), daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 60
+    while not port_file.exists():
+        assert thread.is_alive() and time.monotonic() < deadline
+        time.sleep(0.05)
+
+    address = json.loads(port_file.read_text())
+    client = Client(address["port"], address["token"])
+    assert client.authenticated["result"] == {"authenticated": True}
+    assert client.call("shutdown")["result"] == {"shutting_down": True}
+    client.close()
+    thread.join(timeout=20)
+    assert not thread.is_alive() and not port_file.exists()
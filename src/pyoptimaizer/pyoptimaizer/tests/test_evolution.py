@@ -0,0 +1,124 @@
+import asyncio
+import random
+import re
+
+from pyoptimaizer.assistants import AssistantCodeOptimizationResult
+from pyoptimaizer.evolution import EvolutionConfig, code_similarity, evolve, select_population, tournament
+from pyoptimaizer.types import EvaluatedOptimizedFunctionResult, Lineage
+
+
+def code(runtime_ms, body):
+    return f"# runtime {runtime_ms}\ndef kernel(xs):\n    {body}\n"
+
+
+def candidate(text):
+    return AssistantCodeOptimizationResult(reasoning="", cython_function=text, import_statements=[], backend="numpy")
+
+
+class FakeOptimizer:
+    """Crossovers are as fast as the fastest parent minus one, mutations as the parent minus a half."""
+
+    def __init__(self):
+        self.calls = []
+        self.tokens_used = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def request(self):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+
+    async def crossover_code_async(self, code_, parent_solutions, test_code=[], choices=1, import_statements=[]):
+        await self.request()
+        self.calls.append("crossover")
+        self.tokens_used += 100
+        runtime = min(float(re.search(r"runtime (\S+)", parent).group(1)) for parent in parent_solutions)
+        return [(candidate(code(runtime - 1, f"return {len(self.calls)}")), [])]
+
+    async def refine_code_async(self, error, test_that_failed_src, runtime_ms, user_feedback, choices=4, previous_messages=[], python_interaction=[]):
+        await self.request()
+        self.calls.append("mutation")
+        self.tokens_used += 100
+        return [(candidate(code(runtime_ms - 0.5, f"return {len(self.calls)}")), [])]
+
+
+def evaluator(tmp_path):
+    def evaluate(children):
+        evaluated = []
+        for child, messages in children:
+            path = tmp_path / f"child_{len(list(tmp_path.iterdir()))}.py"
+            path.write_text(child.cython_function)
+            runtime = float(re.search(r"runtime (\S+)", child.cython_function).group(1))
+            evaluated.append(result(path, runtime, child.lineage))
+        return evaluated
+
+    return evaluate
+
+
+def result(path, runtime_ms, lineage=None):
+    return EvaluatedOptimizedFunctionResult(
+        function_name="kernel",
+        test_path="test_kernel.py",
+        optimized_function_path=path,
+        runtime_ms=runtime_ms,
+        user_feedback="Try to optimize this function further",
+        previous_messages=[],
+        error="",
+        test_that_failed_src="",
+        backend="numpy",
+        lineage=lineage,
+    )
+
+
+def initial_population(tmp_path):
+    results = []
+    for idx, (runtime, body) in enumerate([(10, "return sum(xs)"), (12, "return xs.sum()"), (14, "return 0 + sum(xs)")]):
+        path = tmp_path / f"initial_{idx}.py"
+        path.write_text(code(runtime, body))
+        results.append(result(path, runtime, Lineage()))
+    original = result(tmp_path / "kernel.py", 20)
+    original.lineage = None
+    return results + [original]
+
+
+def test_population_keeps_different_candidates(tmp_path):
+    results = initial_population(tmp_path)
+    # a near copy of the best one
+    copy_path = tmp_path / "copy.py"
+    copy_path.write_text(code(10, "return sum(xs) "))
+    results.append(result(copy_path, 11, Lineage()))
+
+    population = select_population(results, size=10, max_similarity=0.95)
+    assert [r.runtime_ms for r in population] == [10, 12, 14]
+    assert code_similarity("abc", "abc") == 1.0
+    # the best of the contestants always wins
+    assert tournament(population, 3, random.Random(0)) is population[0]
+
+
+def test_evolve_until_the_token_budget_is_spent(tmp_path):
+    optimizer = FakeOptimizer()
+    generations = []
+    offspring = evolve(
+        initial_population(tmp_path),
+        {"numpy": optimizer},
+        "def kernel(xs):\n    return sum(xs)\n",
+        [],
+        [],
+        evaluator(tmp_path),
+        EvolutionConfig(offspring=2, max_generations=10, token_budget=600, crossover_rate=0.5),
+        on_generation=lambda generation, children: generations.append(generation),
+    )
+
+    # 2 requests of 100 tokens per generation
+    assert generations == [1, 2, 3]
+    # the requests of a generation are made concurrently
+    assert optimizer.max_in_flight == 2
+    assert len(offspring) == 6
+    assert {"crossover", "mutation"} <= set(optimizer.calls)
+    crossover = next(r for r in offspring if r.lineage.operator == "crossover")
+    assert len(crossover.lineage.parents) == 2
+    assert all(r.lineage.generation in (1, 2, 3) for r in offspring)
+    # improvements compound over the generations
+    assert min(r.runtime_ms for r in offspring) < 10 - 1.5
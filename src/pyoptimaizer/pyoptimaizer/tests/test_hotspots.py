@@ -0,0 +1,59 @@
+from pyoptimaizer.benchmark import BenchmarkConfig
+from pyoptimaizer.hotspots import amdahl_speedup, optimize_hotspots, profile_hotspots
+from pyoptimaizer.runner import run_test_file_with_replacement_function
+from pyoptimaizer.types import EvaluatedOptimizedFunctionResult
+
+
+def write_project(tmp_path):
+    (tmp_path / "work.py").write_text(
+        "def count(n):\n    total = 0\n    for i in range(n):\n        total += i\n    return total\n\n"
+        "def slow():\n    return count(5000000)\n\n"
+        "def quick():\n    return count(50000)\n\n"
+        "def main():\n    slow()\n    quick()\n"
+    )
+    (tmp_path / "run.py").write_text("from work import main\n\nmain()\n")
+    (tmp_path / "work_fast.py").write_text("def count(n):\n    return n * (n - 1) // 2\n")
+    (tmp_path / "test_work.py").write_text("from work import count\n\ndef test_count():\n    assert count(10) == 45\n")
+
+
+def test_ranks_top_level_functions(tmp_path):
+    write_project(tmp_path)
+    hotspots, _ = profile_hotspots(["run.py"], tmp_path, top_n=3)
+    assert [h.function_name for h in hotspots] == ["main", "count", "slow"]
+    assert 0.5 < hotspots[2].fraction <= hotspots[0].fraction <= 1
+
+    hotspots, _ = profile_hotspots(["run.py"], tmp_path, top_n=1, sort_by="self")
+    assert [h.function_name for h in hotspots] == ["count"]
+
+
+def test_swaps_in_optimized_hotspots(tmp_path, monkeypatch):
+    write_project(tmp_path)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    config = BenchmarkConfig(repeats=3, min_sample_time_s=0.001, bootstrap_resamples=10)
+
+    def optimize(function_path):
+        file_path, function_name = function_path.split("::")
+        benchmark = run_test_file_with_replacement_function(
+            tmp_path / "test_work.py", tmp_path / "work_fast.py", function_name, config
+        )
+        return [
+            EvaluatedOptimizedFunctionResult(
+                function_name=function_name,
+                test_path=tmp_path / "test_work.py",
+                optimized_function_path=tmp_path / "work_fast.py",
+                runtime_ms=benchmark.runtime_ms,
+                user_feedback="",
+                previous_messages=[],
+                error="",
+                test_that_failed_src="",
+                benchmark=benchmark,
+                speedup=100.0,
+            )
+        ]
+
+    report = optimize_hotspots(["run.py"], tmp_path, top_n=1, sort_by="self", repeats=1, optimize=optimize)
+    outcome = report.outcomes[0]
+    assert outcome.hotspot.function_name == "count"
+    assert outcome.predicted_speedup == amdahl_speedup(outcome.hotspot.fraction, 100.0)
+    # the loop is gone from the run once the replacement is swapped in
+    assert report.end_to_end_speedup > 1.3
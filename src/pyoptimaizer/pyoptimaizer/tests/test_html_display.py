@@ -0,0 +1,95 @@
+from pyoptimaizer import html_display
+from pyoptimaizer.html_display import IncrementalRenderer
+from pyoptimaizer.types import (
+    EvaluatedOptimizedFunctionResult,
+    Lineage,
+    ScalingPoint,
+    ScalingCurve,
+)
+
+
+def result(name, runtime_ms, lineage=Lineage()):
+    return EvaluatedOptimizedFunctionResult(
+        function_name="kernel",
+        test_path="test_kernel.py",
+        optimized_function_path=f"{name}.pyx",
+        runtime_ms=runtime_ms,
+        user_feedback="Try to optimize this function further",
+        previous_messages=[],
+        error="",
+        test_that_failed_src="",
+        lineage=lineage,
+    )
+
+
+class FakeClock:
+    """A clock that only moves when told to, with timers that fire when it passes their deadline."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.timers = []
+
+    def __call__(self):
+        return self.now
+
+    def timer(self, delay_s, function):
+        clock = self
+
+        class Timer:
+            def start(self):
+                clock.timers.append((clock.now + delay_s, function))
+
+        return Timer()
+
+    def advance(self, seconds):
+        self.now += seconds
+        due = [timer for timer in self.timers if timer[0] <= self.now]
+        self.timers = [timer for timer in self.timers if timer[0] > self.now]
+        for _, function in due:
+            function()
+
+
+def test_shell_once_then_coalesced_deltas(monkeypatch):
+    # the real plotly.js is megabytes
+    monkeypatch.setattr(html_display, "get_plotlyjs", lambda: "/* plotly.js */")
+    messages = []
+    clock = FakeClock()
+    clock.now = 100.0
+    renderer = IncrementalRenderer(messages.append, min_interval_s=0.25, clock=clock, timer=clock.timer)
+    original = result("kernel", 10.0, lineage=None)
+    first = result("kernel_a", 2.0)
+    results = [original, first]
+
+    renderer.update("kernel", results, "Evaluating...")
+    shell, delta = messages
+    assert shell["type"] == "shell" and "/* plotly.js */" in shell["html"]
+    assert delta["status"] and delta["winner"] == "kernel_a.pyx"
+    assert [row["key"] for row in delta["rows"]] == ["kernel.pyx", "kernel_a.pyx"]
+
+    # three updates within the interval become one delta with the latest status and only the changed rows
+    results.append(result("kernel_b", 1.0, Lineage(generation=1, operator="refine", parents=["kernel_a.pyx"], root="kernel_a.pyx")))
+    renderer.update("kernel", results, "Refining...")
+    results[-1].runtime_ms = 0.5
+    renderer.update("kernel", results, "Refining...")
+    results[-1].scaling = ScalingCurve(
+        points=[ScalingPoint(size=10, median_s=0.001), ScalingPoint(size=100, median_s=0.01)], exponent=1.0, coefficient=0.0001
+    )
+    renderer.update("kernel", results, "Done refining")
+    assert len(messages) == 2
+    clock.advance(0.125)
+    assert len(messages) == 2
+    clock.advance(0.125)
+    assert len(messages) == 3
+    delta = messages[2]
+    assert "Done refining" in delta["status"]
+    assert [(row["key"], row["runtime"]) for row in delta["rows"]] == [("kernel_b.pyx", 0.5)]
+    assert len(delta["traces"]["scaling"]) == 1
+    # the winner stays on the same branch
+    assert "winner" not in delta
+    assert "html" not in delta
+
+    # nothing changed, nothing is sent
+    renderer.update("kernel", results, "Done refining")
+    clock.advance(0.3)
+    assert len(messages) == 3
+    assert clock.timers == []
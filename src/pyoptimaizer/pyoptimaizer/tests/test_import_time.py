@@ -0,0 +1,90 @@
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict
+
+import pytest
+
+import pyoptimaizer.tests
+from pyoptimaizer.standin_llm import StandInLLMServer
+
+example_code_dir_path = Path(pyoptimaizer.tests.__file__).parent / "example_code"
+package_root = Path(pyoptimaizer.tests.__file__).parents[2]
+
+ENTRY_POINTS = ["pyoptimaizer.__main__", "pyoptimaizer.optimize", "pyoptimaizer.pipeline", "pyoptimaizer.daemon"]
+# loaded on the code paths that need them, never by importing an entry point
+HEAVY_DEPENDENCIES = ["openai", "plotly", "websockets", "Cython", "numpy"]
+# cold start budgets, a few times what they take on a laptop so only real regressions fail
+IMPORT_BUDGET_S = 1.0
+FIRST_REQUEST_BUDGET_S = 5.0
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def import_times(module: str) -> Dict[str, float]:
+    """Cumulative import time in seconds of every module that `import module` loads, from python -X importtime."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=package_root,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in completed.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            times[match.group(4)] = int(match.group(2)) / 1e6
+    return times
+
+
+@pytest.mark.parametrize("module", ENTRY_POINTS)
+def test_entry_point_imports_lazily(module):
+    times = import_times(module)
+    loaded = sorted({name.split(".")[0] for name in times} & set(HEAVY_DEPENDENCIES))
+    assert loaded == [], f"importing {module} loads {loaded}"
+    assert times[module] < IMPORT_BUDGET_S
+
+
+def test_time_to_first_llm_request(benchmark, tmp_path):
+    """Wall clock time from starting the CLI until its first LLM request arrives."""
+    shutil.copy(example_code_dir_path / "fibonacci.py", tmp_path / "fibonacci.py")
+    with StandInLLMServer(lambda request: []) as server:
+        env = dict(
+            os.environ,
+            OPENAI_BASE_URL=server.base_url,
+            OPENAI_API_KEY="standin",
+            PYOPTIMAIZER_LLM_CACHE="off",
+            PYOPTIMAIZER_CACHE_DIR=str(tmp_path / "cache"),
+        )
+
+        def first_request():
+            server.requests.clear()
+            start = time.perf_counter()
+            process = subprocess.Popen(
+                [
+                    sys.executable, "-m", "pyoptimaizer", f"{tmp_path / 'fibonacci.py'}::fibonacci",
+                    "--report_jsonl", str(tmp_path / "updates.jsonl"),
+                ],
+                cwd=package_root,
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            try:
+                while not server.requests:
+                    assert process.poll() is None, "the CLI exited before sending a request"
+                    time.sleep(0.005)
+                return time.perf_counter() - start
+            finally:
+                process.kill()
+                process.wait()
+
+        seconds = benchmark.pedantic(first_request, rounds=3, iterations=1)
+    for module in ENTRY_POINTS:
+        benchmark.extra_info[f"import_{module}_s"] = import_times(module)[module]
+    assert seconds < FIRST_REQUEST_BUDGET_S
@@ -0,0 +1,99 @@
+import pytest
+from openai.types.chat import ChatCompletion
+
+from pyoptimaizer.assistants import PythonTestCreatorAssistant
+from pyoptimaizer.exceptions import CacheMissError
+from pyoptimaizer.llm_cache import CacheMode, LLMResponseCache, request_key
+
+
+def fake_completion(content):
+    return ChatCompletion.model_validate(
+        {
+            "id": "fake",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "gpt-4o",
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }
+            ],
+        }
+    )
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.requests = []
+
+    def create(self, **request):
+        self.requests.append(request)
+        return fake_completion('{"import_statements": [], "new_tests": ["def test_a(): pass"]}')
+
+
+class FakeClient:
+    def __init__(self):
+        self.chat = self
+        self.completions = FakeCompletions()
+
+
+def create_tests(assistant, source):
+    return assistant.create_tests([], source, 1, [])
+
+
+def test_second_request_is_answered_from_the_cache(tmp_path):
+    client = FakeClient()
+    assistant = PythonTestCreatorAssistant(response_cache=LLMResponseCache(tmp_path, mode=CacheMode.READ_WRITE))
+    assistant._openai_api = client
+
+    first = create_tests(assistant, "def f(): pass")
+    second = create_tests(assistant, "def f(): pass")
+    assert first == second
+    assert len(client.completions.requests) == 1
+
+    create_tests(assistant, "def g(): pass")
+    assert len(client.completions.requests) == 2
+
+
+def test_replay_never_hits_the_network(tmp_path):
+    client = FakeClient()
+    recorder = PythonTestCreatorAssistant(response_cache=LLMResponseCache(tmp_path, mode=CacheMode.RECORD))
+    recorder._openai_api = client
+    recorded = create_tests(recorder, "def f(): pass")
+
+    # no client is set up, the replaying assistant would fail on any request
+    replayer = PythonTestCreatorAssistant(response_cache=LLMResponseCache(tmp_path, mode=CacheMode.REPLAY))
+    assert create_tests(replayer, "def f(): pass") == recorded
+    with pytest.raises(CacheMissError):
+        create_tests(replayer, "def g(): pass")
+    assert len(client.completions.requests) == 1
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = LLMResponseCache(tmp_path, max_size_bytes=1500, mode=CacheMode.READ_WRITE)
+    keys = [request_key("gpt-4o", [{"role": "user", "content": str(i)}], 1) for i in range(3)]
+    content = '"%s"' % ("x" * 300)
+    cache.store(keys[0], fake_completion(content))
+    cache.store(keys[1], fake_completion(content))
+    assert cache.lookup(keys[0]) is not None
+    cache.store(keys[2], fake_completion(content))
+
+    assert cache.lookup(keys[1]) is None
+    assert cache.lookup(keys[0]) is not None
+    assert cache.size_bytes() <= 1500
+
+
+def test_off_by_default_and_invalid_responses_are_not_stored(tmp_path, monkeypatch):
+    monkeypatch.delenv("PYOPTIMAIZER_LLM_CACHE", raising=False)
+    key = request_key("gpt-4o", [{"role": "user", "content": "f"}], 1)
+    LLMResponseCache(tmp_path).store(key, fake_completion("{}"))
+    assert not list(tmp_path.iterdir())
+
+    cache = LLMResponseCache(tmp_path, mode=CacheMode.READ_WRITE)
+    # a retry after a truncated completion has to ask the LLM again
+    cache.store(key, fake_completion('{"new_tests": ['))
+    assert cache.lookup(key) is None
+    cache.store(key, fake_completion("{}"))
+    assert cache.lookup(key) is not None
@@ -0,0 +1,78 @@
+import sys
+
+import pytest
+
+from pyoptimaizer.benchmark import BenchmarkConfig
+from pyoptimaizer.memory import allocation_counter, combine_memory, count_allocations, measure_memory
+from pyoptimaizer.runner import run_test_file_with_replacement_function
+
+MB = 1024 * 1024
+
+
+def test_measures_peak_of_a_single_call():
+    cache = []
+
+    def allocate():
+        data = bytearray(8 * MB)
+        cache.append(object())
+        return len(data)
+
+    usage = measure_memory(allocate)
+    assert 8 * MB <= usage.traced_peak_bytes < 9 * MB
+    assert usage.rss_peak_bytes is None or usage.rss_peak_bytes >= 7 * MB
+    assert usage.retained_blocks >= 1
+    assert usage.allocations is None or usage.allocations >= 2
+    # a later, smaller call is not charged for the peak of the earlier one
+    assert measure_memory(lambda: bytearray(MB)).peak_bytes < 4 * MB
+
+
+def test_counts_allocations_that_are_freed_again():
+    if allocation_counter() is None:
+        pytest.skip("no C compiler to build the allocation counter")
+
+    def temporaries(copies):
+        def call():
+            total = 0
+            for i in range(1000):
+                for _ in range(copies):
+                    total += sum([i, i, i])
+            return total
+
+        return call
+
+    one, three = count_allocations(temporaries(1)), count_allocations(temporaries(3))
+    # every temporary list is freed again, only the count sees them
+    assert one >= 1000
+    # at least one allocation for each of the 2000 extra lists
+    assert three - one >= 2000
+    usage = measure_memory(temporaries(3))
+    assert usage.allocations >= 3000 and usage.retained_blocks < 100
+    assert combine_memory([usage, measure_memory(temporaries(1))]).allocations == usage.allocations
+
+
+def test_benchmarks_record_memory_per_test(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / "squares.py").write_text("def squares(n):\n    return [i * i for i in range(n)]\n")
+    (tmp_path / "squares_lean.py").write_text("def squares(n):\n    return sum(i * i for i in range(n))\n")
+    (tmp_path / "test_squares.py").write_text(
+        "from squares import squares\n\ndef test_squares():\n    squares(100000)\n"
+    )
+    config = BenchmarkConfig(repeats=3, min_sample_time_s=0.001, bootstrap_resamples=10)
+
+    eager = run_test_file_with_replacement_function(
+        tmp_path / "test_squares.py", tmp_path / "squares.py", "squares", config
+    )
+    lean = run_test_file_with_replacement_function(
+        tmp_path / "test_squares.py", tmp_path / "squares_lean.py", "squares", config
+    )
+    assert set(eager.memory) == {"test_squares"}
+    assert combine_memory(eager.memory.values()).traced_peak_bytes > 10 * lean.memory["test_squares"].traced_peak_bytes
+
+    untraced = run_test_file_with_replacement_function(
+        tmp_path / "test_squares.py",
+        tmp_path / "squares.py",
+        "squares",
+        config.model_copy(update={"measure_memory": False}),
+    )
+    assert untraced.memory == {}
+    sys.modules.pop("squares")
@@ -0,0 +1,88 @@
+import pyoptimaizer.benchmark as benchmark
+from pyoptimaizer.objectives import (
+    ObjectiveConfig,
+    dominates,
+    objective_feedback,
+    pareto_fronts,
+    rank_by_objectives,
+    select_parents,
+)
+from pyoptimaizer.types import EvaluatedOptimizedFunctionResult, Lineage, MemoryUsage
+
+MB = 1024 * 1024
+
+
+def result(name, runtime_ms, peak_bytes, lineage=Lineage()):
+    return EvaluatedOptimizedFunctionResult(
+        function_name="kernel",
+        test_path="test_kernel.py",
+        optimized_function_path=f"{name}.pyx",
+        runtime_ms=runtime_ms,
+        user_feedback="Try to optimize this function further",
+        previous_messages=[],
+        error="",
+        test_that_failed_src="",
+        memory=MemoryUsage(traced_peak_bytes=peak_bytes),
+        lineage=lineage,
+    )
+
+
+ORIGINAL = result("original", 10.0, 1 * MB, lineage=None)
+FAST_HUNGRY = result("fast_hungry", 2.0, 6 * MB)
+BALANCED = result("balanced", 4.0, 2 * MB)
+LEAN = result("lean", 8.0, MB // 2)
+DOMINATED = result("dominated", 9.0, 3 * MB)
+RESULTS = [ORIGINAL, FAST_HUNGRY, BALANCED, LEAN, DOMINATED]
+
+
+def test_pareto_fronts():
+    fronts = pareto_fronts(RESULTS, ObjectiveConfig(mode="pareto"))
+    assert fronts[0] == [FAST_HUNGRY, BALANCED, LEAN]
+    assert fronts[1] == [ORIGINAL, DOMINATED]
+    # within a front the fastest comes first
+    assert rank_by_objectives(RESULTS, ObjectiveConfig(mode="pareto"))[:3] == [FAST_HUNGRY, BALANCED, LEAN]
+
+
+def test_memory_within_tolerance_is_a_tie():
+    slightly_more = result("slightly_more", 2.0, MB + 1024)
+    assert pareto_fronts([ORIGINAL, slightly_more], ObjectiveConfig(mode="pareto")) == [[slightly_more], [ORIGINAL]]
+
+
+def test_weighted_score():
+    assert rank_by_objectives(RESULTS, ObjectiveConfig(mode="runtime"))[0] is FAST_HUNGRY
+    # 16x less memory is worth being 4x slower with equal weights
+    assert rank_by_objectives(RESULTS, ObjectiveConfig(mode="weighted"))[0] is LEAN
+    assert rank_by_objectives(RESULTS, ObjectiveConfig(mode="weighted", runtime_weight=3))[0] is FAST_HUNGRY
+
+
+def test_selects_parents_across_the_front():
+    assert select_parents(RESULTS, ObjectiveConfig(mode="pareto", max_parents=2)) == [FAST_HUNGRY, LEAN]
+    assert select_parents(RESULTS, ObjectiveConfig(mode="pareto", max_parents=5)) == [FAST_HUNGRY, BALANCED, LEAN]
+    assert select_parents(RESULTS) == [FAST_HUNGRY]
+    assert "KiB" in objective_feedback(LEAN, ObjectiveConfig(mode="pareto"))
+    assert objective_feedback(LEAN) == LEAN.user_feedback
+    counted = LEAN.model_copy(update={"memory": MemoryUsage(traced_peak_bytes=MB, allocations=1200)})
+    assert "1024 KiB at its peak in 1200 allocations" in objective_feedback(counted, ObjectiveConfig(mode="pareto"))
+
+
+def test_original_is_never_a_parent():
+    # the leanest end of the front, but there is no code of the LLM to refine
+    lean_original = result("original", 10.0, MB // 4, lineage=None)
+    results = [lean_original, FAST_HUNGRY, BALANCED, LEAN]
+    assert lean_original in pareto_fronts(results, ObjectiveConfig(mode="pareto"))[0]
+    assert select_parents(results, ObjectiveConfig(mode="pareto", max_parents=2)) == [FAST_HUNGRY, LEAN]
+    assert lean_original not in select_parents(results, ObjectiveConfig(mode="pareto", max_parents=5))
+    assert select_parents([lean_original], ObjectiveConfig(mode="pareto")) == []
+
+
+def test_fronts_compare_runtime_intervals_without_bootstrapping(monkeypatch):
+    monkeypatch.setattr(benchmark, "speedup", None)
+    # the speedup intervals against the original overlap, so neither is clearly faster
+    close = result("close", 4.4, MB).model_copy(update={"speedup": 2.27, "speedup_ci": (2.0, 2.3)})
+    faster = result("faster", 4.0, MB).model_copy(update={"speedup": 2.5, "speedup_ci": (2.2, 2.8)})
+    config = ObjectiveConfig(mode="pareto")
+    assert pareto_fronts([close, faster], config) == [[close, faster]]
+
+    clearly_faster = faster.model_copy(update={"speedup_ci": (2.4, 2.6)})
+    assert dominates(clearly_faster, close, config)
+    assert pareto_fronts([close, clearly_faster], config) == [[clearly_faster], [close]]
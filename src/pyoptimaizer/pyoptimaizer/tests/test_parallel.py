@@ -0,0 +1,99 @@
+import os
+import sys
+
+from pyoptimaizer.backends import get_backend
+from pyoptimaizer.benchmark import BenchmarkConfig
+from pyoptimaizer.build_cache import BuildCache
+from pyoptimaizer.parallel import (
+    ParallelConfig,
+    measure_thread_scaling,
+    rank_by_threads,
+    thread_counts,
+    thread_feedback,
+)
+from pyoptimaizer.runner import import_module_from_file
+from pyoptimaizer.scheduler import available_cores, run_in_process
+from pyoptimaizer.types import EvaluatedOptimizedFunctionResult, ThreadScaling, ThreadScalingPoint
+
+PARALLEL_SUM = """\
+cpdef double sum_squares(double[:] xs):
+    cdef double s = 0
+    cdef Py_ssize_t i
+    for i in prange(xs.shape[0], nogil=True):
+        s += xs[i] * xs[i]
+    return s
+
+def max_threads():
+    return openmp.omp_get_max_threads()
+"""
+
+
+def result(name, runtime_ms, scaling=None):
+    return EvaluatedOptimizedFunctionResult(
+        function_name="sum_squares",
+        test_path="test_norms.py",
+        optimized_function_path=f"{name}.pyx",
+        runtime_ms=runtime_ms,
+        user_feedback="Try to optimize this function further",
+        previous_messages=[],
+        error="",
+        test_that_failed_src="",
+        thread_scaling=scaling,
+    )
+
+
+def test_thread_counts():
+    assert thread_counts(1) == [1]
+    assert thread_counts(8) == [1, 2, 4, 8]
+    assert thread_counts(6) == [1, 2, 4, 6]
+
+
+def test_rank_by_single_or_many_threads():
+    serial = result("serial", 2.0)
+    parallel = result(
+        "parallel",
+        3.0,
+        ThreadScaling(
+            points=[
+                ThreadScalingPoint(threads=1, runtime_ms=3.0, speedup=1.0, efficiency=1.0),
+                ThreadScalingPoint(threads=4, runtime_ms=1.0, speedup=3.0, efficiency=0.75),
+            ]
+        ),
+    )
+    assert rank_by_threads([serial, parallel], "many") == [parallel, serial]
+    assert rank_by_threads([serial, parallel], "single") == [serial, parallel]
+    assert "efficiency of 75%" in thread_feedback(parallel, parallel.user_feedback)
+    assert thread_feedback(serial, "Faster") == "Faster"
+
+
+def omp_max_threads(threads, import_path):
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    return import_module_from_file(import_path).max_threads()
+
+
+def test_openmp_candidate_scales_over_threads(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / "norms.py").write_text("def sum_squares(xs):\n    return sum(x * x for x in xs)\n")
+    (tmp_path / "test_norms.py").write_text(
+        "import numpy as np\nfrom norms import sum_squares\n\n"
+        "def test_sum_squares():\n"
+        "    assert sum_squares(np.arange(1000, dtype=np.float64)) == 332833500\n"
+    )
+    backend = get_backend("cython_parallel")
+    pyx_path = backend.write_candidate(
+        tmp_path / "norms.py", ["from cython.parallel cimport prange", "cimport openmp"], PARALLEL_SUM
+    )
+    backend.build(pyx_path, build_cache=BuildCache(tmp_path / "builds"))
+    import_path = backend.import_path(pyx_path)
+    # OMP_NUM_THREADS is honored, even with fewer cores than threads
+    core = available_cores()[0]
+    assert run_in_process(omp_max_threads, (3, import_path), [core], 30) == 3
+
+    config = ParallelConfig(
+        benchmark=BenchmarkConfig(repeats=3, min_sample_time_s=0.001, bootstrap_resamples=10, measure_memory=False)
+    )
+    scaling = measure_thread_scaling(tmp_path / "test_norms.py", import_path, "sum_squares", config, cores=[core, core])
+    assert [point.threads for point in scaling.points] == [1, 2]
+    assert scaling.points[0].speedup == 1.0
+    assert scaling.points[1].efficiency == scaling.points[1].speedup / 2
+    sys.modules.pop("norms", None)
@@ -0,0 +1,103 @@
+import asyncio
+
+import pyoptimaizer.pipeline as pipeline
+from pyoptimaizer.assistants import AssistantCodeOptimizationResult, AssistantCodeTestCreateResult
+from pyoptimaizer.build_cache import BuildCache
+from pyoptimaizer.results_store import ResultsStore
+
+SLOW_SUM = """def total(n):
+    result = 0
+    for i in range(n):
+        result += i
+    return result
+"""
+
+
+def candidate(body):
+    return AssistantCodeOptimizationResult(reasoning="", cython_function=body, import_statements=[])
+
+
+class FakeTestCreator:
+    requests = 0
+
+    async def create_tests_async(self, import_statements, python_function, number_of_tests, existing_tests):
+        FakeTestCreator.requests += 1
+        await asyncio.sleep(0.2)
+        return [
+            AssistantCodeTestCreateResult(
+                import_statements=[],
+                new_tests=["def test_total():\n    assert total(20000) == 199990000\n"],
+            )
+        ]
+
+
+class FakeOptimizer:
+    def __init__(self, run=0):
+        self.calls = []
+        # every run writes other candidates
+        self.run = run
+
+    async def optimize_code_initial_async(self, code, test_code=[], choices=1, import_statements=[], seed=None):
+        self.calls.append("initial")
+        idx = len(self.calls) + 10 * self.run
+        await asyncio.sleep(0.05 * idx)
+        return [(candidate(f"def total(long n):\n    return n * (n - 1) // 2 + {idx} - {idx}\n"), [])]
+
+    async def refine_code_async(self, *args, choices=4, previous_messages=[], python_interaction=[]):
+        self.calls.append("refine")
+        return [(candidate(SLOW_SUM), [])]
+
+
+def test_pipeline_refines_new_best_while_tests_are_generated(tmp_path, monkeypatch):
+    (tmp_path / "summing.py").write_text(SLOW_SUM)
+    optimizer = FakeOptimizer()
+    monkeypatch.setattr(pipeline, "CodeOptimizerAssistant", lambda backend="cython": optimizer)
+    monkeypatch.setattr(pipeline, "PythonTestCreatorAssistant", FakeTestCreator)
+    monkeypatch.setattr(pipeline, "render", lambda *args: None)
+
+    results = asyncio.run(
+        pipeline.cythonize_function_async(
+            f"{tmp_path / 'summing.py'}::total",
+            refine_depth=1,
+            choices=2,
+            build_cache=BuildCache(tmp_path / "cache"),
+        )
+    )
+
+    # the initial requests do not wait for the tests, the refinement starts after a confirmed best
+    assert optimizer.calls == ["initial", "initial", "refine"]
+    assert len(results) == 4
+    assert results[0].speedup > 1
+    assert sum(r.user_feedback == "Original function" for r in results) == 1
+
+
+def test_pipeline_stores_results_and_starts_from_them(tmp_path, monkeypatch):
+    (tmp_path / "summing.py").write_text(SLOW_SUM)
+    monkeypatch.setattr(pipeline, "PythonTestCreatorAssistant", FakeTestCreator)
+    monkeypatch.setattr(pipeline, "render", lambda *args: None)
+    monkeypatch.setattr(FakeTestCreator, "requests", 0)
+    store = ResultsStore(tmp_path / "results.sqlite3")
+
+    def run(optimizer):
+        monkeypatch.setattr(pipeline, "CodeOptimizerAssistant", lambda backend="cython": optimizer)
+        return asyncio.run(
+            pipeline.cythonize_function_async(
+                f"{tmp_path / 'summing.py'}::total",
+                refine_depth=0,
+                choices=1,
+                build_cache=BuildCache(tmp_path / "cache"),
+                results_store=store,
+            )
+        )
+
+    first = run(FakeOptimizer())
+    assert FakeTestCreator.requests == 1
+    assert store.load_tests(SLOW_SUM) is not None
+    stored = [r for r in first if r.lineage is not None]
+
+    second = run(FakeOptimizer(run=1))
+    # the tests of the first run are reused and its candidate is evaluated again
+    assert FakeTestCreator.requests == 1
+    seeds = [r for r in second if r.lineage is not None and r.lineage.operator == "warm_start"]
+    assert [r.optimized_function_path for r in seeds] == [r.optimized_function_path for r in stored]
+    assert len(second) == 3
@@ -0,0 +1,237 @@
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+import pytest
+
+import pyoptimaizer.optimize as optimize
+import pyoptimaizer.pipeline as pipeline
+import pyoptimaizer.tests
+from pyoptimaizer.assistants import AssistantCodeOptimizationResult, AssistantCodeTestCreateResult
+from pyoptimaizer.stages import StageTimings
+from pyoptimaizer.standin_llm import KernelScript, StandInLLMServer, scripted_responder
+
+example_code_dir_path = Path(pyoptimaizer.tests.__file__).parent / "example_code"
+
+# latency of every stand-in LLM response, in the order of a fast real endpoint
+LLM_LATENCY_S = 0.5
+# numpy already copies at memory speed, the candidate only has to be correct
+NO_SPEEDUP_EXPECTED = {"copy_int32_array"}
+
+# the timed end-to-end runs take minutes and their speedups depend on the load of the machine
+requires_benchmarks = pytest.mark.skipif(
+    os.environ.get("PYOPTIMAIZER_BENCHMARKS") != "1",
+    reason="timing benchmark, set PYOPTIMAIZER_BENCHMARKS=1 to run it",
+)
+
+
+def cython(code, imports=[]):
+    return AssistantCodeOptimizationResult(reasoning="", cython_function=code, import_statements=imports)
+
+
+def generated_tests(*sources, imports=[]):
+    return AssistantCodeTestCreateResult(import_statements=imports, new_tests=list(sources))
+
+
+SCRIPTS = [
+    KernelScript(
+        function_name="fibonacci",
+        tests=generated_tests(
+            "def test_fibonacci_small():\n    assert [fibonacci(i) for i in range(8)] == [0, 1, 1, 2, 3, 5, 8, 13]\n",
+            "def test_fibonacci_large():\n    assert fibonacci(20) == 6765\n",
+        ),
+        candidates=[
+            cython(
+                "cpdef long fibonacci(int n):\n"
+                "    if n < 2:\n"
+                "        return n\n"
+                "    return fibonacci(n - 1) + fibonacci(n - 2)\n"
+            ),
+        ],
+        refined_candidates=[
+            cython(
+                "cpdef long fibonacci(int n):\n"
+                "    cdef long a = 0, b = 1\n"
+                "    cdef int i\n"
+                "    for i in range(n):\n"
+                "        a, b = b, a + b\n"
+                "    return a\n"
+            ),
+        ],
+    ),
+    KernelScript(
+        function_name="SieveOfEratosthenes",
+        tests=generated_tests(
+            "def test_sieve_small():\n    assert SieveOfEratosthenes(30) == [2, 3, 5, 7, 11, 13, 17, 19, 23, 29]\n",
+            "def test_sieve_count():\n    assert len(SieveOfEratosthenes(20000)) == 2262\n",
+        ),
+        candidates=[
+            cython(
+                "def SieveOfEratosthenes(int num):\n"
+                "    cdef char* prime = <char*>malloc(num + 1)\n"
+                "    cdef int p, i\n"
+                "    cdef list primes = []\n"
+                "    for i in range(num + 1):\n"
+                "        prime[i] = 1\n"
+                "    p = 2\n"
+                "    while p * p <= num:\n"
+                "        if prime[p]:\n"
+                "            for i in range(p * p, num + 1, p):\n"
+                "                prime[i] = 0\n"
+                "        p += 1\n"
+                "    for p in range(2, num + 1):\n"
+                "        if prime[p]:\n"
+                "            primes.append(p)\n"
+                "    free(prime)\n"
+                "    return primes\n",
+                ["from libc.stdlib cimport malloc, free"],
+            ),
+        ],
+    ),
+    KernelScript(
+        function_name="copy_int32_array",
+        tests=generated_tests(
+            "def test_copy():\n"
+            "    a = np.arange(200000, dtype=np.int32)\n"
+            "    b = np.zeros_like(a)\n"
+            "    copy_int32_array(a, b)\n"
+            "    assert (a == b).all()\n",
+            imports=["import numpy as np"],
+        ),
+        candidates=[
+            cython(
+                "def copy_int32_array(int[:] a, int[:] b):\n"
+                "    cdef Py_ssize_t i\n"
+                "    for i in range(a.shape[0]):\n"
+                "        b[i] = a[i]\n"
+            ),
+        ],
+    ),
+    KernelScript(
+        function_name="sum_of_squares",
+        tests=generated_tests(
+            "def test_sum_of_squares():\n    assert sum_of_squares(list(range(10000))) == 333283335000\n",
+        ),
+        candidates=[
+            cython(
+                "def sum_of_squares(values):\n"
+                "    cdef long long total = 0\n"
+                "    cdef long long value\n"
+                "    for value in values:\n"
+                "        total += value * value\n"
+                "    return total\n"
+            ),
+        ],
+    ),
+    KernelScript(
+        function_name="dot_product",
+        tests=generated_tests(
+            "def test_dot_product():\n"
+            "    a = [float(i) for i in range(10000)]\n"
+            "    assert dot_product(a, a) == 333283335000.0\n",
+        ),
+        candidates=[
+            cython(
+                "def dot_product(list a, list b):\n"
+                "    cdef double result = 0.0\n"
+                "    cdef Py_ssize_t i\n"
+                "    for i in range(len(a)):\n"
+                "        result += <double>a[i] * <double>b[i]\n"
+                "    return result\n"
+            ),
+        ],
+    ),
+]
+
+
+def run_offline(server, tmp_path, monkeypatch):
+    """Run the pipeline offline against the stand-in, with cold caches and without the UI."""
+    monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+    monkeypatch.setenv("OPENAI_API_KEY", "standin")
+    monkeypatch.setenv("PYOPTIMAIZER_LLM_CACHE", "off")
+    monkeypatch.setenv("PYOPTIMAIZER_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(optimize, "render", lambda *args: None)
+    monkeypatch.setattr(pipeline, "render", lambda *args: None)
+
+
+@pytest.fixture
+def standin_llm(tmp_path, monkeypatch):
+    with StandInLLMServer(scripted_responder(SCRIPTS), latency_s=LLM_LATENCY_S) as server:
+        run_offline(server, tmp_path, monkeypatch)
+        yield server
+
+
+def candidate_names(results):
+    return sorted(Path(r.optimized_function_path).name for r in results if r.user_feedback != "Original function")
+
+
+def test_pipelined_run_overlaps_and_matches_sequential(tmp_path, monkeypatch):
+    script = next(script for script in SCRIPTS if script.function_name == "sum_of_squares")
+    name = script.function_name
+    responder = scripted_responder([script])
+    optimize_requested = threading.Event()
+    tests_waited_for_optimize = []
+
+    def respond(request):
+        query = json.loads(request["messages"][-1]["content"])
+        if "python_function" in query:
+            # hold the tests back until the optimization is requested, or give up after a while
+            tests_waited_for_optimize.append(optimize_requested.wait(timeout=10))
+        elif "python_code" in query:
+            optimize_requested.set()
+        return responder(request)
+
+    with StandInLLMServer(respond) as server:
+        run_offline(server, tmp_path, monkeypatch)
+        runs = {}
+        for mode in ("sequential", "pipelined"):
+            directory = tmp_path / mode
+            directory.mkdir()
+            shutil.copy(example_code_dir_path / f"{name}.py", directory / f"{name}.py")
+            function_path = f"{directory / name}.py::{name}"
+            if mode == "sequential":
+                # the sequential run asks for the tests first, it must not be held back
+                optimize_requested.set()
+                runs[mode] = optimize.cythonize_function(function_path, refine_depth=0, autotune_top=0, warm_start=0)
+            else:
+                optimize_requested.clear()
+                tests_waited_for_optimize.clear()
+                runs[mode] = pipeline.cythonize_function_pipelined(function_path, refine_depth=0, warm_start=0)
+
+    # the pipelined run requested the optimization while the tests were still being generated
+    assert tests_waited_for_optimize == [True]
+    # both runs evaluated the same candidates next to the original
+    assert candidate_names(runs["sequential"]) == candidate_names(runs["pipelined"]) != []
+    for results in runs.values():
+        assert sum(r.user_feedback == "Original function" for r in results) == 1
+        assert all(r.benchmark is not None for r in results)
+
+
+@requires_benchmarks
+@pytest.mark.parametrize("pipelined", [False, True], ids=["sequential", "pipelined"])
+@pytest.mark.parametrize("script", SCRIPTS, ids=lambda script: script.function_name)
+def test_pipeline_end_to_end(benchmark, standin_llm, script, pipelined, tmp_path):
+    name = script.function_name
+    shutil.copy(example_code_dir_path / f"{name}.py", tmp_path / f"{name}.py")
+    stage_timings = StageTimings()
+    run = pipeline.cythonize_function_pipelined if pipelined else optimize.cythonize_function
+
+    results = benchmark.pedantic(
+        run,
+        args=(f"{tmp_path / name}.py::{name}",),
+        # the pipeline does not autotune, keep the sequential run comparable
+        kwargs=dict(refine_depth=1, stage_timings=stage_timings, **({} if pipelined else {"autotune_top": 0})),
+        rounds=1,
+        iterations=1,
+    )
+
+    best_speedup = max(result.speedup for result in results if result.speedup is not None)
+    benchmark.extra_info["speedup"] = best_speedup
+    benchmark.extra_info["llm_requests"] = len(standin_llm.requests)
+    for stage, seconds in stage_timings.seconds.items():
+        benchmark.extra_info[f"{stage}_s"] = seconds
+    assert len(results) > 1
+    if name not in NO_SPEEDUP_EXPECTED:
+        assert best_speedup > 1
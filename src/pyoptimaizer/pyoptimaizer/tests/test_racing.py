@@ -0,0 +1,36 @@
+from pyoptimaizer.benchmark import BenchmarkConfig
+from pyoptimaizer.racing import RaceConfig, SuccessiveHalvingRace
+from pyoptimaizer.tests.test_benchmark import fake_result
+
+
+def test_race_drops_clearly_slower_candidates_early():
+    config = BenchmarkConfig(repeats=10, bootstrap_resamples=200)
+    centers = {"fast": 0.1, "close": 0.105, "slow": 1.0}
+    race = SuccessiveHalvingRace(RaceConfig(), config)
+    rounds = {key: [] for key in centers}
+    decisions = {}
+
+    racing = list(centers)
+    for round_idx in range(race.race_config.rounds):
+        for key in racing:
+            rounds[key].append(race.round_config(round_idx).repeats)
+            result = fake_result(key, [centers[key]] * 2, seed=10 * round_idx).benchmark
+            decisions[key] = race.record(key, result, round_idx)
+        racing = [key for key in racing if decisions[key] is None]
+
+    # the close candidate is slower, but not by more than the margin with confidence
+    assert decisions == {"slow": True, "fast": False, "close": False}
+    # the slow candidate never got more repeats, survivors ended with the full budget
+    assert rounds["slow"] == [3]
+    assert rounds["fast"] == rounds["close"] == [3, 5, 10]
+    assert set(race.results) == set(centers)
+
+
+def test_candidates_are_decided_independently():
+    config = BenchmarkConfig(repeats=10, bootstrap_resamples=200)
+    race = SuccessiveHalvingRace(RaceConfig(rounds=2), config)
+
+    assert race.record("fast", fake_result("fast", [0.1] * 2).benchmark, 0) is None
+    # the fast candidate finishes its race before the slow one is benchmarked at all
+    assert race.record("fast", fake_result("fast", [0.1] * 2, seed=1).benchmark, 1) is False
+    assert race.record("slow", fake_result("slow", [1.0] * 2).benchmark, 0) is True
@@ -0,0 +1,87 @@
+import json
+import threading
+
+import pytest
+
+from pyoptimaizer.reporter import BackgroundReporter, JsonlSink, Sink
+
+
+def delta(status, *rows):
+    return {"type": "delta", "status": status, "rows": [{"key": key} for key in rows], "traces": {"scaling": []}}
+
+
+class RecordingSink(Sink):
+    """Fails the first `failures` sends and blocks every send until `gate` is set."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.gate = threading.Event()
+        self.gate.set()
+        self.messages = []
+        self.closes = 0
+
+    def send(self, message):
+        self.gate.wait()
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionRefusedError("nothing listens")
+        self.messages.append(message)
+
+    def close(self):
+        self.closes += 1
+
+
+def test_full_queue_keeps_the_latest_frame_and_all_rows():
+    sink = RecordingSink()
+    sink.gate.clear()
+    reporter = BackgroundReporter(sink, max_queue=2)
+    reporter.report({"type": "shell", "html": "<body></body>"})
+    # the shell is taken from the queue and blocks on the stalled UI, reporting does not
+    for idx in range(10):
+        reporter.report(delta(f"status {idx}", f"row {idx}"))
+    sink.gate.set()
+    assert reporter.flush(timeout=5)
+    reporter.close()
+
+    assert reporter.dropped > 0
+    assert len(sink.messages) < 11
+    assert sink.messages[-1]["status"] == "status 9"
+    assert {row["key"] for message in sink.messages[1:] for row in message["rows"]} == {f"row {idx}" for idx in range(10)}
+
+
+def test_reconnects_and_restores_the_page():
+    sink = RecordingSink()
+    reporter = BackgroundReporter(sink, min_backoff_s=0.01)
+    reporter.report({"type": "shell", "html": "<body></body>"})
+    reporter.report(delta("first", "a"))
+    assert reporter.flush(timeout=5)
+
+    # the UI restarts and is gone for two attempts
+    sink.failures = 2
+    reporter.report(delta("second", "b"))
+    assert reporter.flush(timeout=5)
+    reporter.close()
+
+    assert sink.closes >= 2
+    shell, first, restored_shell, restored_state, second = sink.messages
+    assert restored_shell is shell and restored_state is first
+    assert second["status"] == "second"
+
+
+def test_jsonl_sink_without_a_ui(tmp_path):
+    reporter = BackgroundReporter(JsonlSink(tmp_path / "report.jsonl"))
+    reporter.report({"type": "shell", "function_name": "kernel", "html": "<body></body>"})
+    reporter.report(delta("done", "a"))
+    reporter.close()
+
+    lines = [json.loads(line) for line in (tmp_path / "report.jsonl").read_text().splitlines()]
+    assert lines == [{"type": "shell", "function_name": "kernel"}, delta("done", "a")]
+
+
+def test_sink_without_send_fails_when_created():
+    class NoSend(Sink):
+        def close(self):
+            pass
+
+    with pytest.raises(TypeError):
+        NoSend()
@@ -0,0 +1,103 @@
+from pyoptimaizer.assistants import AssistantCodeTestCreateResult
+from pyoptimaizer.results_store import ResultsStore, function_key
+from pyoptimaizer.types import BuildConfig, EvaluatedOptimizedFunctionResult, Lineage
+
+SOURCE = "def total(xs):\n    s = 0\n    for x in xs:\n        s += x\n    return s\n"
+TESTS = [AssistantCodeTestCreateResult(import_statements=[], new_tests=["def test_total():\n    assert total([1, 2]) == 3\n"])]
+
+
+def result(path, runtime_ms, speedup, lineage=Lineage(), build_config=None, error=""):
+    return EvaluatedOptimizedFunctionResult(
+        function_name="total",
+        test_path="test_totals.py",
+        optimized_function_path=path,
+        runtime_ms=runtime_ms,
+        user_feedback="Try to optimize this function further",
+        previous_messages=[{"role": "assistant", "content": "{}"}],
+        error=error,
+        test_that_failed_src="",
+        speedup=speedup,
+        backend="numpy",
+        lineage=lineage,
+        build_config=build_config,
+    )
+
+
+def stored_run(tmp_path):
+    store = ResultsStore(tmp_path / "results.sqlite3")
+    paths = []
+    for name, code in [("slow", "def total(xs):\n    return sum(xs)\n"), ("fast", "import numpy as np\n\ndef total(xs):\n    return np.sum(xs)\n")]:
+        paths.append(tmp_path / f"{name}.py")
+        paths[-1].write_text(code)
+    store.store_tests(SOURCE, "total", TESTS)
+    store.store_results(
+        SOURCE,
+        TESTS,
+        [
+            result(paths[0], 2.0, 1.5),
+            result(paths[1], 1.0, 3.0, Lineage(generation=1, operator="refine", parents=[str(paths[0])]), BuildConfig(name="O3")),
+            result(tmp_path / "broken.py", 0.1, 30.0, error="AssertionError"),
+            # the original is not stored
+            result(tmp_path / "totals.py", 3.0, 1.0, lineage=None),
+        ],
+    )
+    return store
+
+
+def test_function_key_ignores_formatting():
+    assert function_key(SOURCE) == function_key("def total(xs):  # sum\n    s = 0\n\n    for x in xs:\n        s += x\n    return (s)\n")
+    assert function_key(SOURCE) != function_key(SOURCE.replace("s += x", "s -= x"))
+
+
+def test_unchanged_function_starts_from_the_best_candidates(tmp_path):
+    (tmp_path / "broken.py").write_text("def total(xs):\n    return 0\n")
+    store = stored_run(tmp_path)
+
+    assert store.load_tests(SOURCE) == TESTS
+    # formatting changes keep the tests and the candidates
+    reformatted = SOURCE.replace("s = 0", "s = 0  # running sum")
+    best = store.warm_start(reformatted, "total", TESTS, limit=5)
+    assert [candidate.speedup for candidate in best] == [3.0, 1.5]
+    assert best[0].build_config.name == "O3"
+    assert best[0].lineage.operator == "refine"
+    assert best[0].previous_messages == [{"role": "assistant", "content": "{}"}]
+
+    seed, messages = best[0].as_seed()
+    assert "np.sum" in seed.cython_function and seed.backend == "numpy"
+    assert seed.lineage.operator == "warm_start"
+    # the seed keeps its build, so it is not autotuned again
+    assert seed.build_config.name == "O3"
+    # other tests are another suite
+    other_tests = [AssistantCodeTestCreateResult(import_statements=[], new_tests=["def test_empty():\n    assert total([]) == 0\n"])]
+    assert store.best_candidates(SOURCE, other_tests, limit=5) == []
+
+
+def test_changed_function_reuses_close_matches(tmp_path):
+    (tmp_path / "broken.py").write_text("def total(xs):\n    return 0\n")
+    store = stored_run(tmp_path)
+
+    changed = SOURCE.replace("return s", "return s * 1")
+    assert store.load_tests(changed) is None
+    close = store.warm_start(changed, "total", TESTS, limit=1)
+    assert len(close) == 1 and close[0].speedup == 3.0
+    assert 0.8 < close[0].similarity < 1.0
+    # a rewrite is not a close match
+    assert store.warm_start("def total(xs):\n    return functools.reduce(operator.add, xs, 0)\n", "total", TESTS, limit=1) == []
+
+
+def test_keeps_the_best_candidates_of_the_latest_functions(tmp_path):
+    store = ResultsStore(tmp_path / "results.sqlite3", max_candidates=2, max_functions=1)
+    results = []
+    for idx in range(4):
+        path = tmp_path / f"candidate_{idx}.py"
+        path.write_text(f"def total(xs):\n    return sum(xs) + {idx} - {idx}\n")
+        results.append(result(path, 4.0 - idx, float(idx + 1)))
+    store.store_tests(SOURCE, "total", TESTS)
+    store.store_results(SOURCE, TESTS, results)
+    assert [candidate.speedup for candidate in store.best_candidates(SOURCE, TESTS, limit=5)] == [4.0, 3.0]
+
+    # a new function pushes out the least recently optimized one, with its candidates
+    other = "def other(xs):\n    return max(xs)\n"
+    store.store_tests(other, "other", TESTS)
+    assert store.load_tests(SOURCE) is None
+    assert store.best_candidates(SOURCE, TESTS, limit=5) == []
@@ -0,0 +1,104 @@
+import pytest
+
+import pyoptimaizer.assistants as assistants
+from pyoptimaizer.benchmark import BenchmarkConfig
+from pyoptimaizer.html_display import ScalingTrace
+from pyoptimaizer.scaling import (
+    ScalingConfig,
+    fit_power_law,
+    generate_workload,
+    rank_at_size,
+    sweep_results,
+    sweep_sizes,
+)
+from pyoptimaizer.types import BenchmarkResult, EvaluatedOptimizedFunctionResult, ScalingCurve, ScalingPoint
+
+CONFIG = ScalingConfig(
+    min_size=64,
+    max_size=64 * 4**4,
+    fit_points=3,
+    benchmark=BenchmarkConfig(repeats=3, min_sample_time_s=0.002, bootstrap_resamples=10),
+)
+
+
+def result(path, runtime_ms, scaling=None):
+    return EvaluatedOptimizedFunctionResult(
+        function_name="pairs",
+        test_path="test_pairs.py",
+        optimized_function_path=path,
+        runtime_ms=runtime_ms,
+        user_feedback="",
+        previous_messages=[],
+        error="",
+        test_that_failed_src="",
+        benchmark=BenchmarkResult(geometric_mean_s=runtime_ms / 1000, tests={}),
+        scaling=scaling,
+    )
+
+
+def curve(exponent, coefficient):
+    points = [ScalingPoint(size=n, median_s=coefficient * n**exponent) for n in (10, 100, 1000)]
+    return ScalingCurve(points=points, exponent=exponent, coefficient=coefficient)
+
+
+def test_sweep_sizes_include_target():
+    assert sweep_sizes(ScalingConfig(min_size=10, max_size=1000, growth=10)) == [10, 100, 1000]
+    assert sweep_sizes(ScalingConfig(min_size=10, max_size=1000, growth=10, target_size=500)) == [10, 100, 500, 1000]
+
+
+def test_fits_power_law():
+    points = [ScalingPoint(size=n, median_s=3e-9 * n**2) for n in (100, 1000, 10000)]
+    exponent, coefficient = fit_power_law(points)
+    assert exponent == pytest.approx(2)
+    assert coefficient == pytest.approx(3e-9)
+
+
+def test_ranks_by_predicted_runtime_at_target_size():
+    # quadratic is faster on small inputs, linear overtakes it at n=1000
+    quadratic = result("quadratic.pyx", 1.0, curve(2, 1e-9))
+    linear = result("linear.pyx", 2.0, curve(1, 1e-6))
+    unmeasured = result("unmeasured.pyx", 0.5)
+    assert rank_at_size([quadratic, linear, unmeasured], 10) == [quadratic, linear, unmeasured]
+    assert rank_at_size([quadratic, linear, unmeasured], 100000) == [linear, quadratic, unmeasured]
+    assert linear.scaling.predict_s(100000) == pytest.approx(0.1)
+
+
+def test_sweeps_candidates_in_separate_processes(tmp_path):
+    (tmp_path / "pairs.py").write_text(
+        "def pairs(values):\n    return sum(1 for a in values for b in values if a < b)\n"
+    )
+    (tmp_path / "pairs_fast.py").write_text(
+        "def pairs(values):\n    n = len(set(values))\n    return n * (n - 1) // 2\n"
+    )
+    (tmp_path / "workload_pairs.py").write_text(
+        "def make_arguments(n):\n    return (list(range(n)),), {}\n"
+    )
+    results = [result(tmp_path / "pairs.py", 1.0), result(tmp_path / "pairs_fast.py", 1.0)]
+    sweep_results(results, tmp_path / "workload_pairs.py", CONFIG.model_copy(update={"max_call_s": 0.05}))
+
+    original, fast = results
+    assert original.scaling.exponent > 1.6
+    assert fast.scaling.exponent < 1.4
+    # the quadratic sweep stops early and extrapolates to larger sizes
+    assert len(original.scaling.points) < len(fast.scaling.points)
+    assert rank_at_size(results, 10**6)[0] is fast
+    assert ScalingTrace(fast).name.startswith("pairs_fast (n^")
+
+
+def test_workload_of_a_method(tmp_path, monkeypatch):
+    (tmp_path / "kernels.py").write_text(
+        "import math\n\n\nclass Kernel:\n    def run(self, values):\n        return sum(map(math.sqrt, values))\n"
+    )
+    queries = []
+
+    class FakeWorkloadGenerator:
+        def create_workload(self, import_statements, python_function, choices=1):
+            queries.append((import_statements, python_function))
+            return [assistants.AssistantWorkloadResult(import_statements=[], make_arguments="def make_arguments(n): ...")]
+
+    monkeypatch.setattr(assistants, "WorkloadGeneratorAssistant", FakeWorkloadGenerator)
+    path = generate_workload(f"{tmp_path / 'kernels.py'}::Kernel.run")
+
+    # the method is found through the project index like everywhere else
+    assert queries == [(["import math"], "    def run(self, values):\n        return sum(map(math.sqrt, values))")]
+    assert path.name == "workload_kernels.py" and "def make_arguments(n)" in path.read_text()
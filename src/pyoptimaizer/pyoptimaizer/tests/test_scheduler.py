@@ -0,0 +1,26 @@
+import os
+
+import pytest
+
+from pyoptimaizer.scheduler import BenchmarkCrashedError, BenchmarkScheduler, partition_cores
+
+
+def _crash():
+    os._exit(3)
+
+
+def test_partition_cores_keeps_benchmarks_apart():
+    benchmark_cores, compile_cores = partition_cores([0, 1, 2, 3])
+    assert benchmark_cores == [0, 1]
+    assert compile_cores == [2, 3]
+    # a single core can not be split
+    assert partition_cores([0]) == ([0], [0])
+
+
+def test_scheduler_returns_results_and_reports_crashes():
+    with BenchmarkScheduler(timeout=10) as scheduler:
+        result = scheduler.submit(max, 1, 2)
+        crashed = scheduler.submit(_crash)
+        assert result.result() == 2
+        with pytest.raises(BenchmarkCrashedError):
+            crashed.result()
@@ -0,0 +1,97 @@
+import os
+import textwrap
+
+from pyoptimaizer.source_utils import ProjectIndex
+
+UTIL = """
+def helper(x):
+    return x * 2
+"""
+
+KERNELS = """
+import numpy as np
+from .util import helper
+from . import util
+
+
+def kernel(values):
+    def square(x):
+        return x * x
+
+    total = 0
+    for value in values:
+        total += square(helper(value))
+    return np.sum(util.helper(total))
+
+
+class Kernel:
+    def run(self, values):
+        return self.step(kernel(values))
+
+    def step(self, value):
+        return value + 1
+"""
+
+
+def write(path, source):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(textwrap.dedent(source))
+
+
+def test_functions_methods_and_nested_functions(tmp_path):
+    write(tmp_path / "pkg" / "__init__.py", "")
+    write(tmp_path / "pkg" / "util.py", UTIL)
+    write(tmp_path / "pkg" / "kernels.py", KERNELS)
+    index = ProjectIndex(tmp_path)
+    assert index.index_project() == 3
+
+    kernels = tmp_path / "pkg" / "kernels.py"
+    module = index.module(kernels)
+    assert module.module == "pkg.kernels"
+    assert module.imports == ["import numpy as np", "from .util import helper", "from . import util"]
+    assert set(module.functions) == {"kernel", "kernel.<locals>.square", "Kernel.run", "Kernel.step"}
+    assert index.function(kernels, "Kernel.run").kind == "method"
+    assert index.function(kernels, "kernel.<locals>.square").kind == "nested"
+    assert index.function(kernels, "kernel").source.startswith("def kernel(values):")
+    assert index.function(kernels, "missing") is None
+    assert [function.qualname for function in index.find("helper")] == ["helper"]
+
+
+def test_call_edges(tmp_path):
+    write(tmp_path / "pkg" / "__init__.py", "")
+    write(tmp_path / "pkg" / "util.py", UTIL)
+    write(tmp_path / "pkg" / "kernels.py", KERNELS)
+    index = ProjectIndex(tmp_path)
+    index.index_project()
+    kernels = tmp_path / "pkg" / "kernels.py"
+
+    kernel = index.function(kernels, "kernel")
+    assert "np.sum" in kernel.calls
+    # np.sum is outside the project, both calls of helper resolve to the same function
+    assert [f.qualname for f in index.callees(kernel)] == ["kernel.<locals>.square", "helper"]
+    assert [f.qualname for f in index.callees(index.function(kernels, "Kernel.run"))] == ["Kernel.step", "kernel"]
+    helper = index.function(tmp_path / "pkg" / "util.py", "helper")
+    assert [f.qualname for f in index.callers(helper)] == ["kernel"]
+
+
+def test_files_are_parsed_again_only_when_they_change(tmp_path):
+    path = tmp_path / "kernels.py"
+    write(path, UTIL)
+    index = ProjectIndex(tmp_path)
+    index.function(path, "helper")
+    index.imports(path)
+    index.function(path, "helper")
+    assert index.parses == 1
+
+    # touched without changing the content
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert index.function(path, "helper") is not None
+    assert index.parses == 1
+
+    write(path, UTIL.replace("helper", "double"))
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10**9))
+    assert index.function(path, "helper") is None
+    assert index.function(path, "double") is not None
+    assert index.parses == 2
+    assert index.find("helper") == []
@@ -0,0 +1,31 @@
+import time
+
+import openai
+import pytest
+
+from pyoptimaizer.standin_llm import StandInLLMServer
+
+
+def echo(request):
+    return [request["messages"][-1]["content"]] * request.get("n", 1)
+
+
+def test_serves_chat_completions_with_latency():
+    with StandInLLMServer(echo, latency_s=0.2) as server:
+        client = openai.OpenAI(base_url=server.base_url, api_key="standin")
+        start = time.perf_counter()
+        completion = client.chat.completions.create(
+            model="gpt-4o", messages=[{"role": "user", "content": "hi"}], n=2
+        )
+        assert time.perf_counter() - start >= 0.2
+    assert [choice.message.content for choice in completion.choices] == ["hi", "hi"]
+    assert len(server.requests) == 1
+
+
+def test_injects_failures():
+    with StandInLLMServer(echo, failure_rate=1.0, failure_status=503) as server:
+        client = openai.OpenAI(base_url=server.base_url, api_key="standin", max_retries=1)
+        with pytest.raises(openai.InternalServerError):
+            client.chat.completions.create(model="gpt-4o", messages=[{"role": "user", "content": "hi"}])
+    # the client retried once
+    assert server.failures == 2
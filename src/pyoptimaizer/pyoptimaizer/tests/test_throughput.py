@@ -0,0 +1,68 @@
+import sys
+import time
+
+from pyoptimaizer.benchmark import calls_per_second
+from pyoptimaizer.runner import run_test_file_throughput
+from pyoptimaizer.scheduler import available_cores
+from pyoptimaizer.throughput import ThroughputConfig, rank_by_throughput, sweep_throughput, throughput_feedback
+from pyoptimaizer.types import EvaluatedOptimizedFunctionResult, Throughput, ThroughputPoint
+
+# holds the GIL for the whole call
+BUSY = "def wait():\n    return sum(range(20000))\n"
+# releases the GIL while it waits, like a nogil block
+SLEEPY = "import time\n\ndef wait():\n    time.sleep(0.001)\n"
+
+
+def result(path, throughput=None):
+    return EvaluatedOptimizedFunctionResult(
+        function_name="wait",
+        test_path="test_waits.py",
+        optimized_function_path=path,
+        runtime_ms=1.0,
+        user_feedback="Try to optimize this function further",
+        previous_messages=[],
+        error="",
+        test_that_failed_src="",
+        throughput=throughput,
+    )
+
+
+def test_calls_per_second_scales_when_the_gil_is_released():
+    single = calls_per_second([lambda: time.sleep(0.001)], 1, 0.1)
+    many = calls_per_second([lambda: time.sleep(0.001)], 4, 0.1)
+    assert many > 2.5 * single
+
+
+def test_throughput_against_the_original(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / "waits.py").write_text(BUSY)
+    (tmp_path / "waits_sleepy.py").write_text(SLEEPY)
+    (tmp_path / "test_waits.py").write_text("from waits import wait\n\ndef test_wait():\n    wait()\n")
+
+    points = run_test_file_throughput(tmp_path / "test_waits.py", tmp_path / "waits_sleepy.py", "wait", [4], 0.1)
+    assert [point.threads for point in points] == [1, 4]
+    assert points[1].scaling > 2.5
+
+    original = result(tmp_path / "waits.py")
+    candidate = result(tmp_path / "waits_sleepy.py")
+    core = available_cores()[0]
+    config = ThroughputConfig(threads=[1, 4], duration_s=0.1)
+    sweep_throughput([original, candidate], tmp_path / "test_waits.py", config, original, cores=[core])
+
+    assert original.throughput.vs_original == 1.0
+    # a single core cannot tell whether the GIL is released
+    assert candidate.throughput.releases_gil is None
+    assert rank_by_throughput([original, candidate, result("unmeasured.pyx")])[2].throughput is None
+    sys.modules.pop("waits", None)
+
+
+def test_feedback_asks_to_release_the_gil():
+    holding = Throughput(
+        points=[
+            ThroughputPoint(threads=1, calls_per_s=100.0, scaling=1.0),
+            ThroughputPoint(threads=8, calls_per_s=105.0, scaling=1.05),
+        ],
+        releases_gil=False,
+    )
+    assert "nogil" in throughput_feedback(result("holding.pyx", holding), "Faster")
+    assert throughput_feedback(result("unknown.pyx"), "Faster") == "Faster"
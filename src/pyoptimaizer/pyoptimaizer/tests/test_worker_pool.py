@@ -0,0 +1,47 @@
+import pytest
+
+from pyoptimaizer.benchmark import BenchmarkConfig
+from pyoptimaizer.runner import FaultyTestError
+from pyoptimaizer.scheduler import BenchmarkCrashedError
+from pyoptimaizer.worker_pool import BenchmarkWorkerPool, measure_dispatch_overhead
+
+CONFIG = BenchmarkConfig(repeats=3, min_sample_time_s=0.001, bootstrap_resamples=10)
+
+
+@pytest.fixture
+def project(tmp_path):
+    (tmp_path / "square.py").write_text("def square(x):\n    return x * x\n")
+    (tmp_path / "test_square.py").write_text(
+        "from square import square\n\ndef test_square():\n    assert square(3) == 9\n"
+    )
+    (tmp_path / "square_fast.py").write_text("def square(x):\n    return x ** 2\n")
+    (tmp_path / "square_wrong.py").write_text("def square(x):\n    return x\n")
+    (tmp_path / "square_segfault.py").write_text(
+        "import ctypes\n\ndef square(x):\n    return ctypes.string_at(0)\n"
+    )
+    return tmp_path
+
+
+def test_pool_survives_crashing_candidates(project, monkeypatch):
+    monkeypatch.syspath_prepend(str(project))
+    with BenchmarkWorkerPool(project / "test_square.py", "square", timeout=30) as pool:
+        assert "test_square" in pool.benchmark(project / "square_fast.py", CONFIG).tests
+
+        with pytest.raises(FaultyTestError):
+            pool.benchmark(project / "square_wrong.py", CONFIG)
+
+        with pytest.raises(BenchmarkCrashedError):
+            pool.benchmark(project / "square_segfault.py", CONFIG)
+
+        # the crashed worker is replaced
+        assert "test_square" in pool.submit(project / "square_fast.py", CONFIG).result().tests
+        assert len(pool.overheads) == 2
+
+
+def test_pool_dispatches_faster_than_spawning(project, monkeypatch):
+    monkeypatch.syspath_prepend(str(project))
+    overheads = measure_dispatch_overhead(
+        project / "test_square.py", project / "square_fast.py", "square", candidates=3, config=CONFIG
+    )
+    # a worker has the test module imported already, a spawned process starts from scratch
+    assert 0 <= overheads["pool"] < overheads["spawn"]
@@ -0,0 +1,108 @@
+from pathlib import Path
+from typing import List, Optional, Union
+
+from loguru import logger
+from pydantic import BaseModel
+
+from pyoptimaizer.backends import result_import_path
+from pyoptimaizer.parallel import thread_counts
+from pyoptimaizer.runner import run_test_file_throughput
+from pyoptimaizer.scheduler import available_cores, run_in_process
+from pyoptimaizer.types import EvaluatedOptimizedFunctionResult, Throughput
+
+# ranking keys of cythonize_function
+RANKING_KEYS = ("runtime", "throughput")
+
+
+class ThroughputConfig(BaseModel):
+    # numbers of concurrent callers, defaults to 1, 2, 4, ... up to the number of cores
+    threads: Optional[List[int]] = None
+    # time to keep calling per number of callers
+    duration_s: float = 0.2
+    # a function releases the GIL when its throughput on the most threads is at least this many times
+    # its throughput on one thread
+    gil_release_scaling: float = 1.5
+
+
+def measure_throughput(
+    test_path: Union[str, Path],
+    replacement_function_path: Union[str, Path],
+    function_name: str,
+    config: ThroughputConfig,
+    cores: Optional[List[int]] = None,
+    timeout: float = 60,
+    corpus_dir: Optional[Path] = None,
+) -> Throughput:
+    """Measure the throughput of a function called from several threads, in a process pinned to the cores.
+    Args:
+        test_path (Union[str, Path]): Test file whose tests call the function.
+        replacement_function_path (Union[str, Path]): Path to import the function from.
+        function_name (str): Name of the function under test.
+        config (ThroughputConfig): Throughput settings.
+        cores (List[int], optional): Cores the callers run on. Defaults to all cores of this process.
+        timeout (float): Maximum runtime of the measurement in seconds.
+        corpus_dir (Path, optional): Recorded calls to replay as an extra test.
+    """
+    cores = cores or available_cores()
+    threads = config.threads or thread_counts(len(cores))
+    points = run_in_process(
+        run_test_file_throughput,
+        (test_path, replacement_function_path, function_name, threads, config.duration_s, corpus_dir),
+        cores,
+        timeout,
+    )
+    releases_gil = None
+    # with a single core, threads cannot run at the same time whether the GIL is released or not
+    if len(set(cores)) > 1 and points[-1].threads > 1:
+        releases_gil = points[-1].scaling >= config.gil_release_scaling
+    return Throughput(points=points, releases_gil=releases_gil)
+
+
+def sweep_throughput(
+    results: List[EvaluatedOptimizedFunctionResult],
+    test_path: Union[str, Path],
+    config: ThroughputConfig,
+    original: Optional[EvaluatedOptimizedFunctionResult] = None,
+    cores: Optional[List[int]] = None,
+    timeout: float = 60,
+    corpus_dir: Optional[Path] = None,
+):
+    """Measure the throughput of the results that do not have it yet, in place, and compare it
+    with the throughput of the original. The measurements run one after another, since every
+    one of them needs all cores. Raced out results are skipped."""
+    pending = [r for r in results if r.throughput is None and not r.raced_out and not r.error]
+    for result in pending:
+        path = Path(result.optimized_function_path)
+        try:
+            result.throughput = measure_throughput(
+                test_path, result_import_path(result), result.function_name, config, cores, timeout, corpus_dir
+            )
+        except Exception:
+            logger.exception(f"Error measuring the throughput of {path.name}")
+
+    if original is None or original.throughput is None:
+        return
+    original_calls_per_s = original.throughput.points[-1].calls_per_s
+    for result in results:
+        if result.throughput is not None:
+            result.throughput.vs_original = result.throughput.points[-1].calls_per_s / original_calls_per_s
+
+
+def rank_by_throughput(results: List[EvaluatedOptimizedFunctionResult]) -> List[EvaluatedOptimizedFunctionResult]:
+    """Order results by their calls per second on the most threads, highest first.
+    Results without a throughput go last, in their original order."""
+    measured = [r for r in results if r.throughput is not None]
+    unmeasured = [r for r in results if r.throughput is None]
+    return sorted(measured, key=lambda r: -r.throughput.points[-1].calls_per_s) + unmeasured  # type: ignore
+
+
+def throughput_feedback(result: EvaluatedOptimizedFunctionResult, user_feedback: str) -> str:
+    """Extend the feedback for refining a result with its throughput under concurrent callers."""
+    if result.throughput is None or result.throughput.releases_gil is not False:
+        return user_feedback
+    last = result.throughput.points[-1]
+    return (
+        f"{user_feedback}. It is called from {last.threads} threads at once, but only reaches "
+        f"{last.scaling:.2f}x the calls per second of a single thread because it holds the GIL. "
+        "Release the GIL around the computation with a nogil block"
+    )
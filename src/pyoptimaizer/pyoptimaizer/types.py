@@ -2,7 +2,149 @@ from pydantic import BaseModel
 
 
 from pathlib import Path
-from typing import List, Union
+from typing import Dict, List, Optional, Tuple, Union
+
+
+class TimingDistribution(BaseModel):
+    """Per-call timings of a single test, in seconds."""
+    test_name: str
+    loops: int
+    samples_s: List[float]
+    median_s: float
+    iqr_s: float
+    ci_low_s: float
+    ci_high_s: float
+
+
+class MemoryUsage(BaseModel):
+    """Memory taken by a single call, in bytes above what was allocated before the call."""
+    # peak of the python allocators, seen by tracemalloc
+    traced_peak_bytes: int
+    # peak resident set size, also sees plain malloc from C code; None where it cannot be reset
+    rss_peak_bytes: Optional[int] = None
+    # memory blocks the call left allocated, e.g. caches or leaks, not the blocks it freed again
+    retained_blocks: int = 0
+    # allocations of the python allocators during the call, also of the temporaries it freed again;
+    # None where the allocation counter cannot be built
+    allocations: Optional[int] = None
+
+    @property
+    def peak_bytes(self) -> int:
+        return max(self.traced_peak_bytes, self.rss_peak_bytes or 0)
+
+
+class BenchmarkResult(BaseModel):
+    tests: Dict[str, TimingDistribution]
+    # geometric mean of the per-test medians, so long tests do not drown out short ones
+    geometric_mean_s: float
+    # time spent timing the tests, without process startup and imports
+    duration_s: float = 0.0
+    # memory of a single call of every test, measured apart from the timings
+    memory: Dict[str, MemoryUsage] = {}
+
+    @property
+    def runtime_ms(self) -> float:
+        return self.geometric_mean_s * 1000
+
+
+class ScalingPoint(BaseModel):
+    size: int
+    # median time of a single call at this input size
+    median_s: float
+
+
+class ScalingCurve(BaseModel):
+    """Empirical runtime of a function over input sizes, with a power law fitted to the largest sizes."""
+    points: List[ScalingPoint]
+    # runtime ~ coefficient * size ** exponent
+    exponent: float
+    coefficient: float
+
+    def predict_s(self, size: int) -> float:
+        for point in self.points:
+            if point.size == size:
+                return point.median_s
+        return self.coefficient * size**self.exponent
+
+
+class ThreadScalingPoint(BaseModel):
+    threads: int
+    runtime_ms: float
+    # against the same candidate on a single thread
+    speedup: float
+    # speedup per thread, 1.0 is perfect scaling
+    efficiency: float
+
+
+class ThreadScaling(BaseModel):
+    """Runtime of a parallel candidate over the number of OpenMP threads."""
+    points: List[ThreadScalingPoint]
+
+    @property
+    def best(self) -> ThreadScalingPoint:
+        return min(self.points, key=lambda point: point.runtime_ms)
+
+
+class ThroughputPoint(BaseModel):
+    # number of threads calling the function at once
+    threads: int
+    calls_per_s: float
+    # against the same function called from a single thread
+    scaling: float
+
+
+class Throughput(BaseModel):
+    """Calls per second of a function that is called from several threads at once."""
+    points: List[ThroughputPoint]
+    # whether the throughput scales with the callers, None when it was measured on a single core
+    releases_gil: Optional[bool] = None
+    # calls per second against the original function, at the largest number of threads
+    vs_original: Optional[float] = None
+
+    @property
+    def peak(self) -> ThroughputPoint:
+        return max(self.points, key=lambda point: point.calls_per_s)
+
+
+class Lineage(BaseModel):
+    """Where a candidate comes from in the search."""
+    # 0 for the initial candidates
+    generation: int = 0
+    # how the candidate was made: "initial", "refine", "mutation", "crossover", "autotune"
+    # or "warm_start" for a candidate of an earlier run
+    operator: str = "initial"
+    # paths of the candidates it was made from
+    parents: List[str] = []
+    # instruction of a mutation
+    mutation: Optional[str] = None
+    # initial candidate the branch of this candidate started from, None for the initial candidates
+    root: Optional[str] = None
+
+
+class AnnotatedLine(BaseModel):
+    """A line of a pyx file that still interacts with the Python C-API, from `cythonize -a`."""
+    line_number: int
+    # cython's score of the line, roughly the number of Python C-API calls it compiles to
+    score: int
+    source: str
+    # likely causes, e.g. untyped loops, boxed arithmetic or bounds checks
+    hints: List[str] = []
+
+
+class CythonAnnotation(BaseModel):
+    # only the lines with a score above zero
+    lines: List[AnnotatedLine]
+
+    @property
+    def total_score(self) -> int:
+        return sum(line.score for line in self.lines)
+
+
+class BuildConfig(BaseModel):
+    """C compiler flags and Cython directives of a build, see autotune."""
+    name: str
+    compiler_flags: List[str] = []
+    directives: Dict[str, bool] = {}
 
 
 class EvaluatedOptimizedFunctionResult(BaseModel):
@@ -13,4 +155,26 @@ class EvaluatedOptimizedFunctionResult(BaseModel):
     user_feedback: str
     previous_messages: List
     error: str
-    test_that_failed_src: str
\ No newline at end of file
+    test_that_failed_src: str
+    benchmark: Optional[BenchmarkResult] = None
+    # geometric-mean speedup against the original function, with its confidence interval
+    speedup: Optional[float] = None
+    speedup_ci: Optional[Tuple[float, float]] = None
+    # dropped early by a race, so it was benchmarked with a shorter budget
+    raced_out: bool = False
+    # runtime over a sweep of input sizes
+    scaling: Optional[ScalingCurve] = None
+    # worst case memory usage over the tests
+    memory: Optional[MemoryUsage] = None
+    # remaining Python interaction of the compiled candidate
+    annotation: Optional[CythonAnnotation] = None
+    # flags and directives the candidate was built with, None for the defaults of cythonize
+    build_config: Optional[BuildConfig] = None
+    # backend the candidate was written for, see backends; None for the original function
+    backend: Optional[str] = None
+    # runtime over the number of threads, only for parallel candidates
+    thread_scaling: Optional[ThreadScaling] = None
+    # calls per second with several threads calling the function at once
+    throughput: Optional[Throughput] = None
+    # how the candidate was made, None for the original function
+    lineage: Optional[Lineage] = None
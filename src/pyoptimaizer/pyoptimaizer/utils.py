@@ -1,7 +1,18 @@
 #retry decorator, exceptions to retry on, and retry on failure
 from functools import wraps
 import multiprocessing
+import os
 import time
+from typing import Any
+
+from pydantic import BaseModel
+
+
+def jsonable(message: Any) -> Any:
+    """A chat message as plain json data, the messages of the openai client are pydantic models."""
+    if isinstance(message, BaseModel):
+        return message.model_dump(exclude_none=True)
+    return message
 
 
 def retry(tries, exceptions=Exception, delay=0, backoff=1, logger=None):
@@ -52,13 +63,16 @@ class Process(multiprocessing.Process):
     https://stackoverflow.com/a/33599967/4992248
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, cpu_affinity=None, **kwargs):
         multiprocessing.Process.__init__(self, *args, **kwargs)
+        self._cpu_affinity = cpu_affinity
         self._parent_conn, self._child_conn = multiprocessing.Pipe()
         self._parent_conn_result, self._child_conn_result = multiprocessing.Pipe()
         self._exception = None
 
     def run(self):
+        if self._cpu_affinity and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, set(self._cpu_affinity))
         try:
             result = None
             if self._target:
@@ -0,0 +1,316 @@
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from loguru import logger
+
+from pyoptimaizer.benchmark import BenchmarkConfig
+from pyoptimaizer.capture import load_corpus
+from pyoptimaizer.runner import (
+    FaultyTestError,
+    benchmark_test_module,
+    import_module_from_file,
+    run_test_file_with_replacement_function,
+)
+from pyoptimaizer.scheduler import BenchmarkCrashedError, BenchmarkScheduler, available_cores
+from pyoptimaizer.types import BenchmarkResult
+
+
+def _worker_main(
+    conn,
+    test_file_path: str,
+    function_name: str,
+    sys_path: List[str],
+    cores: List[int],
+    corpus_dir: Optional[str] = None,
+):
+    """Entry point of a pool worker.
+
+    Imports the test module (and with it the original function and its dependencies) once,
+    then benchmarks every candidate it receives over the pipe against that module.
+    The recorded calls in `corpus_dir` are loaded once as well, memory-mapped.
+    """
+    for path in sys_path:
+        if path not in sys.path:
+            sys.path.append(path)
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, set(cores))
+
+    try:
+        test_module = import_module_from_file(test_file_path)
+        original_function = getattr(test_module, function_name)
+        corpus = load_corpus(corpus_dir) if corpus_dir else None
+    except Exception as e:
+        conn.send(("error", (repr(e), None)))
+        return
+    conn.send(("ready", None))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message[0] == "stop":
+            return
+
+        _, replacement_function_path, config = message
+        try:
+            replacement_module = import_module_from_file(replacement_function_path)
+            setattr(test_module, function_name, getattr(replacement_module, function_name))
+            result = benchmark_test_module(
+                test_module, Path(replacement_function_path).stem, config, corpus, function_name
+            )
+            conn.send(("ok", result))
+        except FaultyTestError as e:
+            conn.send(("error", (str(e), e.test_name)))
+        except Exception as e:
+            conn.send(("error", (repr(e), None)))
+        finally:
+            setattr(test_module, function_name, original_function)
+
+
+class _Worker:
+    def __init__(
+        self, ctx, test_file_path: str, function_name: str, core: int, corpus_dir: Optional[str] = None
+    ):
+        self.core = core
+        self.tasks = 0
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, test_file_path, function_name, list(sys.path), [core], corpus_dir),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def receive(self, timeout: Optional[float]):
+        """Wait for the next message of the worker.
+        Raises BenchmarkCrashedError when the worker died or did not answer in time."""
+        ready = multiprocessing.connection.wait([self.conn, self.process.sentinel], timeout)
+        if self.conn in ready:
+            try:
+                return self.conn.recv()
+            except EOFError:
+                pass
+        if not ready:
+            self.kill()
+            raise BenchmarkCrashedError(f"Benchmark timed out after {timeout} seconds")
+        self.process.join(1)
+        raise BenchmarkCrashedError(
+            f"Benchmark worker exited with code {self.process.exitcode}", self.process.exitcode
+        )
+
+    def stop(self):
+        try:
+            self.conn.send(("stop",))
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class BenchmarkWorkerPool:
+    """Pool of pre-warmed processes that benchmark candidates against a test file.
+
+    Every worker imports the test module once, so the import cost of the tests, the original
+    function and its dependencies (numpy, ...) is paid once per worker instead of once per
+    candidate. Candidates are handed to a worker as the path of their pyx file. A worker that
+    crashes (e.g. segfaults in a candidate) is replaced and the candidate is reported as crashed.
+    Workers are recycled after `max_tasks_per_worker` candidates, since extension modules
+    can never be unloaded.
+    """
+
+    def __init__(
+        self,
+        test_file_path: Union[str, Path],
+        function_name: str,
+        cores: Optional[List[int]] = None,
+        timeout: float = 5,
+        startup_timeout: float = 60,
+        max_tasks_per_worker: int = 50,
+        start_method: Optional[str] = None,
+        corpus_dir: Optional[Union[str, Path]] = None,
+    ):
+        """
+        Args:
+            test_file_path (Union[str, Path]): Path to the test file.
+            function_name (str): Name of the function to replace in the test module.
+            cores (List[int], optional): One worker is started per core and pinned to it.
+                Defaults to a single core of this machine.
+            timeout (float): Maximum runtime of a single benchmark in seconds.
+            startup_timeout (float): Maximum time a worker may take to import the tests.
+            max_tasks_per_worker (int): Number of candidates after which a worker is replaced.
+            start_method (str, optional): Multiprocessing start method, defaults to forkserver where available.
+            corpus_dir (Union[str, Path], optional): Recorded calls to replay as an extra benchmark, see capture.
+        """
+        self.test_file_path = str(test_file_path)
+        self.function_name = function_name
+        self.cores = cores or available_cores()[:1]
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.corpus_dir = str(corpus_dir) if corpus_dir else None
+        if start_method is None:
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._ctx = multiprocessing.get_context(start_method)
+        if start_method == "forkserver":
+            self._ctx.set_forkserver_preload(["pyoptimaizer.runner"])
+        # per-candidate time spent outside of the actual timing, in seconds
+        self.overheads: List[float] = []
+        # every core is a slot, holding its worker or None when the worker has to be (re)started
+        self._idle: "queue.Queue[Tuple[int, Optional[_Worker]]]" = queue.Queue()
+        # start all workers first, so they import the tests concurrently
+        workers = [self._start_worker(core) for core in self.cores]
+        for worker in workers:
+            self._idle.put((worker.core, self._wait_until_ready(worker)))
+        self._closed = False
+
+    def _start_worker(self, core: int) -> _Worker:
+        return _Worker(self._ctx, self.test_file_path, self.function_name, core, self.corpus_dir)
+
+    def _wait_until_ready(self, worker: _Worker) -> Optional[_Worker]:
+        try:
+            status, payload = worker.receive(self.startup_timeout)
+        except BenchmarkCrashedError:
+            logger.exception("Benchmark worker crashed while importing the tests")
+            return None
+        if status != "ready":
+            logger.error(f"Benchmark worker could not import the tests: {payload[0]}")
+            worker.kill()
+            return None
+        return worker
+
+    def _take_worker(self) -> _Worker:
+        core, worker = self._idle.get()
+        if worker is None or not worker.process.is_alive() or worker.tasks >= self.max_tasks_per_worker:
+            if worker is not None:
+                worker.stop()
+            worker = self._wait_until_ready(self._start_worker(core))
+            if worker is None:
+                # put the slot back, so the pool does not shrink
+                self._idle.put((core, None))
+                raise BenchmarkCrashedError("Could not start a benchmark worker")
+        return worker
+
+    def benchmark(
+        self, replacement_function_path: Union[str, Path], config: Optional[BenchmarkConfig] = None
+    ) -> BenchmarkResult:
+        """Benchmark a candidate on the first idle worker, blocking until it is done."""
+        worker = self._take_worker()
+        start = time.perf_counter()
+        try:
+            worker.tasks += 1
+            worker.conn.send(("benchmark", str(replacement_function_path), config))
+            status, payload = worker.receive(self.timeout)
+        except BenchmarkCrashedError:
+            logger.error(f"Benchmark worker crashed on {Path(replacement_function_path).name}, replacing it")
+            worker.kill()
+            self._idle.put((worker.core, None))
+            raise
+        self._idle.put((worker.core, worker))
+
+        if status == "error":
+            message, test_name = payload
+            if test_name is not None:
+                raise FaultyTestError(test_name, Path(replacement_function_path).stem)
+            raise BenchmarkCrashedError(message)
+
+        self.overheads.append(time.perf_counter() - start - payload.duration_s)
+        return payload
+
+    def submit(
+        self, replacement_function_path: Union[str, Path], config: Optional[BenchmarkConfig] = None
+    ) -> Future:
+        """Benchmark a candidate in the background, see `benchmark`."""
+        future: Future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(self.benchmark(replacement_function_path, config))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+    @property
+    def mean_overhead_s(self) -> Optional[float]:
+        return statistics.mean(self.overheads) if self.overheads else None
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        while True:
+            try:
+                _, worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if worker is not None:
+                worker.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def measure_dispatch_overhead(
+    test_file_path: Union[str, Path],
+    replacement_function_path: Union[str, Path],
+    function_name: str,
+    candidates: int = 5,
+    config: Optional[BenchmarkConfig] = None,
+) -> Dict[str, float]:
+    """Measure the mean per-candidate overhead (everything but the timing itself) of
+    spawning a process per candidate versus dispatching to a pre-warmed worker pool.
+
+    Returns:
+        Dict[str, float]: Mean overhead in seconds per model, keyed "spawn" and "pool".
+    """
+    config = config or BenchmarkConfig(repeats=3, min_sample_time_s=0.001)
+    cores = available_cores()[:1]
+
+    spawn_overheads = []
+    scheduler = BenchmarkScheduler(cores, timeout=60)
+    for _ in range(candidates):
+        start = time.perf_counter()
+        result = scheduler.submit(
+            run_test_file_with_replacement_function,
+            test_file_path,
+            replacement_function_path,
+            function_name,
+            config,
+        ).result()
+        spawn_overheads.append(time.perf_counter() - start - result.duration_s)
+    scheduler.shutdown()
+
+    with BenchmarkWorkerPool(test_file_path, function_name, cores, timeout=60) as pool:
+        for _ in range(candidates):
+            pool.benchmark(replacement_function_path, config)
+        pool_overhead = pool.mean_overhead_s
+
+    overheads = {"spawn": statistics.mean(spawn_overheads), "pool": pool_overhead}
+    logger.info(
+        f"Per-candidate overhead: spawn {overheads['spawn'] * 1000:.1f}ms, "
+        f"worker pool {overheads['pool'] * 1000:.1f}ms"
+    )
+    return overheads